@@ -0,0 +1,302 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the overhead of Failsafe per call.
+
+Each benchmark runs a call in a loop, several times, and keeps the fastest run to leave out the noise of
+other processes. Asynchronous benchmarks are compared to a bare `await` of the same operation.
+
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --compare results.json --threshold 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+from datetime import timedelta
+
+from failsafe import (
+    Failsafe, FallbackFailsafe, CircuitBreaker, FailureRateCircuitBreaker, RetryPolicy, Backoff, Delay,
+    FullJitterBackoff, DecorrelatedJitterBackoff, CircuitOpen,
+)
+
+
+async def succeeding_operation(*args):
+    pass
+
+
+def create_flaky_operation():
+    """
+    Returns an operation failing every other call, so that every Failsafe call is retried once.
+    """
+    state = {'calls': 0}
+
+    async def operation(*args):
+        state['calls'] += 1
+        if state['calls'] % 2:
+            raise ValueError()
+
+    return operation
+
+
+def create_fallback_operation():
+    """
+    Returns an operation failing for the first fallback option, so that every call falls back to the second.
+    """
+    async def operation(option):
+        if option == 'primary':
+            raise ValueError()
+
+    return operation
+
+
+def bare_await():
+    return succeeding_operation
+
+
+def failsafe_success():
+    failsafe = Failsafe()
+    return lambda: failsafe.run(succeeding_operation)
+
+
+def failsafe_circuit_breaker_success():
+    failsafe = Failsafe(circuit_breaker=CircuitBreaker())
+    return lambda: failsafe.run(succeeding_operation)
+
+
+def failsafe_failure_rate_circuit_breaker_success():
+    failsafe = Failsafe(circuit_breaker=FailureRateCircuitBreaker())
+    return lambda: failsafe.run(succeeding_operation)
+
+
+def failsafe_retry():
+    failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1), circuit_breaker=CircuitBreaker(1000000))
+    operation = create_flaky_operation()
+    return lambda: failsafe.run(operation)
+
+
+def failsafe_circuit_open():
+    circuit_breaker = CircuitBreaker(reset_timeout_seconds=1000000)
+    circuit_breaker.open()
+    failsafe = Failsafe(circuit_breaker=circuit_breaker)
+
+    async def call():
+        try:
+            await failsafe.run(succeeding_operation)
+        except CircuitOpen:
+            pass
+
+    return call
+
+
+def fallback_failsafe_success():
+    fallback_failsafe = FallbackFailsafe(['primary', 'secondary'])
+    return lambda: fallback_failsafe.run(succeeding_operation)
+
+
+def fallback_failsafe_fallback():
+    fallback_failsafe = FallbackFailsafe(['primary', 'secondary'],
+                                         retry_policy_factory=lambda option: RetryPolicy(allowed_retries=0),
+                                         circuit_breaker_factory=lambda option: CircuitBreaker(1000000))
+    return lambda: fallback_failsafe.run(create_fallback_operation())
+
+
+def circuit_breaker_open_close():
+    circuit_breaker = CircuitBreaker()
+
+    def transition():
+        circuit_breaker.open()
+        circuit_breaker.close()
+
+    return transition
+
+
+def circuit_breaker_half_open_close():
+    circuit_breaker = CircuitBreaker()
+
+    def transition():
+        circuit_breaker.half_open()
+        circuit_breaker.close()
+
+    return transition
+
+
+def circuit_breaker_record_success():
+    return CircuitBreaker().record_success
+
+
+def circuit_breaker_record_failure():
+    circuit_breaker = CircuitBreaker(maximum_failures=2 ** 62)
+    return circuit_breaker.record_failure
+
+
+def backoff_for_attempt():
+    backoff = Backoff(timedelta(seconds=0.1), timedelta(seconds=10))
+    return lambda: backoff.for_attempt(3)
+
+
+def backoff_with_jitter_for_attempt():
+    backoff = Backoff(timedelta(seconds=0.1), timedelta(seconds=10), jitter=True)
+    return lambda: backoff.for_attempt(3)
+
+
+def delay_for_attempt():
+    delay = Delay(timedelta(seconds=0.1))
+    return lambda: delay.for_attempt(3)
+
+
+def full_jitter_backoff_for_attempt():
+    backoff = FullJitterBackoff(timedelta(seconds=0.1), timedelta(seconds=10))
+    return lambda: backoff.for_attempt(3)
+
+
+def decorrelated_jitter_backoff_for_attempt():
+    backoff = DecorrelatedJitterBackoff(timedelta(seconds=0.1), timedelta(seconds=10))
+    return lambda: backoff.for_attempt_after(3, 0.5)
+
+
+ASYNC_BENCHMARKS = [
+    bare_await,
+    failsafe_success,
+    failsafe_circuit_breaker_success,
+    failsafe_failure_rate_circuit_breaker_success,
+    failsafe_retry,
+    failsafe_circuit_open,
+    fallback_failsafe_success,
+    fallback_failsafe_fallback,
+]
+
+SYNC_BENCHMARKS = [
+    circuit_breaker_open_close,
+    circuit_breaker_half_open_close,
+    circuit_breaker_record_success,
+    circuit_breaker_record_failure,
+    backoff_for_attempt,
+    backoff_with_jitter_for_attempt,
+    delay_for_attempt,
+    full_jitter_backoff_for_attempt,
+    decorrelated_jitter_backoff_for_attempt,
+]
+
+
+async def _time_async(call, iterations):
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        await call()
+    return time.perf_counter() - started_at
+
+
+def _time_sync(call, iterations):
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    return time.perf_counter() - started_at
+
+
+def run_benchmarks(iterations=20000, repeat=5, loop=None):
+    """
+    Runs every benchmark and returns the fastest time per call of each in nanoseconds,
+    along with the overhead compared to a bare `await` for asynchronous benchmarks.
+    """
+    loop = loop or asyncio.get_event_loop()
+    results = {}
+
+    for benchmark in ASYNC_BENCHMARKS:
+        call = benchmark()
+        seconds = min(loop.run_until_complete(_time_async(call, iterations)) for _ in range(repeat))
+        results[benchmark.__name__] = {'ns_per_call': seconds / iterations * 1e9}
+
+    bare_ns = results['bare_await']['ns_per_call']
+    for benchmark in ASYNC_BENCHMARKS:
+        results[benchmark.__name__]['overhead_ns'] = results[benchmark.__name__]['ns_per_call'] - bare_ns
+
+    for benchmark in SYNC_BENCHMARKS:
+        call = benchmark()
+        seconds = min(_time_sync(call, iterations) for _ in range(repeat))
+        results[benchmark.__name__] = {'ns_per_call': seconds / iterations * 1e9}
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': iterations,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold, min_difference_ns=0):
+    """
+    Returns the names of the benchmarks slower than in the baseline by more than `threshold`,
+    0.1 meaning 10% slower, and by more than `min_difference_ns` so that the noise of the
+    fastest benchmarks is not reported.
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            continue
+        baseline_ns = baseline['results'][name]['ns_per_call']
+        if result['ns_per_call'] > baseline_ns * (1 + threshold) + min_difference_ns:
+            regressions.append(name)
+    return regressions
+
+
+def format_results(current, baseline=None):
+    lines = ['{:<48} {:>12} {:>12} {:>10}'.format('benchmark', 'ns/call', 'overhead ns', 'change')]
+    for name, result in current['results'].items():
+        overhead = result.get('overhead_ns')
+        change = ''
+        if baseline is not None and name in baseline['results']:
+            change = '{:+.1%}'.format(result['ns_per_call'] / baseline['results'][name]['ns_per_call'] - 1)
+        lines.append('{:<48} {:>12.0f} {:>12} {:>10}'.format(
+            name, result['ns_per_call'], '' if overhead is None else '{:.0f}'.format(overhead), change))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000, help='calls per run of a benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each benchmark, the fastest being kept')
+    parser.add_argument('--output', help='file to save the results to as JSON')
+    parser.add_argument('--compare', help='JSON file of baseline results to compare to')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown compared to the baseline failing the comparison, 0.1 meaning 10%%')
+    parser.add_argument('--min-difference-ns', type=float, default=100,
+                        help='slowdown in nanoseconds per call under which the comparison does not fail')
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.iterations, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print(format_results(current, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(current, output_file, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(baseline, current, args.threshold, args.min_difference_ns)
+        if regressions:
+            print('Slower than the baseline by more than {:.0%}: {}'.format(args.threshold, ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
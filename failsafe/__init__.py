@@ -1,10 +1,25 @@
-from .failsafe import Failsafe, FailsafeError, CircuitOpen, RetriesExhausted  # noqa
-from .circuit_breaker import CircuitBreaker  # noqa
-from .retry_policy import RetryPolicy, Delay, Backoff  # noqa
-from .fallback_failsafe import FallbackFailsafe, FallbacksExhausted  # noqa
+from .failsafe import Failsafe, FailsafeError, CircuitOpen, RetriesExhausted, AttemptTimeout, TimeoutExceeded  # noqa
+from .circuit_breaker import CircuitBreaker, FailureRateCircuitBreaker  # noqa
+from .circuit_breaker_registry import CircuitBreakerRegistry  # noqa
+from .circuit_breaker_backend import StateBackend, SharedState, InMemoryStateBackend, RedisStateBackend  # noqa
+from .shared_circuit_breaker import SharedCircuitBreaker  # noqa
+from .retry_policy import (  # noqa
+    RetryPolicy, RetryBudget, Delay, Backoff, FullJitterBackoff, EqualJitterBackoff, DecorrelatedJitterBackoff,
+    get_retry_after, parse_retry_after,
+)
+from .hedge_policy import HedgePolicy  # noqa
+from .bulkhead import Bulkhead, BulkheadFull  # noqa
+from .adaptive_bulkhead import AdaptiveBulkhead, AIMDLimit, GradientLimit  # noqa
+from .rate_limiter import RateLimiter, RateLimitExceeded  # noqa
+from .adaptive_throttle import AdaptiveThrottle, RequestThrottled  # noqa
+from .result_cache import ResultCache  # noqa
+from .metrics import FailsafeMetrics, LatencyHistogram, prometheus_text  # noqa
+from .events import Event, AsyncEventQueue  # noqa
+from .deadline import deadline_at, deadline_after, get_deadline  # noqa
+from .fallback_failsafe import FallbackFailsafe, FallbacksExhausted, OptionHealth  # noqa
 
 import logging
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
 
-__version__ = '0.6.0'
+__version__ = '0.7.0'
@@ -1,4 +1,5 @@
 import logging
+import weakref
 
 logger = logging.getLogger(__name__)
 
@@ -7,8 +8,34 @@ def _do_nothing(*args):
     pass
 
 
-def _safe_call(callable):
+def _safe_call(callable, *args):
     try:
-        callable()
+        callable(*args)
     except Exception:
         logger.exception("Exception caught!")
+
+
+def _is_open(circuit_breaker):
+    # circuit breakers written before `is_open` was added are never seen open
+    is_open = getattr(circuit_breaker, 'is_open', None)
+    return is_open is not None and is_open()
+
+
+def _notify(listeners, state):
+    for listener in listeners:
+        _safe_call(listener, state)
+
+
+def _add_weak_transition_listener(circuit_breaker, method):
+    """
+    Adds the bound `method` as a transition listener of the circuit breaker, held by a weak reference
+    and removed once its object is garbage collected, so that the objects observing a shared circuit
+    breaker do not accumulate in it.
+    """
+    def listener(state):
+        bound_method = reference()
+        if bound_method is not None:
+            bound_method(state)
+
+    reference = weakref.WeakMethod(method, lambda _: circuit_breaker.remove_transition_listener(listener))
+    circuit_breaker.add_transition_listener(listener)
@@ -0,0 +1,163 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import math
+import time
+
+from failsafe.bulkhead import Bulkhead
+
+logger = logging.getLogger(__name__)
+
+# round trip times are clamped to this minimum, so that their ratios are defined for instant executions
+_MIN_RTT_SECONDS = 1e-6
+
+
+class Limit:
+    """
+    Base class for the algorithms learning the concurrency limit of a downstream from the
+    round trip times of the executions. Subclasses should override the `_new_limit` method.
+    """
+
+    def __init__(self, initial_limit, min_limit, max_limit, history_size):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._limit = float(initial_limit)
+        self.history = collections.deque([(time.monotonic(), int(initial_limit))], maxlen=history_size)
+
+    @property
+    def current_limit(self):
+        """
+        The current concurrency limit.
+        """
+        return int(self._limit)
+
+    def update(self, rtt_seconds, in_flight, dropped):
+        """
+        Updates the limit with a sample.
+
+        :param rtt_seconds: round trip time of the execution.
+        :param in_flight: number of executions in flight when the execution completed, including itself.
+        :param dropped: whether the execution was dropped by the downstream, e.g. it timed out.
+        """
+        previous_limit = self.current_limit
+        new_limit = self._new_limit(rtt_seconds, in_flight, dropped)
+        self._limit = min(self.max_limit, max(self.min_limit, new_limit))
+
+        if self.current_limit != previous_limit:
+            logger.debug("Concurrency limit changed to {}".format(self.current_limit))
+            self.history.append((time.monotonic(), self.current_limit))
+
+    def _new_limit(self, rtt_seconds, in_flight, dropped):
+        raise NotImplementedError()
+
+
+class AIMDLimit(Limit):
+    """
+    Additive increase, multiplicative decrease limit. The limit grows by one for every sample
+    taken while at least half of it is used, and is multiplied by `backoff_ratio` when an execution
+    is dropped or slower than `rtt_threshold_seconds`.
+    """
+
+    def __init__(self, initial_limit=20, min_limit=1, max_limit=200, backoff_ratio=0.9,
+                 rtt_threshold_seconds=None, history_size=100):
+        """
+        :param rtt_threshold_seconds: round trip time above which an execution is treated as dropped.
+            If None, only dropped executions decrease the limit.
+        :param history_size: number of limit changes kept in `history`.
+        """
+        super(AIMDLimit, self).__init__(initial_limit, min_limit, max_limit, history_size)
+        self.backoff_ratio = backoff_ratio
+        self.rtt_threshold_seconds = rtt_threshold_seconds
+
+    def _new_limit(self, rtt_seconds, in_flight, dropped):
+        if dropped or (self.rtt_threshold_seconds is not None and rtt_seconds > self.rtt_threshold_seconds):
+            return self._limit * self.backoff_ratio
+        if in_flight * 2 >= self._limit:
+            return self._limit + 1
+        return self._limit
+
+
+class GradientLimit(Limit):
+    """
+    Limit following the gradient between a long term and a short term average of the round trip
+    times, the way Netflix's Gradient2 limit does. When the short term average rises above the long
+    term one - requests start queueing in the downstream - the limit decreases proportionally.
+    Otherwise it grows by the square root of the limit, which is the allowed queue size.
+    """
+
+    def __init__(self, initial_limit=20, min_limit=1, max_limit=200, smoothing=0.2, rtt_tolerance=1.5,
+                 short_window=10, long_window=600, history_size=100):
+        """
+        :param smoothing: weight of the new limit in the smoothed limit, between 0 and 1.
+        :param rtt_tolerance: tolerated ratio between the short and long term round trip times
+            before the limit is decreased.
+        :param short_window: number of samples of the short term average.
+        :param long_window: number of samples of the long term average.
+        :param history_size: number of limit changes kept in `history`.
+        """
+        super(GradientLimit, self).__init__(initial_limit, min_limit, max_limit, history_size)
+        self.smoothing = smoothing
+        self.rtt_tolerance = rtt_tolerance
+        self._short_factor = 2 / (short_window + 1)
+        self._long_factor = 2 / (long_window + 1)
+        self._short_rtt = None
+        self._long_rtt = None
+
+    def _new_limit(self, rtt_seconds, in_flight, dropped):
+        rtt_seconds = max(rtt_seconds, _MIN_RTT_SECONDS)
+        if self._short_rtt is None:
+            self._short_rtt = self._long_rtt = rtt_seconds
+        self._short_rtt += (rtt_seconds - self._short_rtt) * self._short_factor
+        self._long_rtt += (rtt_seconds - self._long_rtt) * self._long_factor
+
+        # recover faster from a long period of high latency
+        if self._long_rtt / self._short_rtt > 2:
+            self._long_rtt *= 0.95
+
+        # the limit cannot be probed when it is not used
+        if in_flight < self._limit / 2:
+            return self._limit
+
+        gradient = max(0.5, min(1.0, self.rtt_tolerance * self._long_rtt / self._short_rtt))
+        new_limit = self._limit * gradient + math.sqrt(self._limit)
+        return self._limit * (1 - self.smoothing) + new_limit * self.smoothing
+
+
+class AdaptiveBulkhead(Bulkhead):
+    """
+    A Bulkhead whose concurrency limit is learned from the round trip times of the executions
+    by a :class:`Limit` algorithm, instead of being fixed.
+    """
+
+    def __init__(self, limit=None, max_queued_calls=0, max_queue_time_seconds=None,
+                 queue_delay_target_seconds=None, queue_delay_interval_seconds=0.1, on_reject=None):
+        """
+        Constructs AdaptiveBulkhead.
+
+        :param limit: :class:`Limit` algorithm, :class:`AIMDLimit` by default.
+        The remaining parameters are the same as the ones of :class:`failsafe.Bulkhead`.
+        """
+        super(AdaptiveBulkhead, self).__init__(
+            max_concurrent_calls=None, max_queued_calls=max_queued_calls, max_queue_time_seconds=max_queue_time_seconds,
+            queue_delay_target_seconds=queue_delay_target_seconds,
+            queue_delay_interval_seconds=queue_delay_interval_seconds, on_reject=on_reject)
+        self.limit = limit or AIMDLimit()
+
+    def _limit(self):
+        return self.limit.current_limit
+
+    def release(self, rtt_seconds=None, dropped=False):
+        if rtt_seconds is not None:
+            self.limit.update(rtt_seconds, self.in_flight, dropped)
+        super(AdaptiveBulkhead, self).release(rtt_seconds, dropped)
@@ -0,0 +1,137 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+
+from failsafe._internal import _do_nothing, _safe_call
+from failsafe.circuit_breaker import _TimeWindow
+from failsafe.failsafe import FailsafeError
+
+logger = logging.getLogger(__name__)
+
+
+class RequestThrottled(FailsafeError):
+    pass
+
+
+class AdaptiveThrottle:
+    """
+    AdaptiveThrottle rejects executions locally when the downstream rejects many of them, as
+    described in the chapter "Handling Overload" of the Google SRE book. It counts the requests
+    made and the requests accepted by the downstream over the last `window_seconds`, and rejects
+    executions with the probability `max(0, (requests - k * accepts) / (requests + 1))`.
+
+    While the downstream accepts everything, nothing is rejected until requests exceed `k` times
+    the accepts. Beyond that, the rejected fraction grows with the overload, so that the requests
+    reaching the downstream stay close to what it can accept. Requests rejected locally are counted
+    as requests not accepted. Counters are kept in one bucket per second.
+    """
+
+    def __init__(self, k=2.0, window_seconds=120, rejection_exceptions=None, seed=None, on_reject=None):
+        """
+        Constructs AdaptiveThrottle.
+
+        :param k: multiplier of the accepts over which requests are rejected. Lower values reject more
+            aggressively, 2 letting through about twice the requests the downstream accepts.
+        :param window_seconds: length of the window over which requests and accepts are counted.
+        :param rejection_exceptions: list of exception types meaning that the downstream rejected the
+            request, e.g. because it is overloaded. If None, every exception counts as a rejection.
+        :param seed: seed of the random number generator of this throttle, to make rejections reproducible.
+            If None, the global generator of the `random` module is used.
+        :param on_reject: callable that will be invoked when an execution is rejected
+        """
+        if k < 1:
+            raise ValueError("`k` must be at least 1.")
+        if window_seconds < 1:
+            raise ValueError("`window_seconds` must be at least 1.")
+
+        self.k = k
+        self.window_seconds = window_seconds
+        self.rejection_exceptions = rejection_exceptions
+        self.random = random if seed is None else random.Random(seed)
+
+        self.on_reject = on_reject or _do_nothing
+
+        # the failures of the window are the requests not accepted
+        self._window = _TimeWindow(window_seconds)
+
+    @property
+    def requests(self):
+        """
+        Requests counted over the window, those rejected locally included.
+        """
+        self._window.expire()
+        return self._window.total
+
+    @property
+    def accepts(self):
+        """
+        Requests accepted by the downstream over the window.
+        """
+        self._window.expire()
+        return self._window.total - self._window.failures
+
+    @property
+    def rejection_probability(self):
+        """
+        The probability with which an execution is currently rejected.
+        """
+        window = self._window
+        window.expire()
+        requests = window.total
+        accepts = requests - window.failures
+        return max(0.0, (requests - self.k * accepts) / (requests + 1))
+
+    def try_acquire(self):
+        """
+        Returns a boolean indicating whether an execution is allowed. A rejected execution is counted as
+        a request not accepted, an allowed one should be followed by `record_accept` or `record_rejection`.
+        """
+        rejection_probability = self.rejection_probability
+        if rejection_probability > 0 and self.random.random() < rejection_probability:
+            self._window.record(True)
+            return False
+        return True
+
+    def acquire(self):
+        """
+        Allows an execution or rejects it.
+
+        :raises: RequestThrottled when the execution is rejected.
+        """
+        if not self.try_acquire():
+            logger.debug("Throttling execution")
+            _safe_call(self.on_reject)
+            raise RequestThrottled()
+
+    def record_accept(self):
+        """
+        Records a request accepted by the downstream.
+        """
+        self._window.record(False)
+
+    def record_rejection(self):
+        """
+        Records a request rejected by the downstream.
+        """
+        self._window.record(True)
+
+    def record_exception(self, exception):
+        """
+        Records a request which raised `exception`, rejected by the downstream if the exception is one of
+        `rejection_exceptions`, accepted otherwise.
+        """
+        if self.rejection_exceptions is None or any(isinstance(exception, e) for e in self.rejection_exceptions):
+            self.record_rejection()
+        else:
+            self.record_accept()
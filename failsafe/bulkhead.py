@@ -0,0 +1,162 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import logging
+import time
+
+from failsafe._internal import _do_nothing, _safe_call
+from failsafe.failsafe import FailsafeError
+
+logger = logging.getLogger(__name__)
+
+
+class BulkheadFull(FailsafeError):
+    pass
+
+
+class Bulkhead:
+    """
+    Bulkhead limits the number of concurrent executions. Executions over the limit wait in a
+    bounded queue for a permit, and are rejected when the queue is full or they have waited for
+    longer than `max_queue_time_seconds`.
+
+    When `queue_delay_target_seconds` is set, the bulkhead also sheds load the way CoDel does:
+    once the queueing delay has stayed above the target for `queue_delay_interval_seconds`, new
+    executions which would have to wait are rejected until the delay drops below the target again.
+    """
+
+    def __init__(self, max_concurrent_calls=10, max_queued_calls=0, max_queue_time_seconds=None,
+                 queue_delay_target_seconds=None, queue_delay_interval_seconds=0.1, on_reject=None):
+        """
+        Constructs Bulkhead.
+
+        :param max_concurrent_calls: maximum number of executions running at the same time.
+        :param max_queued_calls: maximum number of executions waiting for a permit. 0 means
+            executions over the limit are rejected immediately.
+        :param max_queue_time_seconds: maximum time an execution waits for a permit. If None,
+            executions wait until a permit is available.
+        :param queue_delay_target_seconds: acceptable queueing delay. If None, load is not shed
+            based on the queueing delay.
+        :param queue_delay_interval_seconds: how long the queueing delay has to stay above
+            `queue_delay_target_seconds` before load is shed.
+        :param on_reject: callable that will be invoked when an execution is rejected
+        """
+        self.max_concurrent_calls = max_concurrent_calls
+        self.max_queued_calls = max_queued_calls
+        self.max_queue_time_seconds = max_queue_time_seconds
+        self.queue_delay_target_seconds = queue_delay_target_seconds
+        self.queue_delay_interval_seconds = queue_delay_interval_seconds
+
+        self.on_reject = on_reject or _do_nothing
+
+        self.in_flight = 0
+        self._waiters = collections.deque()
+        self._above_target_since = None
+        self._shedding = False
+
+    @property
+    def queued(self):
+        """
+        Number of executions currently waiting for a permit.
+        """
+        return len(self._waiters)
+
+    def _limit(self):
+        return self.max_concurrent_calls
+
+    def try_acquire(self):
+        """
+        Returns a boolean indicating whether a permit is available right now, without queueing, and takes
+        it if so. A permit taken must be returned with `release`.
+        """
+        if self.in_flight < self._limit() and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self):
+        """
+        Waits for a permit to execute. Every successful call must be paired with a call to `release`.
+
+        :raises: BulkheadFull when the execution is rejected.
+        """
+        if self.try_acquire():
+            return
+
+        if len(self._waiters) >= self.max_queued_calls or self._shedding:
+            self._reject("Bulkhead full, rejecting execution")
+
+        waiter = [asyncio.get_event_loop().create_future(), time.monotonic()]
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[0], self.max_queue_time_seconds)
+        except asyncio.TimeoutError:
+            if waiter[0].done() and not waiter[0].cancelled():
+                return
+            self._remove_waiter(waiter)
+            self._reject("Bulkhead queue time exceeded, rejecting execution")
+        except asyncio.CancelledError:
+            if waiter[0].done() and not waiter[0].cancelled():
+                # the permit was handed over just before cancellation, give it back
+                self.release()
+            else:
+                self._remove_waiter(waiter)
+            raise
+
+    def release(self, rtt_seconds=None, dropped=False):
+        """
+        Returns a permit obtained with `acquire`, handing it over to the longest waiting execution if any.
+
+        :param rtt_seconds: duration of the execution, if it completed.
+        :param dropped: whether the execution was dropped by the downstream, e.g. it timed out.
+            Both are ignored by the static bulkhead, and let adaptive bulkheads learn their limit.
+        """
+        self.in_flight -= 1
+        handed_over = False
+        while self._waiters and self.in_flight < self._limit():
+            future, queued_at = self._waiters.popleft()
+            if not future.done():
+                self._record_queue_delay(time.monotonic() - queued_at)
+                self.in_flight += 1
+                future.set_result(None)
+                handed_over = True
+
+        if not handed_over and not self._waiters:
+            self._above_target_since = None
+            self._shedding = False
+
+    def _record_queue_delay(self, delay):
+        if self.queue_delay_target_seconds is None:
+            return
+
+        if delay <= self.queue_delay_target_seconds:
+            self._above_target_since = None
+            self._shedding = False
+        elif self._above_target_since is None:
+            self._above_target_since = time.monotonic()
+        elif time.monotonic() - self._above_target_since >= self.queue_delay_interval_seconds:
+            if not self._shedding:
+                logger.debug("Queueing delay above target, shedding load")
+            self._shedding = True
+
+    def _remove_waiter(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _reject(self, message):
+        logger.debug(message)
+        _safe_call(self.on_reject)
+        raise BulkheadFull(message)
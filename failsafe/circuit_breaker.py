@@ -10,10 +10,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import time
 import logging
+from collections import deque
 
-from failsafe._internal import _do_nothing, _safe_call
+from failsafe._internal import _do_nothing, _notify, _safe_call
 
 logger = logging.getLogger(__name__)
 
@@ -25,22 +27,73 @@ class CircuitBreaker:
     allowed before considering the circuit as open for a period of 60 seconds.
     Additionally, while transitioning from open to closed, it will allow for
     a maximum of n * `half_open_ratio requests` to go through and probe the
-    underlying system.
+    underlying system, or a maximum of `half_open_max_calls` concurrent requests when given.
+    The circuit closes after `half_open_successes` successful probes, and when `slow_start_seconds`
+    is given, the ratio of the executions allowed then rises from `half_open_ratio` to all of them
+    over this period, so that a barely recovered system is not sent all the traffic at once.
 
     The initial state of the CircuitBreaker is closed.
+
+    The state objects are created once and reset on transitions, and whether debug messages are
+    logged is decided at construction, so that recording outcomes allocates nothing.
+
+    With a `state_backend`, the state of the circuit is shared with the other circuit breakers
+    synchronized with the same backend and `state_key`, e.g. in every instance of a service.
+    Decisions are still taken locally: outcomes are counted and sent to the backend every
+    `sync_interval_seconds` by a background task, which opens the circuit when the backend says so.
     """
 
+    _sync = None
+    _transition_listeners = ()
+    open_on_retry_after = False
+
     def __init__(self, maximum_failures=2, reset_timeout_seconds=60, half_open_ratio=0.1,
-                 on_open=None, on_half_open=None, on_close=None):
+                 on_open=None, on_half_open=None, on_close=None, state_backend=None, state_key=None,
+                 sync_interval_seconds=1, half_open_max_calls=None, half_open_successes=1, slow_start_seconds=0,
+                 slow_start_curve='linear', open_on_retry_after=False):
+        """
+        :param state_backend: :class:`failsafe.StateBackend` sharing the state of the circuit.
+        :param state_key: key of the circuit in the backend, required with a `state_backend`.
+        :param sync_interval_seconds: interval between synchronizations with the backend.
+        :param half_open_max_calls: number of probes allowed at the same time while half open. Probes
+            not completed within `reset_timeout_seconds`, e.g. cancelled ones, open the circuit again.
+            If None, `half_open_ratio` of the executions are allowed instead.
+        :param half_open_successes: successful probes needed to close the circuit.
+        :param slow_start_seconds: period over which the ratio of executions allowed after closing
+            rises to all of them.
+        :param slow_start_curve: `linear` or `exponential` rise of the ratio of executions allowed.
+        :param open_on_retry_after: if True, a :class:`failsafe.Failsafe` call failing with an exception
+            asking to retry after some time, see :func:`failsafe.get_retry_after`, opens the circuit until then.
+        """
         self.maximum_failures = maximum_failures
         self.reset_timeout_seconds = reset_timeout_seconds
         self.half_open_ratio = half_open_ratio
+        if half_open_successes < 1:
+            raise ValueError("`half_open_successes` must be at least 1.")
+        if slow_start_curve not in ('linear', 'exponential'):
+            raise ValueError("`slow_start_curve` must be `linear` or `exponential`.")
+        self.half_open_max_calls = half_open_max_calls
+        self.half_open_successes = half_open_successes
+        self.slow_start_seconds = slow_start_seconds
+        self.slow_start_curve = slow_start_curve
+        self.open_on_retry_after = open_on_retry_after
 
         self.on_open = on_open or _do_nothing
         self.on_half_open = on_half_open or _do_nothing
         self.on_close = on_close or _do_nothing
 
-        self.state = _ClosedState(self)
+        self._debug = logger.isEnabledFor(logging.DEBUG)
+        self._closed = self._closed_state()
+        self._open = _OpenState(self)
+        self._half_open = _HalfOpenState(self, half_open_ratio)
+        self._slow_start = _SlowStartState(self, self._closed)
+        self.state = self._closed
+
+        self._sync = None
+        if state_backend is not None:
+            if state_key is None:
+                raise ValueError("`state_key` is required with a `state_backend`.")
+            self._sync = _StateSync(self, state_backend, state_key, sync_interval_seconds)
 
     def allows_execution(self):
         """
@@ -49,17 +102,22 @@ class CircuitBreaker:
         """
         return self.state.allows_execution()
 
-    def record_success(self):
+    def record_success(self, duration_seconds=None):
         """
         Records an execution success.
 
         Should be called when the operation protected by circuit breaker succeeded.
         This will reset counter of consecutive failures. Does nothing if circuit breaker is open.
+
+        :param duration_seconds: how long the execution took, used by circuit breakers tracking slow calls.
         """
-        self.state.record_success()
-        logger.debug("Success recorded")
+        self.state.record_success(duration_seconds)
+        if self._sync is not None:
+            self._sync.record(True)
+        if self._debug:
+            logger.debug("Success recorded")
 
-    def record_failure(self):
+    def record_failure(self, duration_seconds=None):
         """
         Records an execution failure.
 
@@ -67,33 +125,91 @@ class CircuitBreaker:
         If the number of consecutive failures has reached the allowed number of failures,
         changes the state of the CircuitBreaker to open meaning that `allows_execution` will be
         returning false for the configured timeout. Does nothing if circuit breaker is already open.
+
+        :param duration_seconds: how long the execution took, used by circuit breakers tracking slow calls.
         """
-        self.state.record_failure()
-        logger.debug("Failure recorded")
+        self.state.record_failure(duration_seconds)
+        if self._sync is not None:
+            self._sync.record(False)
+        if self._debug:
+            logger.debug("Failure recorded")
+
+    def is_open(self):
+        """
+        Returns a boolean indicating whether the circuit is open and executions are rejected.
+        Unlike `allows_execution`, this never changes the state of the CircuitBreaker.
+        """
+        return self.state.is_open()
 
     def open(self):
         """
         Sets the state of the CircuitBreaker to open
         """
-        self.state = _OpenState(self)
+        self._open.reset()
+        self.state = self._open
         logger.debug("Opened")
         _safe_call(self.on_open)
+        _notify(self._transition_listeners, 'open')
+
+    def add_transition_listener(self, listener):
+        """
+        Adds a callable invoked with the new state, 'open', 'half-open' or 'closed', after every transition
+        of the CircuitBreaker and its `on_open`, `on_half_open` or `on_close` callback. Unlike those callbacks,
+        listeners can be removed, which lets every Failsafe sharing the breaker observe it.
+        """
+        self._transition_listeners = self._transition_listeners + (listener,)
+
+    def remove_transition_listener(self, listener):
+        """
+        Removes a listener added with `add_transition_listener`.
+        """
+        self._transition_listeners = tuple(added for added in self._transition_listeners if added is not listener)
+
+    def release_permit(self):
+        """
+        Gives back the permit taken by `allows_execution` for an execution whose outcome will not be
+        recorded, e.g. because it was aborted or rejected by another policy, so that another probe can
+        be made while the circuit is half open.
+        """
+        if self.state is self._half_open:
+            self._half_open.release()
+
+    def open_for(self, seconds):
+        """
+        Sets the state of the CircuitBreaker to open for `seconds` rather than `reset_timeout_seconds`,
+        e.g. for as long as the underlying system asked. An open circuit stays open for at least `seconds`.
+        """
+        half_open_at = time.monotonic() + seconds
+        if self.state is self._open:
+            self._open.half_open_at = max(self._open.half_open_at, half_open_at)
+            return
+        self.open()
+        self._open.half_open_at = half_open_at
 
     def half_open(self):
         """
         Sets the state of the CircuitBreaker to half open
         """
-        self.state = _HalfOpenState(self, self.half_open_ratio)
+        self._half_open.reset()
+        self.state = self._half_open
         logger.debug("Half opened")
         _safe_call(self.on_half_open)
+        _notify(self._transition_listeners, 'half-open')
 
     def close(self):
         """
         Sets the state of the CircuitBreaker to closed
         """
-        self.state = _ClosedState(self)
+        recovering = self.state is self._half_open or self.state is self._open
+        self._closed.reset()
+        if recovering and self.slow_start_seconds:
+            self._slow_start.reset()
+            self.state = self._slow_start
+        else:
+            self.state = self._closed
         logger.debug("Closed")
         _safe_call(self.on_close)
+        _notify(self._transition_listeners, 'closed')
 
     @property
     def current_state(self):
@@ -104,23 +220,140 @@ class CircuitBreaker:
         """
         return self.state.get_name()
 
+    async def sync_state(self):
+        """
+        Synchronizes the state with the `state_backend` without waiting for the background task.
+        """
+        if self._sync is not None:
+            await self._sync.sync()
+
+    async def stop_state_sync(self):
+        """
+        Sends the outcomes not synchronized yet to the `state_backend` and stops the background task.
+        """
+        if self._sync is not None:
+            await self._sync.stop()
+
+    def _closed_state(self):
+        return _ClosedState(self)
+
+
+class FailureRateCircuitBreaker(CircuitBreaker):
+    """
+    A CircuitBreaker which opens when the rate of failures over a sliding window of recent
+    executions reaches `failure_rate_threshold`, instead of after a number of consecutive failures.
+    The window either holds the outcomes of the last `window_size` executions or of the executions
+    of the last `window_seconds` seconds. The circuit does not open before `minimum_calls` executions
+    have been recorded in the window.
+
+    When `slow_call_duration_seconds` is set, executions taking longer are counted as slow, whether
+    they succeeded or not, and the circuit also opens when the rate of slow executions over the window
+    reaches `slow_call_rate_threshold`.
+
+    Recording an outcome and checking the failure rate take constant time, and the memory used
+    only depends on the size of the window.
+    """
+
+    def __init__(self, failure_rate_threshold=0.5, minimum_calls=10, window_size=100, window_seconds=None,
+                 slow_call_duration_seconds=None, slow_call_rate_threshold=1.0,
+                 reset_timeout_seconds=60, half_open_ratio=0.1, on_open=None, on_half_open=None, on_close=None,
+                 state_backend=None, state_key=None, sync_interval_seconds=1, half_open_max_calls=None,
+                 half_open_successes=1, slow_start_seconds=0, slow_start_curve='linear', open_on_retry_after=False):
+        """
+        :param failure_rate_threshold: failure rate between 0 and 1 at which the circuit opens.
+        :param minimum_calls: number of executions in the window needed before the circuit can open.
+        :param window_size: number of recent executions in the window. Ignored when `window_seconds` is given.
+        :param window_seconds: length in seconds of a time based window, made of one bucket per second.
+        :param slow_call_duration_seconds: duration above which an execution is slow. If None,
+            the duration of the executions is not taken into account.
+        :param slow_call_rate_threshold: slow execution rate between 0 and 1 at which the circuit opens.
+        """
+        if not 0 < failure_rate_threshold <= 1:
+            raise ValueError("`failure_rate_threshold` must be greater than 0 and at most 1.")
+        if not 0 < slow_call_rate_threshold <= 1:
+            raise ValueError("`slow_call_rate_threshold` must be greater than 0 and at most 1.")
+        if window_size < 1:
+            raise ValueError("`window_size` must be at least 1.")
+        if window_seconds is not None and window_seconds < 1:
+            raise ValueError("`window_seconds` must be at least 1.")
+
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.slow_call_duration_seconds = slow_call_duration_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        super(FailureRateCircuitBreaker, self).__init__(
+            reset_timeout_seconds=reset_timeout_seconds, half_open_ratio=half_open_ratio,
+            on_open=on_open, on_half_open=on_half_open, on_close=on_close, state_backend=state_backend,
+            state_key=state_key, sync_interval_seconds=sync_interval_seconds, half_open_max_calls=half_open_max_calls,
+            half_open_successes=half_open_successes, slow_start_seconds=slow_start_seconds,
+            slow_start_curve=slow_start_curve, open_on_retry_after=open_on_retry_after)
+
+    def _closed_state(self):
+        if self.window_seconds is not None:
+            window = _TimeWindow(self.window_seconds)
+        else:
+            window = _CountWindow(self.window_size)
+        return _FailureRateClosedState(self, window)
+
+    @property
+    def failure_rate(self):
+        """
+        Get the failure rate over the current window, or None if the circuit is not closed
+        or no execution was recorded since it closed.
+        """
+        window = getattr(self.state, 'window', None)
+        if window is None:
+            return None
+        window.expire()
+        if window.total == 0:
+            return None
+        return window.failures / window.total
+
+    @property
+    def slow_call_rate(self):
+        """
+        Get the slow execution rate over the current window, or None if the circuit is not closed
+        or no execution was recorded since it closed.
+        """
+        window = getattr(self.state, 'window', None)
+        if window is None:
+            return None
+        window.expire()
+        if window.total == 0:
+            return None
+        return window.slow_calls / window.total
+
+    def _is_slow(self, duration_seconds):
+        return duration_seconds is not None and self.slow_call_duration_seconds is not None and \
+            duration_seconds > self.slow_call_duration_seconds
+
 
 class _ClosedState:
     """
     A status class representing the closed state of a CircuitBreaker.
     """
 
+    __slots__ = ('circuit_breaker', 'current_failures')
+
     def __init__(self, circuit_breaker):
         self.circuit_breaker = circuit_breaker
         self.current_failures = 0
 
+    def reset(self):
+        self.current_failures = 0
+
     def allows_execution(self):
         return True
 
-    def record_success(self):
+    def is_open(self):
+        return False
+
+    def record_success(self, duration_seconds=None):
         self.current_failures = 0
 
-    def record_failure(self):
+    def record_failure(self, duration_seconds=None):
         self.current_failures += 1
         if self.current_failures >= self.circuit_breaker.maximum_failures:
             self.circuit_breaker.open()
@@ -129,26 +362,175 @@ class _ClosedState:
         return 'closed'
 
 
+class _FailureRateClosedState:
+    """
+    A status class representing the closed state of a FailureRateCircuitBreaker.
+    """
+
+    __slots__ = ('circuit_breaker', 'window')
+
+    def __init__(self, circuit_breaker, window):
+        self.circuit_breaker = circuit_breaker
+        self.window = window
+
+    def reset(self):
+        self.window.clear()
+
+    def allows_execution(self):
+        return True
+
+    def is_open(self):
+        return False
+
+    def record_success(self, duration_seconds=None):
+        slow = self.circuit_breaker._is_slow(duration_seconds)
+        self.window.record(False, slow)
+        if slow:
+            self._check_rates()
+
+    def record_failure(self, duration_seconds=None):
+        self.window.record(True, self.circuit_breaker._is_slow(duration_seconds))
+        self._check_rates()
+
+    def _check_rates(self):
+        window = self.window
+        circuit_breaker = self.circuit_breaker
+        if window.total < circuit_breaker.minimum_calls:
+            return
+        if window.failures >= circuit_breaker.failure_rate_threshold * window.total:
+            circuit_breaker.open()
+        elif window.slow_calls >= circuit_breaker.slow_call_rate_threshold * window.total:
+            logger.debug("Slow call rate reached")
+            circuit_breaker.open()
+
+    def get_name(self):
+        return 'closed'
+
+
+class _CountWindow:
+    """
+    Outcomes of the last `size` executions, kept in a ring buffer.
+    """
+
+    __slots__ = ('outcomes', 'slow_outcomes', 'index', 'total', 'failures', 'slow_calls')
+
+    def __init__(self, size):
+        self.outcomes = bytearray(size)
+        self.slow_outcomes = bytearray(size)
+        self.clear()
+
+    def clear(self):
+        self.outcomes[:] = bytes(len(self.outcomes))
+        self.slow_outcomes[:] = bytes(len(self.slow_outcomes))
+        self.index = 0
+        self.total = 0
+        self.failures = 0
+        self.slow_calls = 0
+
+    def record(self, failed, slow=False):
+        size = len(self.outcomes)
+        index = self.index
+        if self.total == size:
+            self.failures -= self.outcomes[index]
+            self.slow_calls -= self.slow_outcomes[index]
+        else:
+            self.total += 1
+        self.outcomes[index] = failed
+        self.slow_outcomes[index] = slow
+        self.failures += failed
+        self.slow_calls += slow
+        self.index = (index + 1) % size
+
+    def expire(self):
+        # outcomes only leave a count window when newer ones are recorded
+        pass
+
+
+class _TimeWindow:
+    """
+    Outcomes of the executions of the last `seconds` seconds, kept in one bucket per second.
+    """
+
+    __slots__ = ('bucket_totals', 'bucket_failures', 'bucket_slow_calls', 'current_second', 'total', 'failures',
+                 'slow_calls')
+
+    def __init__(self, seconds):
+        seconds = int(seconds)
+        self.bucket_totals = [0] * seconds
+        self.bucket_failures = [0] * seconds
+        self.bucket_slow_calls = [0] * seconds
+        self.clear()
+
+    def clear(self):
+        seconds = len(self.bucket_totals)
+        self.bucket_totals[:] = [0] * seconds
+        self.bucket_failures[:] = [0] * seconds
+        self.bucket_slow_calls[:] = [0] * seconds
+        self.current_second = int(time.monotonic())
+        self.total = 0
+        self.failures = 0
+        self.slow_calls = 0
+
+    def record(self, failed, slow=False):
+        self._expire(int(time.monotonic()))
+        index = self.current_second % len(self.bucket_totals)
+        self.bucket_totals[index] += 1
+        self.bucket_failures[index] += failed
+        self.bucket_slow_calls[index] += slow
+        self.total += 1
+        self.failures += failed
+        self.slow_calls += slow
+
+    def expire(self):
+        """
+        Forgets the outcomes older than the window, so that the totals can be read.
+        """
+        self._expire(int(time.monotonic()))
+
+    def _expire(self, now):
+        # every bucket is cleared at most once per second, so this is constant time amortized
+        size = len(self.bucket_totals)
+        for second in range(max(self.current_second, now - size) + 1, now + 1):
+            index = second % size
+            self.total -= self.bucket_totals[index]
+            self.failures -= self.bucket_failures[index]
+            self.slow_calls -= self.bucket_slow_calls[index]
+            self.bucket_totals[index] = 0
+            self.bucket_failures[index] = 0
+            self.bucket_slow_calls[index] = 0
+        self.current_second = max(self.current_second, now)
+
+
 class _OpenState:
     """
     A status class representing the open state of a CircuitBreaker
     """
 
+    __slots__ = ('circuit_breaker', 'opened_at', 'half_open_at')
+
     def __init__(self, circuit_breaker):
         self.circuit_breaker = circuit_breaker
+        self.reset()
+
+    def reset(self):
         self.opened_at = time.monotonic()
+        self.half_open_at = self.opened_at + self.circuit_breaker.reset_timeout_seconds
 
     def allows_execution(self):
-        if time.monotonic() > self.opened_at + self.circuit_breaker.reset_timeout_seconds:
+        if time.monotonic() > self.half_open_at:
             self.circuit_breaker.half_open()
-            return True
+            # the execution half opening the circuit is a probe like the others
+            return self.circuit_breaker._half_open.allows_execution()
 
         return False
 
-    def record_success(self):
+    def is_open(self):
+        return time.monotonic() <= self.half_open_at
+
+    def record_success(self, duration_seconds=None):
         pass
 
-    def record_failure(self):
+    def record_failure(self, duration_seconds=None):
         pass
 
     def get_name(self):
@@ -158,32 +540,224 @@ class _OpenState:
 class _HalfOpenState:
     """
     A status class representing the half open state of a CircuitBreaker. The half-open state
-    allows for up to n * `half_open_ratio` requests to go through in order to check whether the
-    underlying system has recovered or not. The first request that finishes successfully will
-    close the circuit - or open it back if it fails instead.
+    allows for up to n * `half_open_ratio` requests, or `half_open_max_calls` concurrent requests,
+    to go through in order to check whether the underlying system has recovered or not. The circuit
+    closes once `half_open_successes` requests finished successfully, or opens back if one fails.
+
+    The permits of the concurrent requests are the times they were granted, oldest first. Outcomes
+    of executions started before the circuit half opened held no permit and do not release one.
     """
 
+    __slots__ = ('circuit_breaker', 'attempts', 'half_open_ratio', 'permits', 'successes', 'half_opened_at')
+
     def __init__(self, circuit_breaker, half_open_ratio):
         self.circuit_breaker = circuit_breaker
         self.attempts = 0
         self.half_open_ratio = half_open_ratio
+        self.permits = deque()
+        self.successes = 0
+        self.half_opened_at = 0.0
+
+    def reset(self):
+        self.attempts = 0
+        self.half_open_ratio = self.circuit_breaker.half_open_ratio
+        self.permits.clear()
+        self.successes = 0
+        self.half_opened_at = time.monotonic()
 
     def allows_execution(self):
-        self.attempts += 1
-        if self.attempts % 100 < 100 * self.half_open_ratio:
+        circuit_breaker = self.circuit_breaker
+        if circuit_breaker.half_open_max_calls is None:
+            self.attempts += 1
+            if self.attempts % 100 < 100 * self.half_open_ratio:
+                return True
+            return False
+
+        now = time.monotonic()
+        permits = self.permits
+        if len(permits) < circuit_breaker.half_open_max_calls:
+            permits.append(now)
             return True
+        if now - permits[0] > circuit_breaker.reset_timeout_seconds:
+            # the oldest probe was lost, so its permit would never be released
+            logger.debug("Probes not completed in time")
+            circuit_breaker.open()
+        return False
+
+    def release(self):
+        if self.permits:
+            self.permits.popleft()
+
+    def is_open(self):
         return False
 
-    def record_success(self):
-        self.circuit_breaker.close()
+    def record_success(self, duration_seconds=None):
+        if duration_seconds is not None and time.monotonic() - duration_seconds < self.half_opened_at:
+            return
+        self.release()
+        self.successes += 1
+        if self.successes >= self.circuit_breaker.half_open_successes:
+            self.circuit_breaker.close()
 
-    def record_failure(self):
+    def record_failure(self, duration_seconds=None):
         self.circuit_breaker.open()
 
     def get_name(self):
         return 'half-open'
 
 
+class _SlowStartState:
+    """
+    A status class representing the closed state of a CircuitBreaker during the slow start following
+    the recovery of the underlying system. Outcomes are recorded by the closed state, and the ratio
+    of executions allowed rises from `half_open_ratio` to 1 over `slow_start_seconds`, after which
+    the closed state is restored.
+    """
+
+    __slots__ = ('circuit_breaker', 'closed', 'started_at', 'credit')
+
+    def __init__(self, circuit_breaker, closed):
+        self.circuit_breaker = circuit_breaker
+        self.closed = closed
+        self.started_at = 0.0
+        self.credit = 0.0
+
+    def reset(self):
+        self.started_at = time.monotonic()
+        self.credit = 0.0
+
+    @property
+    def window(self):
+        return self.closed.window
+
+    @property
+    def allowed_ratio(self):
+        circuit_breaker = self.circuit_breaker
+        progress = (time.monotonic() - self.started_at) / circuit_breaker.slow_start_seconds
+        if progress >= 1:
+            return 1.0
+        initial_ratio = circuit_breaker.half_open_ratio
+        if circuit_breaker.slow_start_curve == 'exponential' and initial_ratio > 0:
+            return initial_ratio ** (1 - progress)
+        return initial_ratio + (1 - initial_ratio) * progress
+
+    def allows_execution(self):
+        ratio = self.allowed_ratio
+        if ratio >= 1:
+            logger.debug("Slow start completed")
+            self.circuit_breaker.state = self.closed
+            return True
+        # executions are spread evenly by accumulating the allowed ratio
+        self.credit += ratio
+        if self.credit >= 1:
+            self.credit -= 1
+            return True
+        return False
+
+    def is_open(self):
+        return False
+
+    def record_success(self, duration_seconds=None):
+        self.closed.record_success(duration_seconds)
+
+    def record_failure(self, duration_seconds=None):
+        self.closed.record_failure(duration_seconds)
+
+    def get_name(self):
+        return 'closed'
+
+
+class _StateSync:
+    """
+    Counts the outcomes recorded by a CircuitBreaker and synchronizes them with a StateBackend
+    in a background task, started with the first outcome recorded in a running event loop and
+    restarted if it ended, e.g. because its loop was closed.
+    """
+
+    __slots__ = ('circuit_breaker', 'backend', 'key', 'interval_seconds', 'successes', 'failures',
+                 'published_opened_at', 'open_until', 'task')
+
+    def __init__(self, circuit_breaker, backend, key, interval_seconds):
+        self.circuit_breaker = circuit_breaker
+        self.backend = backend
+        self.key = key
+        self.interval_seconds = interval_seconds
+        self.successes = 0
+        self.failures = 0
+        # opening of the breaker last sent to or received from the backend
+        self.published_opened_at = None
+        # latest time until which the shared circuit is known to be open
+        self.open_until = 0.0
+        self.task = None
+
+    def record(self, succeeded):
+        if succeeded:
+            self.successes += 1
+        else:
+            self.failures += 1
+        if self.task is None or self.task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # outcomes recorded outside of a loop are sent by the next synchronization
+                return
+            self.task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.sync()
+
+    async def sync(self):
+        circuit_breaker = self.circuit_breaker
+        open_until = None
+        if circuit_breaker.state is circuit_breaker._open and \
+                circuit_breaker._open.opened_at != self.published_opened_at:
+            # monotonic times are local to the host, the backend is given a unix time
+            open_until = time.time() + circuit_breaker._open.half_open_at - time.monotonic()
+            self.published_opened_at = circuit_breaker._open.opened_at
+            self.open_until = max(self.open_until, open_until)
+
+        successes, failures = self.successes, self.failures
+        self.successes = self.failures = 0
+        try:
+            state = await self.backend.sync(self.key, successes, failures, open_until)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.successes += successes
+            self.failures += failures
+            if open_until is not None:
+                self.published_opened_at = None
+            logger.exception("State synchronization failed")
+            return
+        self._apply(state)
+
+    def _apply(self, state):
+        circuit_breaker = self.circuit_breaker
+        if state.open_until > self.open_until:
+            # opened by another circuit breaker
+            self.open_until = state.open_until
+            remaining_seconds = state.open_until - time.time()
+            if remaining_seconds <= 0:
+                return
+            logger.debug("Opened by the state backend")
+            if circuit_breaker.state is not circuit_breaker._open:
+                circuit_breaker.open()
+            circuit_breaker._open.half_open_at = time.monotonic() + remaining_seconds
+            self.published_opened_at = circuit_breaker._open.opened_at
+        elif circuit_breaker.current_state == 'closed' and self.backend.is_failing(state):
+            logger.debug("Shared failure rate reached")
+            # opened for the local reset timeout, which is published at the next synchronization
+            circuit_breaker.open()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.sync()
+
+
 class AlwaysClosedCircuitBreaker(CircuitBreaker):
     """
     A CircuitBreaker which is always closed allowing all executions.
@@ -195,8 +769,18 @@ class AlwaysClosedCircuitBreaker(CircuitBreaker):
     def allows_execution(self):
         return True
 
-    def record_success(self):
+    def is_open(self):
+        return False
+
+    def record_success(self, duration_seconds=None):
+        pass
+
+    def record_failure(self, duration_seconds=None):
         pass
 
-    def record_failure(self):
+    def release_permit(self):
         pass
+
+    @property
+    def current_state(self):
+        return 'closed'
@@ -0,0 +1,169 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+
+class SharedState:
+    """
+    State of a circuit shared by the circuit breakers synchronized with a :class:`StateBackend`.
+    """
+
+    __slots__ = ('successes', 'failures', 'open_until')
+
+    def __init__(self, successes=0, failures=0, open_until=0.0):
+        """
+        :param successes: successes recorded by every breaker in the current window.
+        :param failures: failures recorded by every breaker in the current window.
+        :param open_until: unix time until which the circuit is open, 0 if it was never opened.
+        """
+        self.successes = successes
+        self.failures = failures
+        self.open_until = open_until
+
+    def __repr__(self):
+        return '<SharedState successes={} failures={} open_until={}>'.format(
+            self.successes, self.failures, self.open_until)
+
+
+class StateBackend:
+    """
+    Base class for the backends sharing the state of circuit breakers, such as the breakers of a
+    partner in every instance of a service. Subclasses should override the `sync` method.
+
+    Outcomes are counted in windows of `window_seconds` seconds of wall clock time. Circuit breakers
+    synchronized with the backend open when the failure rate of the current window reaches
+    `failure_rate_threshold`, once `minimum_calls` outcomes were recorded in it, and when any of them
+    opens. The counts of the window are cleared when the circuit opens.
+    """
+
+    def __init__(self, window_seconds=10, failure_rate_threshold=0.5, minimum_calls=100):
+        """
+        :param window_seconds: length of the windows in which outcomes are counted.
+        :param failure_rate_threshold: failure rate between 0 and 1 at which the circuit opens.
+            If None, only the transitions to open are shared.
+        :param minimum_calls: number of outcomes in the window needed before the circuit can open.
+        """
+        self.window_seconds = window_seconds
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+
+    async def sync(self, key, successes, failures, open_until=None):
+        """
+        Adds the outcomes recorded by a circuit breaker since its last synchronization and returns
+        the :class:`SharedState` of the circuit.
+
+        :param key: key of the circuit, the same for every breaker sharing it.
+        :param successes: successes recorded since the last synchronization.
+        :param failures: failures recorded since the last synchronization.
+        :param open_until: unix time until which the breaker opened since the last synchronization,
+            if it did. The circuit stays open until the latest time given.
+        """
+        raise NotImplementedError()
+
+    def is_failing(self, state):
+        """
+        Returns whether the failure rate of the shared state should open the circuit.
+        """
+        if self.failure_rate_threshold is None:
+            return False
+        total = state.successes + state.failures
+        return total >= self.minimum_calls and state.failures >= self.failure_rate_threshold * total
+
+    def _window(self, now):
+        return int(now // self.window_seconds)
+
+
+class InMemoryStateBackend(StateBackend):
+    """
+    StateBackend keeping the state in memory, shared by the circuit breakers of the process using it.
+    """
+
+    def __init__(self, window_seconds=10, failure_rate_threshold=0.5, minimum_calls=100):
+        super(InMemoryStateBackend, self).__init__(window_seconds, failure_rate_threshold, minimum_calls)
+        # window, successes, failures and open_until of each key
+        self._states = {}
+
+    async def sync(self, key, successes, failures, open_until=None):
+        window = self._window(time.time())
+        entry = self._states.get(key)
+        if entry is None:
+            entry = self._states[key] = [window, 0, 0, 0.0]
+        elif entry[0] != window:
+            entry[0:3] = [window, 0, 0]
+        if open_until is not None and open_until > entry[3]:
+            entry[1:4] = [0, 0, open_until]
+        entry[1] += successes
+        entry[2] += failures
+        return SharedState(entry[1], entry[2], entry[3])
+
+
+# Adds the outcomes of a circuit breaker and returns the shared state in one atomic step.
+# KEYS: counts of the window, time until which the circuit is open.
+# ARGV: successes, failures, time until which the breaker opened or '', expiries of both keys.
+_SYNC_SCRIPT = """
+local shared_open_until = redis.call('get', KEYS[2]) or '0'
+if ARGV[3] ~= '' and tonumber(ARGV[3]) > tonumber(shared_open_until) then
+    shared_open_until = ARGV[3]
+    redis.call('set', KEYS[2], ARGV[3], 'ex', ARGV[5])
+    redis.call('del', KEYS[1])
+end
+local successes = tonumber(ARGV[1])
+local failures = tonumber(ARGV[2])
+if successes > 0 then
+    redis.call('hincrby', KEYS[1], 'successes', successes)
+end
+if failures > 0 then
+    redis.call('hincrby', KEYS[1], 'failures', failures)
+end
+if successes > 0 or failures > 0 then
+    redis.call('expire', KEYS[1], ARGV[4])
+end
+local counts = redis.call('hmget', KEYS[1], 'successes', 'failures')
+return {counts[1] or '0', counts[2] or '0', shared_open_until}
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """
+    StateBackend keeping the state in Redis, shared by every process using the same server.
+
+    `redis` is an asynchronous client with the interface of `redis.asyncio.Redis`, of which the
+    `eval` method is used. Each synchronization is a single Lua script, so that it takes one round
+    trip and concurrent breakers cannot overwrite a later opening with an earlier one. The counts of
+    each window are kept in a hash expiring after two windows, and the time until which the circuit
+    is open in a key expiring with it.
+    """
+
+    def __init__(self, redis, prefix='failsafe:circuit:', window_seconds=10, failure_rate_threshold=0.5,
+                 minimum_calls=100):
+        """
+        :param redis: asynchronous Redis client.
+        :param prefix: prefix of the Redis keys.
+        """
+        super(RedisStateBackend, self).__init__(window_seconds, failure_rate_threshold, minimum_calls)
+        self.redis = redis
+        self.prefix = prefix
+
+    async def sync(self, key, successes, failures, open_until=None):
+        now = time.time()
+        counts_key = '{}{}:{}'.format(self.prefix, key, self._window(now))
+        open_until_key = '{}{}:open_until'.format(self.prefix, key)
+        shared_successes, shared_failures, shared_open_until = await self.redis.eval(
+            _SYNC_SCRIPT, 2, counts_key, open_until_key, successes, failures,
+            '' if open_until is None else repr(open_until), int(2 * self.window_seconds),
+            0 if open_until is None else max(int(open_until - now) + 1, 1))
+        return SharedState(int(shared_successes), int(shared_failures), float(_text(shared_open_until)))
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
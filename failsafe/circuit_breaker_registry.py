@@ -0,0 +1,260 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+from array import array
+from collections import OrderedDict
+
+from failsafe._internal import _do_nothing, _notify, _safe_call
+
+logger = logging.getLogger(__name__)
+
+_CLOSED = 0
+_OPEN = 1
+_HALF_OPEN = 2
+
+_STATE_NAMES = {_CLOSED: 'closed', _OPEN: 'open', _HALF_OPEN: 'half-open'}
+
+
+class CircuitBreakerRegistry:
+    """
+    CircuitBreakerRegistry holds one circuit breaker per key, such as a host or a partner id, each
+    behaving as a :class:`failsafe.CircuitBreaker` created with the parameters of the registry.
+    Breakers are created when a key is first used.
+
+    The state of the breakers is kept in arrays rather than in objects, taking about 40 bytes per key
+    besides the key itself. Closed breakers are evicted when the registry holds more than `max_size`
+    breakers, least recently used first, or when they were not used for `idle_seconds`. Open and
+    half-open breakers are never evicted, so the registry can grow over `max_size` while more than
+    `max_size` circuits are open.
+    """
+
+    def __init__(self, maximum_failures=2, reset_timeout_seconds=60, half_open_ratio=0.1, max_size=10000,
+                 idle_seconds=None, on_open=None, on_half_open=None, on_close=None, open_on_retry_after=False):
+        """
+        Constructs CircuitBreakerRegistry.
+
+        :param maximum_failures: consecutive failures opening the circuit of a key.
+        :param reset_timeout_seconds: time after which an open circuit half opens.
+        :param half_open_ratio: ratio of the executions allowed while a circuit is half open.
+        :param max_size: number of breakers above which closed breakers are evicted.
+        :param idle_seconds: time after which an unused closed breaker is evicted. If None, breakers
+            are only evicted when there are more than `max_size`.
+        :param on_open: callable that will be invoked when the circuit of any key opens
+        :param on_half_open: callable that will be invoked when the circuit of any key half opens
+        :param on_close: callable that will be invoked when the circuit of any key closes
+        :param open_on_retry_after: whether Failsafe opens the circuit of a key for the time asked by
+            a failure carrying a retry hint, instead of counting it as a failure.
+        """
+        if max_size < 1:
+            raise ValueError("`max_size` must be at least 1.")
+
+        self.maximum_failures = maximum_failures
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.half_open_ratio = half_open_ratio
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.open_on_retry_after = open_on_retry_after
+
+        self.on_open = on_open or _do_nothing
+        self.on_half_open = on_half_open or _do_nothing
+        self.on_close = on_close or _do_nothing
+
+        # index of the slot of each key, from the least to the most recently used
+        self._slots = OrderedDict()
+        self._free_slots = []
+        self._states = array('b')
+        self._failures = array('q')
+        self._half_open_attempts = array('q')
+        self._opened_at = array('d')
+        self._used_at = array('d')
+        self._transition_listeners = ()
+
+    def add_transition_listener(self, listener):
+        """
+        Adds a callable invoked with the new state, 'open', 'half-open' or 'closed', after every transition
+        of the circuit of any key and the matching `on_*` callback.
+        """
+        self._transition_listeners = self._transition_listeners + (listener,)
+
+    def remove_transition_listener(self, listener):
+        """
+        Removes a listener added with `add_transition_listener`.
+        """
+        self._transition_listeners = tuple(added for added in self._transition_listeners if added is not listener)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def get(self, key):
+        """
+        Returns the circuit breaker of the key, with the same interface as :class:`failsafe.CircuitBreaker`.
+        It is a lightweight view on the registry, which can be created for every call.
+        """
+        return _KeyedCircuitBreaker(self, key)
+
+    def _slot(self, key):
+        slots = self._slots
+        now = time.monotonic()
+        slot = slots.get(key)
+        if slot is None:
+            self._evict(now)
+            slot = self._allocate()
+            slots[key] = slot
+        else:
+            slots.move_to_end(key)
+        self._used_at[slot] = now
+        return slot
+
+    def _allocate(self):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._states[slot] = _CLOSED
+            self._failures[slot] = 0
+            self._half_open_attempts[slot] = 0
+            self._opened_at[slot] = 0.0
+            return slot
+        self._states.append(_CLOSED)
+        self._failures.append(0)
+        self._half_open_attempts.append(0)
+        self._opened_at.append(0.0)
+        self._used_at.append(0.0)
+        return len(self._states) - 1
+
+    def _evict(self, now):
+        slots = self._slots
+        # open breakers met at the least recently used end are moved to the other end, so that
+        # each of them is skipped at most once per pass over the registry
+        for _ in range(len(slots)):
+            key, slot = next(iter(slots.items()))
+            if self._states[slot] != _CLOSED:
+                slots.move_to_end(key)
+                continue
+            idle = self.idle_seconds is not None and now - self._used_at[slot] > self.idle_seconds
+            if not idle and len(slots) < self.max_size:
+                return
+            del slots[key]
+            self._free_slots.append(slot)
+            logger.debug("Evicted circuit breaker of {!r}".format(key))
+
+    def _allows_execution(self, slot):
+        state = self._states[slot]
+        if state == _CLOSED:
+            return True
+        if state == _OPEN:
+            if time.monotonic() > self._opened_at[slot] + self.reset_timeout_seconds:
+                self._half_open(slot)
+                return True
+            return False
+        self._half_open_attempts[slot] += 1
+        return self._half_open_attempts[slot] % 100 < 100 * self.half_open_ratio
+
+    def _record_success(self, slot):
+        state = self._states[slot]
+        if state == _CLOSED:
+            self._failures[slot] = 0
+        elif state == _HALF_OPEN:
+            self._close(slot)
+
+    def _record_failure(self, slot):
+        state = self._states[slot]
+        if state == _CLOSED:
+            self._failures[slot] += 1
+            if self._failures[slot] >= self.maximum_failures:
+                self._open(slot)
+        elif state == _HALF_OPEN:
+            self._open(slot)
+
+    def _is_open(self, slot):
+        return self._states[slot] == _OPEN and \
+            time.monotonic() <= self._opened_at[slot] + self.reset_timeout_seconds
+
+    def _open(self, slot):
+        self._states[slot] = _OPEN
+        self._opened_at[slot] = time.monotonic()
+        logger.debug("Opened")
+        _safe_call(self.on_open)
+        _notify(self._transition_listeners, 'open')
+
+    def _open_for(self, slot, seconds):
+        # the opening time is set so that the circuit half opens once `seconds` have passed
+        opened_at = time.monotonic() + seconds - self.reset_timeout_seconds
+        if self._states[slot] == _OPEN:
+            self._opened_at[slot] = max(self._opened_at[slot], opened_at)
+            return
+        self._open(slot)
+        self._opened_at[slot] = opened_at
+
+    def _half_open(self, slot):
+        self._states[slot] = _HALF_OPEN
+        self._half_open_attempts[slot] = 0
+        logger.debug("Half opened")
+        _safe_call(self.on_half_open)
+        _notify(self._transition_listeners, 'half-open')
+
+    def _close(self, slot):
+        self._states[slot] = _CLOSED
+        self._failures[slot] = 0
+        logger.debug("Closed")
+        _safe_call(self.on_close)
+        _notify(self._transition_listeners, 'closed')
+
+
+class _KeyedCircuitBreaker:
+    """
+    The circuit breaker of a key of a CircuitBreakerRegistry. It looks the key up on every use,
+    so that it remains valid if the breaker is evicted and created again.
+    """
+
+    __slots__ = ('registry', 'key')
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    def allows_execution(self):
+        return self.registry._allows_execution(self.registry._slot(self.key))
+
+    def record_success(self, duration_seconds=None):
+        self.registry._record_success(self.registry._slot(self.key))
+
+    def record_failure(self, duration_seconds=None):
+        self.registry._record_failure(self.registry._slot(self.key))
+
+    def release_permit(self):
+        # executions are allowed by ratio while half open, without permits
+        pass
+
+    def is_open(self):
+        slot = self.registry._slots.get(self.key)
+        return slot is not None and self.registry._is_open(slot)
+
+    def open(self):
+        self.registry._open(self.registry._slot(self.key))
+
+    def open_for(self, seconds):
+        self.registry._open_for(self.registry._slot(self.key), seconds)
+
+    def half_open(self):
+        self.registry._half_open(self.registry._slot(self.key))
+
+    def close(self):
+        self.registry._close(self.registry._slot(self.key))
+
+    @property
+    def current_state(self):
+        slot = self.registry._slots.get(self.key)
+        return 'closed' if slot is None else _STATE_NAMES[self.registry._states[slot]]
@@ -0,0 +1,49 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+import contextvars
+import time
+
+_current_deadline = contextvars.ContextVar('failsafe_deadline', default=None)
+
+
+def get_deadline():
+    """
+    Returns the deadline of the current context as a `time.monotonic()` time, or None if there is none.
+    """
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_at(monotonic_time):
+    """
+    Sets the deadline, as a `time.monotonic()` time, which Failsafe and FallbackFailsafe calls made
+    within the block - including nested ones and the ones made by tasks created within the block -
+    have to honour. An earlier deadline already set is kept.
+    """
+    current_deadline = _current_deadline.get()
+    if current_deadline is not None and current_deadline < monotonic_time:
+        monotonic_time = current_deadline
+
+    token = _current_deadline.set(monotonic_time)
+    try:
+        yield monotonic_time
+    finally:
+        _current_deadline.reset(token)
+
+
+def deadline_after(seconds):
+    """
+    Same as :func:`deadline_at`, with a deadline `seconds` from now.
+    """
+    return deadline_at(time.monotonic() + seconds)
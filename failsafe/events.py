@@ -0,0 +1,157 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Event:
+    """
+    Event describes something which happened during a :class:`failsafe.Failsafe` call,
+    and is passed to the listeners of the Failsafe.
+    """
+
+    ATTEMPT_SUCCEEDED = 'attempt_succeeded'
+    ATTEMPT_FAILED = 'attempt_failed'
+    RETRY = 'retry'
+    ABORT = 'abort'
+    RETRIES_EXHAUSTED = 'retries_exhausted'
+    TIMEOUT = 'timeout'
+    CIRCUIT_REJECTED = 'circuit_rejected'
+    CIRCUIT_OPENED = 'circuit_opened'
+    CIRCUIT_HALF_OPENED = 'circuit_half_opened'
+    CIRCUIT_CLOSED = 'circuit_closed'
+
+    def __init__(self, type, name=None, attempt=None, exception=None, elapsed_seconds=None, duration_seconds=None,
+                 circuit_state=None):
+        """
+        :param type: one of the event types defined in this class.
+        :param name: name of the Failsafe.
+        :param attempt: number of the attempt, starting at 1, or None for circuit breaker transitions.
+        :param exception: exception of the failed attempt, if any.
+        :param elapsed_seconds: time elapsed since the beginning of the Failsafe call.
+        :param duration_seconds: duration of the attempt, for attempt events.
+        :param circuit_state: state of the circuit breaker after the event.
+        """
+        self.type = type
+        self.name = name
+        self.attempt = attempt
+        self.exception = exception
+        self.elapsed_seconds = elapsed_seconds
+        self.duration_seconds = duration_seconds
+        self.circuit_state = circuit_state
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        return '<Event {} name={!r} attempt={} exception={!r} circuit_state={}>'.format(
+            self.type, self.name, self.attempt, self.exception, self.circuit_state)
+
+
+class AsyncEventQueue:
+    """
+    AsyncEventQueue is a listener queueing events and passing them in batches to an asynchronous
+    listener in a background task, so that slow listeners do not delay the calls.
+
+    The queue holds at most `max_size` events: events arriving when it is full are dropped and
+    counted in `dropped`. The background task is started with the first event queued in a running
+    event loop, and started again in the loop of the next event if it ended or ran in another loop.
+    """
+
+    def __init__(self, listener, max_size=10000, batch_size=100):
+        """
+        Constructs AsyncEventQueue.
+
+        :param listener: coroutine function called with a list of at most `batch_size` events.
+        :param max_size: maximum number of events waiting to be passed to the listener.
+        :param batch_size: maximum number of events passed to the listener at once.
+        """
+        if max_size < 1 or batch_size < 1:
+            raise ValueError("`max_size` and `batch_size` must be at least 1.")
+
+        self.listener = listener
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.dropped = 0
+
+        self._events = deque()
+        self._wakeup = None
+        self._idle = None
+        self._task = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def __call__(self, event):
+        if len(self._events) >= self.max_size:
+            self.dropped += 1
+            return
+        self._events.append(event)
+        if not self._start():
+            # queued events are passed to the listener once an event is queued in a running loop
+            return
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def flush(self):
+        """
+        Waits until every queued event has been passed to the listener.
+        """
+        if self._events and self._start():
+            self._wakeup.set()
+        # a task left behind by another loop has nothing to wait for in this one
+        if self._task is not None and not self._task.done() and self._loop is asyncio.get_running_loop():
+            await self._idle.wait()
+
+    async def close(self):
+        """
+        Passes the queued events to the listener and stops the background task.
+        """
+        await self.flush()
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+
+    def _start(self):
+        """
+        Starts the background task in the running loop unless it is running there already, and returns
+        whether it is running.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._task = loop.create_task(self._dispatch())
+        return True
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._events:
+                batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+                try:
+                    await self.listener(batch)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Exception caught!")
+            self._idle.set()
@@ -12,11 +12,16 @@
 
 
 import asyncio
+import inspect
 import logging
+import time
 
-from failsafe._internal import _safe_call
+from failsafe._internal import _add_weak_transition_listener, _is_open, _safe_call
 from failsafe.circuit_breaker import AlwaysClosedCircuitBreaker
-from failsafe.retry_policy import RetryPolicy
+from failsafe.circuit_breaker_registry import CircuitBreakerRegistry
+from failsafe.deadline import _current_deadline
+from failsafe.events import Event
+from failsafe.retry_policy import RetryPolicy, get_retry_after
 
 logger = logging.getLogger(__name__)
 
@@ -33,11 +38,45 @@ class RetriesExhausted(FailsafeError):
     pass
 
 
+class AttemptTimeout(FailsafeError):
+    """
+    Raised inside Failsafe when a single attempt takes longer than `attempt_timeout_seconds`.
+    It is treated as any other failure: it is recorded by the circuit breaker and it is
+    passed to `RetryPolicy.should_retry`.
+    """
+    pass
+
+
+class TimeoutExceeded(FailsafeError):
+    """
+    Raised when the whole Failsafe call, including retries and waits between them,
+    takes longer than `timeout_seconds`.
+    """
+    pass
+
+
 class Context(object):
 
+    __slots__ = ('attempts', 'errors', 'previous_delay')
+
     def __init__(self):
         self.attempts = 0
         self.errors = 0
+        self.previous_delay = None
+
+
+_TRANSITION_EVENTS = {
+    'open': Event.CIRCUIT_OPENED,
+    'half-open': Event.CIRCUIT_HALF_OPENED,
+    'closed': Event.CIRCUIT_CLOSED,
+}
+
+
+class _CoalescedCall(object):
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
 
 
 class Failsafe:
@@ -45,9 +84,50 @@ class Failsafe:
     Failsafe is used to wrap a method call with a retry policy and/or a circuit breaker.
     By default, the number of retries of the retry policy is 0 so no retries will be allowed
     and the circuit breaker is always closed allowing all calls.
+
+    The policies given are read at construction to plan the execution of calls, so that calls only
+    go through the steps they need. Whether debug messages are logged is also decided then.
     """
 
-    def __init__(self, retry_policy=None, circuit_breaker=None):
+    def __init__(self, retry_policy=None, circuit_breaker=None, attempt_timeout_seconds=None, timeout_seconds=None,
+                 hedge_policy=None, bulkhead=None, rate_limiter=None, coalesce_key=None,
+                 result_cache=None, metrics=None, name=None, listeners=None, circuit_breaker_key=None, throttle=None):
+        """
+        :param retry_policy: :class:`failsafe.RetryPolicy` deciding whether failed attempts are retried.
+        :param circuit_breaker: :class:`failsafe.CircuitBreaker` guarding the calls, or
+            :class:`failsafe.CircuitBreakerRegistry` when `circuit_breaker_key` is given.
+        :param attempt_timeout_seconds: maximum duration of a single attempt. An attempt running for longer
+            is cancelled and counts as a failure with an :class:`AttemptTimeout` exception. If None, attempts
+            are not time limited.
+        :param timeout_seconds: maximum duration of the whole call, including retries and waits between them.
+            When exceeded, the running attempt is cancelled and :class:`TimeoutExceeded` is raised.
+            If None, the call is only limited by the deadline set with :func:`failsafe.deadline_after`, if any.
+        :param hedge_policy: :class:`failsafe.HedgePolicy` launching a concurrent attempt when an attempt
+            is slow. If None, attempts are not hedged.
+        :param bulkhead: :class:`failsafe.Bulkhead` or :class:`failsafe.AdaptiveBulkhead` limiting the number
+            of concurrent attempts. If None, concurrency is not limited.
+        :param rate_limiter: :class:`failsafe.RateLimiter` limiting the rate of attempts, retries included.
+            If None, the rate is not limited.
+        :param coalesce_key: function called with the arguments of :meth:`run` returning a hashable key. Concurrent
+            calls with the same key share a single execution, retries included, and all receive its result or
+            exception. A call cancelled while waiting does not cancel the shared execution unless it was the
+            last one waiting. If None, or if the function returns None, calls are not coalesced.
+        :param result_cache: :class:`failsafe.ResultCache` returning the results of previous calls, possibly
+            stale when the call fails. If None, results are not cached.
+        :param metrics: :class:`failsafe.FailsafeMetrics` counting the attempts and their outcome, and
+            the state transitions of the circuit breaker. If None, nothing is counted.
+        :param name: name of the Failsafe, given in its events.
+        :param listeners: list of callables invoked with a :class:`failsafe.Event` for every attempt, retry,
+            rejection and transition of the circuit breaker. They are invoked synchronously, slow listeners
+            should be wrapped in a :class:`failsafe.AsyncEventQueue`.
+        :param circuit_breaker_key: function called with the arguments of :meth:`run` returning the key of
+            the circuit breaker guarding the call in the `circuit_breaker` registry.
+        :param throttle: :class:`failsafe.AdaptiveThrottle` rejecting a fraction of the attempts when the
+            downstream rejects many of them. If None, attempts are not throttled.
+        """
+        if circuit_breaker_key is not None and not isinstance(circuit_breaker, CircuitBreakerRegistry):
+            raise ValueError("`circuit_breaker` must be a registry when `circuit_breaker_key` is given.")
+
         if retry_policy is None:
             retry_policy = RetryPolicy(allowed_retries=0)
         self.retry_policy = retry_policy
@@ -55,6 +135,35 @@ class Failsafe:
         if circuit_breaker is None:
             circuit_breaker = AlwaysClosedCircuitBreaker()
         self.circuit_breaker = circuit_breaker
+        self.circuit_breaker_key = circuit_breaker_key
+
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.timeout_seconds = timeout_seconds
+        self.hedge_policy = hedge_policy
+        self.bulkhead = bulkhead
+        self.rate_limiter = rate_limiter
+        self.throttle = throttle
+        self.coalesce_key = coalesce_key
+        self._coalesced_calls = {}
+        self.result_cache = result_cache
+        self.metrics = metrics
+        if metrics is not None and not isinstance(circuit_breaker, AlwaysClosedCircuitBreaker):
+            metrics.observe_circuit_breaker(circuit_breaker)
+        self.name = name
+        self.listeners = list(listeners or [])
+        if self.listeners and not isinstance(circuit_breaker, AlwaysClosedCircuitBreaker) and \
+                hasattr(circuit_breaker, 'add_transition_listener'):
+            # held weakly by the breaker, which may be shared by Failsafe instances created per request
+            _add_weak_transition_listener(circuit_breaker, self._emit_transition)
+
+        self._debug = logger.isEnabledFor(logging.DEBUG)
+        self._open_on_retry_after = getattr(circuit_breaker, 'open_on_retry_after', False)
+        if self._open_on_retry_after and circuit_breaker_key is None and not hasattr(circuit_breaker, 'open_for'):
+            raise ValueError("`circuit_breaker` must have an `open_for` method when `open_on_retry_after` is set.")
+        self._records_duration = isinstance(circuit_breaker, CircuitBreakerRegistry) or \
+            _accepts_duration(circuit_breaker)
+        # calls skip caching, coalescing and deadline handling when none is needed
+        self._direct = result_cache is None and coalesce_key is None and timeout_seconds is None
 
     async def run(self, callable, *args, **kwargs):
         """
@@ -68,41 +177,484 @@ class Failsafe:
         :raises: RetriesExhausted when the retry policy attempts has been reached.
         :raises: CircuitOpen when the circuit_breaker policy has reached the
             maximum allowed number of failures
+        :raises: TimeoutExceeded when the call took longer than `timeout_seconds` or reached the deadline
+        :raises: BulkheadFull when the bulkhead rejected the call
+        :raises: RateLimitExceeded when the rate limiter rejected the call
+        :raises: RequestThrottled when the adaptive throttle rejected the call
+        """
+        if self._direct and _current_deadline.get() is None:
+            return await self._run(None, callable, args, kwargs)
+        if self.result_cache is not None:
+            return await self.result_cache.run(self._run_uncached, callable, args, kwargs)
+        return await self._run_uncached(callable, args, kwargs)
+
+    async def run_many(self, callable, items, concurrency=10, return_exceptions=False):
+        """
+        Calls the callable method with each of the items, as :meth:`run` does, running at most `concurrency`
+        calls at a time. Each call is retried on its own, so only failed items are retried. Once the
+        circuit breaker is open, the remaining items are not called and fail with :class:`CircuitOpen`.
+
+        :param callable: method to call with each item.
+        :param items: iterable of the items, consumed as calls complete.
+        :param concurrency: maximum number of concurrent calls.
+        :param return_exceptions: if True, the exception of a failed call is returned in place of its
+            result. Otherwise the first exception is raised and the running calls are cancelled.
+        :return: list of the results, in the order of the items.
+        """
+        results = {}
+        async for index, _, result in self._run_iter(callable, items, concurrency, return_exceptions):
+            results[index] = result
+        return [results[index] for index in range(len(results))]
+
+    async def run_iter(self, callable, items, concurrency=10, return_exceptions=False):
+        """
+        Same as :meth:`run_many`, but yields `(item, result)` pairs as the calls complete.
+        """
+        async for _, item, result in self._run_iter(callable, items, concurrency, return_exceptions):
+            yield item, result
+
+    async def _run_iter(self, callable, items, concurrency, return_exceptions):
+        if concurrency < 1:
+            raise ValueError("`concurrency` must be at least 1.")
+
+        # workers take the next item from the shared iterator when they are done with the previous one,
+        # so that calls are created as they are run
+        items = enumerate(items)
+        completed = asyncio.Queue()
+        circuit_open = False
+
+        async def worker():
+            nonlocal circuit_open
+            try:
+                while True:
+                    try:
+                        index, item = next(items)
+                    except StopIteration:
+                        return
+                    except Exception as e:
+                        # the items could not be iterated
+                        completed.put_nowait(e)
+                        return
+                    if self.circuit_breaker_key is not None:
+                        # with a breaker per key, only the items of keys whose circuit is open are failed
+                        if _is_open(self._circuit_breaker_for((item,), {})):
+                            completed.put_nowait((index, item, None, CircuitOpen()))
+                            continue
+                    elif not circuit_open and _is_open(self.circuit_breaker):
+                        if self._debug:
+                            logger.debug("Circuit open, failing the remaining items")
+                        circuit_open = True
+                    if circuit_open:
+                        completed.put_nowait((index, item, None, CircuitOpen()))
+                        continue
+                    try:
+                        result = await self.run(callable, item)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        completed.put_nowait((index, item, None, e))
+                    else:
+                        completed.put_nowait((index, item, result, None))
+            finally:
+                completed.put_nowait(None)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        running = len(workers)
+        try:
+            while running:
+                entry = await completed.get()
+                if entry is None:
+                    running -= 1
+                    continue
+                if isinstance(entry, Exception):
+                    raise entry
+                index, item, result, exception = entry
+                if exception is None:
+                    yield index, item, result
+                elif return_exceptions:
+                    yield index, item, exception
+                else:
+                    raise exception
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def _run_uncached(self, callable, args, kwargs):
+        if self.coalesce_key is not None:
+            key = self.coalesce_key(*args, **kwargs)
+            if key is not None:
+                return await self._run_coalesced(key, callable, args, kwargs)
+        return await self._run_with_deadline(callable, args, kwargs)
+
+    async def _run_with_deadline(self, callable, args, kwargs):
+        deadline = _current_deadline.get()
+        if self.timeout_seconds is not None:
+            timeout_deadline = time.monotonic() + self.timeout_seconds
+            if deadline is None or timeout_deadline < deadline:
+                deadline = timeout_deadline
+
+        if deadline is None:
+            return await self._run(deadline, callable, args, kwargs)
+
+        # nested calls made by the callable inherit the deadline
+        token = _current_deadline.set(deadline)
+        try:
+            return await self._run(deadline, callable, args, kwargs)
+        finally:
+            _current_deadline.reset(token)
+
+    async def _run_coalesced(self, key, callable, args, kwargs):
         """
+        Joins the execution in flight for the key, starting it if there is none. The execution runs
+        in a task of its own so that cancelling a waiting call does not cancel it, and it is cancelled
+        once no call is waiting for it anymore.
+        """
+        call = self._coalesced_calls.get(key)
+        if call is None:
+            call = _CoalescedCall(asyncio.ensure_future(self._run_with_deadline(callable, args, kwargs)))
+            self._coalesced_calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget_coalesced_call(key, call))
+        elif self._debug:
+            logger.debug("Coalescing call with the one in flight for key {!r}".format(key))
+
+        # the shared execution follows the deadline of the call which started it,
+        # callers joining it with an earlier deadline stop waiting at their own
+        timeout = None
+        deadline = _current_deadline.get()
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0)
+
+        call.waiters += 1
+        try:
+            done, _ = await asyncio.wait({call.task}, timeout=timeout)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                if self._debug:
+                    logger.debug("No call waiting for key {!r} anymore, cancelling it".format(key))
+                self._forget_coalesced_call(key, call)
+                call.task.cancel()
+
+        if not done:
+            raise TimeoutExceeded()
+        return call.task.result()
+
+    def _forget_coalesced_call(self, key, call):
+        if self._coalesced_calls.get(key) is call:
+            del self._coalesced_calls[key]
+
+    async def _run(self, deadline, callable, args, kwargs):
         recent_exception = None
         retry = True
-        context = Context()
+        # the context is only needed by the retry policy, so it is created on the first failure
+        context = None
+        attempts = 0
+        circuit_breaker = self._circuit_breaker_for(args, kwargs)
+        retry_policy = self.retry_policy
+        metrics = self.metrics
+        listeners = self.listeners
+        throttle = self.throttle
+        called_at = time.monotonic() if listeners else None
+        direct_attempt = self.hedge_policy is None and self.attempt_timeout_seconds is None and deadline is None
 
         while retry:
-            if not self.circuit_breaker.allows_execution():
-                logger.debug("Circuit open, stopping execution")
+            if not circuit_breaker.allows_execution():
+                if self._debug:
+                    logger.debug("Circuit open, stopping execution")
+                if metrics is not None:
+                    metrics.circuit_rejections += 1
+                if listeners:
+                    self._emit(Event.CIRCUIT_REJECTED, circuit_breaker, attempts, called_at)
                 if recent_exception is None:
                     raise CircuitOpen()
                 else:
                     raise CircuitOpen() from recent_exception
+
+            try:
+                if throttle is not None:
+                    throttle.acquire()
+                if self.rate_limiter is not None:
+                    max_wait_seconds = None if deadline is None else max(deadline - time.monotonic(), 0)
+                    await self.rate_limiter.acquire(max_wait_seconds)
+                if self.bulkhead is not None:
+                    await self.bulkhead.acquire()
+            except BaseException:
+                _release_permit(circuit_breaker)
+                raise
+            rtt_seconds = None
+            dropped = False
+            recorded = False
             try:
-                context.attempts += 1
-                result = await callable(*args, **kwargs)
-                self.circuit_breaker.record_success()
-                return result
-
-            except Exception as e:
-                if self.retry_policy.should_abort(e):
-                    logger.debug("Aborting Failsafe, exception {}".format(type(e).__name__))
-                    _safe_call(self.retry_policy.on_abort)
+                timeout = self.attempt_timeout_seconds
+                timeout_is_deadline = False
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        if listeners:
+                            self._emit(Event.TIMEOUT, circuit_breaker, attempts, called_at)
+                        raise TimeoutExceeded() from recent_exception
+                    if timeout is None or remaining < timeout:
+                        timeout = remaining
+                        timeout_is_deadline = True
+
+                try:
+                    attempts += 1
+                    started_at = time.monotonic()
+                    if direct_attempt:
+                        result = await callable(*args, **kwargs)
+                    else:
+                        result = await self._attempt(timeout, circuit_breaker, callable, args, kwargs)
+                    rtt_seconds = time.monotonic() - started_at
+                    if metrics is not None:
+                        metrics.attempts += 1
+                        metrics.successes += 1
+                        metrics.attempt_latency.record(rtt_seconds)
+                    if self._records_duration:
+                        circuit_breaker.record_success(rtt_seconds)
+                    else:
+                        circuit_breaker.record_success()
+                    recorded = True
+                    if throttle is not None:
+                        throttle.record_accept()
+                    if listeners:
+                        self._emit(Event.ATTEMPT_SUCCEEDED, circuit_breaker, attempts, called_at,
+                                   duration_seconds=rtt_seconds)
+                    if retry_policy.retry_budget is not None:
+                        retry_policy.retry_budget.deposit()
+                    return result
+
+                except asyncio.CancelledError:
+                    # an exception before Python 3.8, the attempt was cancelled rather than failed
                     raise
-                recent_exception = e
-                context.errors += 1
-                retry, wait_for = self.retry_policy.should_retry(context, e)
-                self.circuit_breaker.record_failure()
-                _safe_call(self.retry_policy.on_failed_attempt)
-
-                if retry:
-                    if wait_for:
+                except Exception as e:
+                    duration = time.monotonic() - started_at
+                    if throttle is not None:
+                        throttle.record_exception(e)
+                    if metrics is not None:
+                        metrics.attempts += 1
+                        metrics.attempt_latency.record(duration)
+                    if retry_policy.should_abort(e):
+                        if self._debug:
+                            logger.debug("Aborting Failsafe, exception {}".format(type(e).__name__))
+                        if metrics is not None:
+                            metrics.aborts += 1
+                        if listeners:
+                            self._emit(Event.ABORT, circuit_breaker, attempts, called_at, e, duration)
+                        _safe_call(retry_policy.on_abort)
+                        raise
+                    recent_exception = e
+                    if context is None:
+                        context = Context()
+                    context.attempts = attempts
+                    context.errors += 1
+                    if metrics is not None:
+                        metrics.failures += 1
+                    if isinstance(e, AttemptTimeout):
+                        rtt_seconds = duration
+                        dropped = True
+                    deadline_reached = deadline is not None and (
+                        (timeout_is_deadline and isinstance(e, AttemptTimeout)) or time.monotonic() >= deadline)
+                    if deadline_reached:
+                        if self._debug:
+                            logger.debug("Failsafe deadline reached")
+                        self._record_failure(circuit_breaker, e, duration)
+                        recorded = True
+                        _safe_call(retry_policy.on_failed_attempt)
+                        if listeners:
+                            self._emit(Event.ATTEMPT_FAILED, circuit_breaker, attempts, called_at, e, duration)
+                            self._emit(Event.TIMEOUT, circuit_breaker, attempts, called_at, e)
+                        raise TimeoutExceeded() from e
+
+                    retry, wait_for = retry_policy.should_retry(context, e)
+                    self._record_failure(circuit_breaker, e, duration)
+                    recorded = True
+                    _safe_call(retry_policy.on_failed_attempt)
+                    if listeners:
+                        self._emit(Event.ATTEMPT_FAILED, circuit_breaker, attempts, called_at, e, duration)
+            finally:
+                # aborted, cancelled or timed out before the attempt
+                if not recorded:
+                    _release_permit(circuit_breaker)
+                if self.bulkhead is not None:
+                    self.bulkhead.release(rtt_seconds, dropped)
+
+            if retry:
+                if deadline is not None and (wait_for or 0) >= deadline - time.monotonic():
+                    if self._debug:
+                        logger.debug("Not retrying, wait of {} would exceed the timeout".format(wait_for))
+                    retry_budget = getattr(retry_policy, 'retry_budget', None)
+                    if retry_budget is not None:
+                        retry_budget.refund()
+                    if listeners:
+                        self._emit(Event.TIMEOUT, circuit_breaker, attempts, called_at, recent_exception)
+                    raise TimeoutExceeded() from recent_exception
+                if wait_for:
+                    if self._debug:
                         logger.debug("Waiting {}".format(wait_for))
-                        await asyncio.sleep(wait_for)
+                    await asyncio.sleep(wait_for)
+                if self._debug:
                     logger.debug("Retrying call")
-                    _safe_call(self.retry_policy.on_retry)
+                if metrics is not None:
+                    metrics.retries += 1
+                _safe_call(retry_policy.on_retry)
+                if listeners:
+                    self._emit(Event.RETRY, circuit_breaker, attempts, called_at, recent_exception)
 
-        _safe_call(self.retry_policy.on_retries_exceeded)
+        _safe_call(retry_policy.on_retries_exceeded)
+        if listeners:
+            self._emit(Event.RETRIES_EXHAUSTED, circuit_breaker, attempts, called_at, recent_exception)
         raise RetriesExhausted() from recent_exception
+
+    def _record_failure(self, circuit_breaker, exception, duration):
+        if self._open_on_retry_after:
+            retry_after_seconds = get_retry_after(exception)
+            if retry_after_seconds is not None and retry_after_seconds > 0:
+                if self._debug:
+                    logger.debug("Opening the circuit for {} seconds as asked".format(retry_after_seconds))
+                circuit_breaker.open_for(retry_after_seconds)
+                return
+        if self._records_duration:
+            circuit_breaker.record_failure(duration)
+        else:
+            circuit_breaker.record_failure()
+
+    def _circuit_breaker_for(self, args, kwargs):
+        if self.circuit_breaker_key is None:
+            return self.circuit_breaker
+        return self.circuit_breaker.get(self.circuit_breaker_key(*args, **kwargs))
+
+    def _emit(self, event_type, circuit_breaker, attempts, called_at, exception=None, duration_seconds=None):
+        event = Event(event_type, self.name, attempts, exception, time.monotonic() - called_at,
+                      duration_seconds, getattr(circuit_breaker, 'current_state', None))
+        for listener in self.listeners:
+            _safe_call(listener, event)
+
+    def _emit_transition(self, state):
+        event = Event(_TRANSITION_EVENTS[state], self.name, circuit_state=state)
+        for listener in self.listeners:
+            _safe_call(listener, event)
+
+    def _attempt(self, timeout, circuit_breaker, callable, args, kwargs):
+        if self.hedge_policy is not None:
+            args = (circuit_breaker, callable) + args
+            callable = self._run_hedged
+
+        if timeout is None:
+            return callable(*args, **kwargs)
+        return _run_with_timeout(timeout, callable, *args, **kwargs)
+
+    async def _run_hedged(self, circuit_breaker, callable, *args, **kwargs):
+        """
+        Runs the callable, launching a second concurrent execution if the first one does not complete
+        within the delay of the hedge policy. Returns the first successful result, or raises the exception
+        of the last execution to fail.
+        """
+        hedge_policy = self.hedge_policy
+        hedge_policy.record_attempt()
+        delay = hedge_policy.delay()
+
+        started_at = {}
+
+        def launch():
+            task = asyncio.ensure_future(callable(*args, **kwargs))
+            started_at[task] = time.monotonic()
+            return task
+
+        pending = {launch()}
+        first_started_at = time.monotonic()
+        hedged = delay is None
+        recent_exception = None
+        try:
+            while pending:
+                wait_timeout = None
+                if not hedged:
+                    wait_timeout = max(0, first_started_at + delay - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=wait_timeout,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                succeeded = None
+                for task in done:
+                    if task.exception() is None:
+                        succeeded = task
+                    else:
+                        recent_exception = task.exception()
+                if succeeded is not None:
+                    hedge_policy.record_latency(time.monotonic() - started_at[succeeded])
+                    return succeeded.result()
+
+                if not hedged and not done:
+                    hedged = True
+                    if self._allows_hedge(circuit_breaker):
+                        if self._debug:
+                            logger.debug("Hedging attempt after {}s".format(delay))
+                        hedge = launch()
+                        if self.bulkhead is not None:
+                            hedge.add_done_callback(lambda task: self.bulkhead.release())
+                        pending.add(hedge)
+                        _safe_call(hedge_policy.on_hedge)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise recent_exception
+
+    def _allows_hedge(self, circuit_breaker):
+        """
+        Returns a boolean indicating whether a hedged attempt can be launched, taking a permit of the bulkhead
+        and of the rate limiter for it if so. Hedges are only launched while the circuit is closed, as they
+        would otherwise use the probes of a half-open circuit, and not while the throttle rejects attempts.
+        """
+        if getattr(circuit_breaker, 'current_state', 'closed') != 'closed':
+            return False
+        if self.throttle is not None and self.throttle.rejection_probability > 0:
+            return False
+        if not self.hedge_policy.allows_hedge():
+            return False
+        bulkhead = self.bulkhead
+        if bulkhead is not None and not bulkhead.try_acquire():
+            return False
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire():
+            if bulkhead is not None:
+                bulkhead.release()
+            return False
+        return True
+
+
+def _accepts_duration(circuit_breaker):
+    # circuit breakers written before durations were recorded define `record_success(self)`
+    try:
+        inspect.signature(circuit_breaker.record_success).bind(0.0)
+        inspect.signature(circuit_breaker.record_failure).bind(0.0)
+    except TypeError:
+        return False
+    except ValueError:
+        # no signature available, e.g. for callables implemented in C
+        return True
+    return True
+
+
+def _release_permit(circuit_breaker):
+    # circuit breakers written before permits only implement `allows_execution` and `record_*`
+    release_permit = getattr(circuit_breaker, 'release_permit', None)
+    if release_permit is not None:
+        release_permit()
+
+
+async def _run_with_timeout(timeout, callable, *args, **kwargs):
+    """
+    Awaits the callable for at most `timeout` seconds, cancelling it and raising
+    :class:`AttemptTimeout` if it does not complete in time.
+    """
+    task = asyncio.ensure_future(callable(*args, **kwargs))
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    if not done:
+        task.cancel()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Attempt timed out after {}s".format(timeout))
+        raise AttemptTimeout()
+
+    return task.result()
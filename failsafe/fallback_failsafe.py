@@ -10,9 +10,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import logging
+import time
 
-from failsafe import Failsafe, FailsafeError, CircuitBreaker, RetryPolicy
+from failsafe import Failsafe, FailsafeError, CircuitBreaker, CircuitOpen, RetryPolicy, TimeoutExceeded
+from failsafe._internal import _is_open
+from failsafe.deadline import deadline_at, get_deadline
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +25,66 @@ class FallbacksExhausted(FailsafeError):
     pass
 
 
+class OptionHealth:
+    """
+    Exponentially weighted moving averages of the latency and success rate of a fallback option.
+    """
+
+    def __init__(self, smoothing=0.2, stale_seconds=60):
+        """
+        :param smoothing: weight of the most recent call in the averages, between 0 and 1.
+        :param stale_seconds: time without any call after which the averages are stale, and the option
+            is scored as if it had not been tried yet. If None, the averages never become stale.
+        """
+        self.smoothing = smoothing
+        self.stale_seconds = stale_seconds
+        self.latency_seconds = None
+        self.success_rate = 1.0
+        self.updated_at = None
+
+    def record_success(self, latency_seconds):
+        if self.latency_seconds is None:
+            self.latency_seconds = latency_seconds
+        else:
+            self.latency_seconds += (latency_seconds - self.latency_seconds) * self.smoothing
+        self.success_rate += (1.0 - self.success_rate) * self.smoothing
+        self.updated_at = time.monotonic()
+
+    def record_failure(self):
+        self.success_rate -= self.success_rate * self.smoothing
+        self.updated_at = time.monotonic()
+
+    @property
+    def score(self):
+        """
+        Expected time to get a successful result from the option, the lower the better.
+        Options which have not been tried yet score 0 so that they get tried, and the ones which
+        have only failed score infinity. Options not called for `stale_seconds` score 0 again, so
+        that an option which failed or was slow is tried again once in a while.
+        """
+        if self.stale_seconds is not None and self.updated_at is not None and \
+                time.monotonic() - self.updated_at >= self.stale_seconds:
+            return 0.0
+        if self.latency_seconds is None:
+            return 0.0 if self.success_rate == 1.0 else float('inf')
+        return self.latency_seconds / max(self.success_rate, 0.01)
+
+
 class FallbackFailsafe:
     """
     This class provides a way of executing Failsafe calls in order to provide fallback functionality.
+
+    By default the fallback options are tried one after the other. With `concurrent_options` greater
+    than 1, up to that many options race concurrently: the first option to succeed provides the result
+    and the other ones are cancelled, while every failed option is replaced with the next one.
+
+    Options whose circuit breaker is open are skipped without being called. With `order_by_health`,
+    options are tried in order of their recent latency and success rate instead of the given order.
     """
 
-    def __init__(self, fallback_options, retry_policy_factory=None, circuit_breaker_factory=None):
+    def __init__(self, fallback_options, retry_policy_factory=None, circuit_breaker_factory=None, retry_budget=None,
+                 timeout_seconds=None, concurrent_options=1, stagger_seconds=None, order_by_health=False,
+                 health_smoothing=0.2, health_stale_seconds=60):
         """
         :param fallback_options: a list of objects which will differentiate between different fallback calls. An item
             from this list will be passed as the first parameter to the function provided to the run method.
@@ -34,17 +92,38 @@ class FallbackFailsafe:
             and returning a retry policy
         :param circuit_breaker_factory: factory function accepting a fallback option
             and returning a circuit breaker
+        :param retry_budget: :class:`failsafe.RetryBudget` shared by the retry policies of all the fallback
+            options which do not have a budget of their own.
+        :param timeout_seconds: maximum duration of the whole call, across all the fallback options. Every
+            option only gets the time remaining. If None, the call is only limited by the deadline set with
+            :func:`failsafe.deadline_after`, if any.
+        :param concurrent_options: maximum number of fallback options running concurrently.
+        :param stagger_seconds: when racing options, delay after which one more option is started if no
+            option has completed yet. If None, the first `concurrent_options` options are started at once.
+        :param order_by_health: if True, options are tried from the one with the lowest ratio of average
+            latency to success rate, instead of in the order of `fallback_options`.
+        :param health_smoothing: weight of the most recent call in the health averages, between 0 and 1.
+        :param health_stale_seconds: time without any call after which an option is tried again as if its
+            health was unknown. If None, options are only ordered by their recorded health.
         """
 
         retry_policy_factory = retry_policy_factory or (lambda _: RetryPolicy())
         circuit_breaker_factory = circuit_breaker_factory or (lambda _: CircuitBreaker())
 
         def _create_failsafe(option):
-            return Failsafe(retry_policy=retry_policy_factory(option),
+            retry_policy = retry_policy_factory(option)
+            if retry_budget is not None and retry_policy.retry_budget is None:
+                retry_policy.retry_budget = retry_budget
+            return Failsafe(retry_policy=retry_policy,
                             circuit_breaker=circuit_breaker_factory(option))
 
         self.failsafes = [(option, _create_failsafe(option))
                           for option in fallback_options]
+        self.health = [OptionHealth(health_smoothing, health_stale_seconds) for _ in self.failsafes]
+        self.timeout_seconds = timeout_seconds
+        self.concurrent_options = concurrent_options
+        self.stagger_seconds = stagger_seconds
+        self.order_by_health = order_by_health
 
     async def run(self, callable, *args, **kwargs):
         """
@@ -53,11 +132,48 @@ class FallbackFailsafe:
 
         :param callable: method to call.
         :raises: FallbacksExhausted when all the fallback options have failed.
+        :raises: TimeoutExceeded when the deadline was reached before a fallback option succeeded.
         """
+        run = self._run if self.concurrent_options <= 1 else self._race
+        if self.timeout_seconds is None:
+            return await run(callable, *args, **kwargs)
+
+        with deadline_at(time.monotonic() + self.timeout_seconds):
+            return await run(callable, *args, **kwargs)
+
+    def _ordered_options(self):
+        options = [(option, failsafe, health) for (option, failsafe), health in zip(self.failsafes, self.health)]
+        if self.order_by_health:
+            # sorting is stable, so options with the same score keep their order
+            options.sort(key=lambda item: item[2].score)
+        return options
+
+    async def _run_option(self, fallback_option, failsafe, health, callable, args, kwargs):
+        if not self.order_by_health:
+            return await failsafe.run(callable, fallback_option, *args, **kwargs)
+
+        started_at = time.monotonic()
+        try:
+            result = await failsafe.run(callable, fallback_option, *args, **kwargs)
+        except FailsafeError:
+            health.record_failure()
+            raise
+        health.record_success(time.monotonic() - started_at)
+        return result
+
+    async def _run(self, callable, *args, **kwargs):
+        deadline = get_deadline()
         recent_exception = None
-        for (fallback_option, failsafe) in self.failsafes:
+        for (fallback_option, failsafe, health) in self._ordered_options():
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.debug("Deadline reached, not trying fallback option {}".format(fallback_option))
+                raise TimeoutExceeded() from recent_exception
+            if _is_open(failsafe.circuit_breaker):
+                logger.debug("Circuit open, skipping fallback option {}".format(fallback_option))
+                recent_exception = recent_exception or CircuitOpen()
+                continue
             try:
-                return await failsafe.run(callable, fallback_option, *args, **kwargs)
+                return await self._run_option(fallback_option, failsafe, health, callable, args, kwargs)
             except FailsafeError as e:
                 recent_exception = e
                 logger.debug("Fallback option {} failed".format(fallback_option))
@@ -67,3 +183,75 @@ class FallbackFailsafe:
 
         logger.debug("No more fallbacks")
         raise FallbacksExhausted("No more fallbacks") from recent_exception
+
+    async def _race(self, callable, *args, **kwargs):
+        deadline = get_deadline()
+        recent_exception = None
+        options = self._ordered_options()
+        next_option = 0
+        running = {}
+        last_started_at = None
+
+        def start_next_option():
+            nonlocal next_option, last_started_at, recent_exception
+            if len(running) >= self.concurrent_options:
+                return
+            while next_option < len(options):
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                fallback_option, failsafe, health = options[next_option]
+                next_option += 1
+                if _is_open(failsafe.circuit_breaker):
+                    logger.debug("Circuit open, skipping fallback option {}".format(fallback_option))
+                    recent_exception = recent_exception or CircuitOpen()
+                    continue
+                task = asyncio.ensure_future(
+                    self._run_option(fallback_option, failsafe, health, callable, args, kwargs))
+                running[task] = fallback_option
+                last_started_at = time.monotonic()
+                return
+
+        try:
+            start_next_option()
+            if self.stagger_seconds is None:
+                for _ in range(self.concurrent_options - 1):
+                    start_next_option()
+
+            while running:
+                timeout = None
+                if self.stagger_seconds is not None and len(running) < self.concurrent_options and \
+                        next_option < len(options):
+                    timeout = max(0, last_started_at + self.stagger_seconds - time.monotonic())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    logger.debug("No fallback option completed after {}s".format(self.stagger_seconds))
+                    start_next_option()
+                    continue
+
+                succeeded = None
+                for task in done:
+                    fallback_option = running.pop(task)
+                    exception = task.exception()
+                    if exception is None:
+                        succeeded = task
+                    elif isinstance(exception, FailsafeError):
+                        recent_exception = exception
+                        logger.debug("Fallback option {} failed".format(fallback_option))
+                    else:
+                        logger.debug("Aborting FallbackFailsafe, exception {}".format(type(exception).__name__))
+                        raise exception
+
+                if succeeded is not None:
+                    return succeeded.result()
+                for _ in done:
+                    start_next_option()
+        finally:
+            for task in running:
+                task.cancel()
+
+        if deadline is not None and time.monotonic() >= deadline and next_option < len(options):
+            raise TimeoutExceeded() from recent_exception
+
+        logger.debug("No more fallbacks")
+        raise FallbacksExhausted("No more fallbacks") from recent_exception
@@ -0,0 +1,99 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from failsafe._internal import _do_nothing
+
+
+class HedgePolicy:
+    """
+    HedgePolicy makes Failsafe launch a second, concurrent attempt when the first one has not
+    completed after a delay. Whichever attempt succeeds first provides the result and the other
+    one is cancelled.
+
+    The delay is either fixed or learned as a percentile of the latencies of recent successful
+    attempts. To bound the extra load put on the downstream, at most `max_hedged_ratio` of the
+    attempts are hedged.
+    """
+
+    def __init__(self, delay_seconds=None, latency_percentile=None, max_hedged_ratio=0.05,
+                 sample_size=1000, min_samples=100, on_hedge=None):
+        """
+        Constructs HedgePolicy.
+
+        :param delay_seconds: fixed delay after which the hedged attempt is launched. When
+            `latency_percentile` is given, it is only used until `min_samples` latencies have been recorded.
+        :param latency_percentile: percentile (0-100) of recent attempt latencies used as the delay,
+            e.g. 95 launches a hedged attempt for the calls slower than 95% of the recent ones.
+        :param max_hedged_ratio: maximum fraction of attempts which can be hedged.
+        :param sample_size: number of recent latencies the percentile is computed from.
+        :param min_samples: number of latencies needed before the percentile is used.
+        :param on_hedge: callable that will be invoked when a hedged attempt is launched
+        """
+        if delay_seconds is None and latency_percentile is None:
+            raise ValueError("Either `delay_seconds` or `latency_percentile` must be provided.")
+        if latency_percentile is not None and not 0 < latency_percentile <= 100:
+            raise ValueError("`latency_percentile` must be between 0 and 100.")
+
+        self.delay_seconds = delay_seconds
+        self.latency_percentile = latency_percentile
+        self.max_hedged_ratio = max_hedged_ratio
+        self.min_samples = min_samples
+
+        self.on_hedge = on_hedge or _do_nothing
+
+        self._samples = [0.0] * sample_size
+        self._samples_count = 0
+        self._refresh_every = max(1, sample_size // 10)
+        self._learned_delay = None
+        self._budget = 0.0
+
+    def delay(self):
+        """
+        Returns the number of seconds after which a hedged attempt should be launched,
+        or None if attempts should not be hedged yet.
+        """
+        if self._learned_delay is not None:
+            return self._learned_delay
+        return self.delay_seconds
+
+    def record_attempt(self):
+        """
+        Records that an attempt was started, which grants `max_hedged_ratio` of a hedge.
+        """
+        self._budget = min(self._budget + self.max_hedged_ratio, 1.0 + self.max_hedged_ratio)
+
+    def allows_hedge(self):
+        """
+        Returns a boolean indicating whether a hedged attempt can be launched without exceeding
+        `max_hedged_ratio`. Launching is assumed when True is returned.
+        """
+        # tolerate the rounding errors accumulated by adding up fractions of a hedge
+        if self._budget < 1.0 - 1e-9:
+            return False
+        self._budget -= 1.0
+        return True
+
+    def record_latency(self, seconds):
+        """
+        Records the duration of a successful attempt.
+        """
+        if self.latency_percentile is None:
+            return
+
+        size = len(self._samples)
+        self._samples[self._samples_count % size] = seconds
+        self._samples_count += 1
+
+        if self._samples_count >= self.min_samples and self._samples_count % self._refresh_every == 0:
+            samples = sorted(self._samples[:min(self._samples_count, size)])
+            index = int(round(self.latency_percentile / 100 * (len(samples) - 1)))
+            self._learned_delay = samples[index]
@@ -0,0 +1,217 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import weakref
+
+from failsafe._internal import _add_weak_transition_listener
+
+
+class LatencyHistogram:
+    """
+    LatencyHistogram counts durations in log-linear buckets, as HdrHistogram does: durations are
+    recorded in microseconds, each power of two is split into `2 ** sub_bucket_bits` buckets of
+    equal width, so the relative error of percentiles is at most `2 ** -sub_bucket_bits`.
+
+    Recording a duration is constant time and does not allocate, the buckets being preallocated
+    up to `max_seconds`. Longer durations are counted in the last bucket.
+    """
+
+    def __init__(self, sub_bucket_bits=3, max_seconds=3600):
+        """
+        Constructs LatencyHistogram.
+
+        :param sub_bucket_bits: number of bits of precision kept, 3 meaning a relative error of 12.5%.
+        :param max_seconds: longest duration told apart from others.
+        """
+        if sub_bucket_bits < 1:
+            raise ValueError("`sub_bucket_bits` must be at least 1.")
+
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_seconds = max_seconds
+        self.count = 0
+        self.sum = 0.0
+
+        self._sub_buckets = 1 << sub_bucket_bits
+        self._max_micros = int(max_seconds * 1000000)
+        self._counts = [0] * (self._index(self._max_micros) + 1)
+
+    def record(self, seconds):
+        # same as _index, inlined as recording is on the path of every attempt
+        micros = int(seconds * 1000000)
+        if micros >= self._max_micros:
+            index = len(self._counts) - 1
+        elif micros < self._sub_buckets:
+            index = micros if micros > 0 else 0
+        else:
+            shift = micros.bit_length() - self.sub_bucket_bits - 1
+            index = (shift + 1) * self._sub_buckets + (micros >> shift) - self._sub_buckets
+        self._counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, percentile):
+        """
+        Returns the duration in seconds which `percentile` percent of the recorded durations do not
+        exceed, rounded up to the upper bound of its bucket, or None if no duration was recorded.
+        """
+        if self.count == 0:
+            return None
+        threshold = self.count * percentile / 100.0
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= threshold:
+                return self._upper_bound(index) / 1000000.0
+        return self._upper_bound(len(self._counts) - 1) / 1000000.0
+
+    def cumulative_counts(self, upper_bounds_seconds):
+        """
+        Returns the number of recorded durations lower than each of the ascending `upper_bounds_seconds`.
+        The bounds are rounded to the bucket boundaries.
+        """
+        cumulative = []
+        seen = 0
+        index = 0
+        for upper_bound in upper_bounds_seconds:
+            micros = int(upper_bound * 1000000)
+            end = len(self._counts) if micros >= self._max_micros else self._index(micros)
+            while index < end:
+                seen += self._counts[index]
+                index += 1
+            cumulative.append(seen)
+        return cumulative
+
+    def _index(self, micros):
+        if micros < self._sub_buckets:
+            return micros
+        shift = micros.bit_length() - self.sub_bucket_bits - 1
+        return (shift + 1) * self._sub_buckets + (micros >> shift) - self._sub_buckets
+
+    def _upper_bound(self, index):
+        if index < self._sub_buckets:
+            return index + 1
+        shift = index // self._sub_buckets - 1
+        mantissa = index % self._sub_buckets + self._sub_buckets
+        return (mantissa + 1) << shift
+
+
+class FailsafeMetrics:
+    """
+    FailsafeMetrics counts what happens in the :class:`failsafe.Failsafe` it is given to, and the
+    durations of its attempts. Counters are plain attributes, which can be read at any time.
+
+    The transitions counted are those of the circuit breaker of the Failsafe. A breaker shared by
+    Failsafe instances having their own metrics has its transitions counted by each of them.
+    """
+
+    def __init__(self, labels=None, latency_histogram=None):
+        """
+        Constructs FailsafeMetrics.
+
+        :param labels: dict of labels identifying the Failsafe in :func:`prometheus_text`.
+        :param latency_histogram: :class:`LatencyHistogram` recording attempt durations.
+            If None, a default one is used.
+        """
+        self.labels = labels or {}
+        self.attempt_latency = latency_histogram or LatencyHistogram()
+
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.aborts = 0
+        self.circuit_rejections = 0
+        self.circuit_opened = 0
+        self.circuit_half_opened = 0
+        self.circuit_closed = 0
+
+        self._observed_circuit_breakers = weakref.WeakSet()
+
+    def observe_circuit_breaker(self, circuit_breaker):
+        """
+        Counts the state transitions of the circuit breaker with a transition listener, held by a weak
+        reference so that the metrics can be collected before the breaker. Transitions are counted once
+        when several Failsafe instances given these metrics share the breaker.
+        """
+        if not hasattr(circuit_breaker, 'add_transition_listener') or \
+                circuit_breaker in self._observed_circuit_breakers:
+            return
+        self._observed_circuit_breakers.add(circuit_breaker)
+        _add_weak_transition_listener(circuit_breaker, self._record_transition)
+
+    def _record_transition(self, state):
+        if state == 'open':
+            self.circuit_opened += 1
+        elif state == 'half-open':
+            self.circuit_half_opened += 1
+        else:
+            self.circuit_closed += 1
+
+
+_COUNTERS = [
+    ('attempts', 'attempts_total', 'Attempts made, retries included.'),
+    ('successes', 'successes_total', 'Successful attempts.'),
+    ('failures', 'failures_total', 'Failed attempts.'),
+    ('retries', 'retries_total', 'Retries after a failed attempt.'),
+    ('aborts', 'aborts_total', 'Calls aborted by an abortable exception.'),
+    ('circuit_rejections', 'circuit_rejections_total', 'Calls rejected because the circuit was open.'),
+    ('circuit_opened', 'circuit_opened_total', 'Transitions of the circuit breaker to open.'),
+    ('circuit_half_opened', 'circuit_half_opened_total', 'Transitions of the circuit breaker to half open.'),
+    ('circuit_closed', 'circuit_closed_total', 'Transitions of the circuit breaker to closed.'),
+]
+
+# powers of four from 1 microsecond to about 70 minutes, aligned with the histogram buckets
+_LATENCY_BUCKETS = [4 ** exponent / 1000000.0 for exponent in range(17)]
+
+
+def prometheus_text(metrics, prefix='failsafe'):
+    """
+    Returns the metrics in the Prometheus text exposition format.
+
+    :param metrics: :class:`FailsafeMetrics` or list of them, told apart by their labels.
+    :param prefix: prefix of the metric names.
+    """
+    if isinstance(metrics, FailsafeMetrics):
+        metrics = [metrics]
+
+    lines = []
+    for attribute, name, description in _COUNTERS:
+        name = '{}_{}'.format(prefix, name)
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} counter'.format(name))
+        for failsafe_metrics in metrics:
+            lines.append('{}{} {}'.format(name, _labels(failsafe_metrics.labels), getattr(failsafe_metrics, attribute)))
+
+    name = '{}_attempt_duration_seconds'.format(prefix)
+    lines.append('# HELP {} Duration of the attempts.'.format(name))
+    lines.append('# TYPE {} histogram'.format(name))
+    for failsafe_metrics in metrics:
+        histogram = failsafe_metrics.attempt_latency
+        for upper_bound, count in zip(_LATENCY_BUCKETS, histogram.cumulative_counts(_LATENCY_BUCKETS)):
+            labels = _labels(failsafe_metrics.labels, le='{:g}'.format(upper_bound))
+            lines.append('{}_bucket{} {}'.format(name, labels, count))
+        lines.append('{}_bucket{} {}'.format(name, _labels(failsafe_metrics.labels, le='+Inf'), histogram.count))
+        lines.append('{}_sum{} {!r}'.format(name, _labels(failsafe_metrics.labels), histogram.sum))
+        lines.append('{}_count{} {}'.format(name, _labels(failsafe_metrics.labels), histogram.count))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, _escape(value)) for key, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
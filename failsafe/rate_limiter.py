@@ -0,0 +1,110 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+
+from failsafe._internal import _do_nothing, _safe_call
+from failsafe.failsafe import FailsafeError
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(FailsafeError):
+    pass
+
+
+class RateLimiter:
+    """
+    RateLimiter limits the rate of executions to `calls_per_second`, allowing for bursts of up to
+    `burst` executions. It implements the generic cell rate algorithm, so acquiring a permit is
+    constant time and no background task is needed to refill permits.
+
+    Executions over the rate either wait for a permit, for at most `max_wait_seconds`, or are
+    rejected immediately when `max_wait_seconds` is 0.
+    """
+
+    def __init__(self, calls_per_second, burst=1, max_wait_seconds=0, on_reject=None):
+        """
+        Constructs RateLimiter.
+
+        :param calls_per_second: sustained rate of executions allowed.
+        :param burst: number of executions which can be performed at once after a period of inactivity.
+        :param max_wait_seconds: maximum time to wait for a permit. 0 means executions over the rate are
+            rejected immediately, None means executions wait as long as needed.
+        :param on_reject: callable that will be invoked when an execution is rejected
+        """
+        if calls_per_second <= 0:
+            raise ValueError("`calls_per_second` must be positive.")
+        if burst < 1:
+            raise ValueError("`burst` must be at least 1.")
+
+        self.calls_per_second = calls_per_second
+        self.burst = burst
+        self.max_wait_seconds = max_wait_seconds
+
+        self.on_reject = on_reject or _do_nothing
+
+        self._interval = 1.0 / calls_per_second
+        self._tolerance = self._interval * (burst - 1)
+        self._theoretical_arrival = time.monotonic()
+
+    def try_acquire(self):
+        """
+        Returns a boolean indicating whether an execution is allowed right now, and takes a permit if so.
+        """
+        return self._reserve(0) == 0
+
+    async def acquire(self, max_wait_seconds=None):
+        """
+        Waits for a permit to execute.
+
+        :param max_wait_seconds: maximum time to wait, further limiting the `max_wait_seconds` of the limiter.
+        :raises: RateLimitExceeded when no permit can be obtained in time.
+        """
+        if max_wait_seconds is None:
+            max_wait_seconds = self.max_wait_seconds
+        elif self.max_wait_seconds is not None:
+            max_wait_seconds = min(max_wait_seconds, self.max_wait_seconds)
+
+        wait = self._reserve(max_wait_seconds)
+        if wait is None:
+            logger.debug("Rate limit exceeded, rejecting execution")
+            _safe_call(self.on_reject)
+            raise RateLimitExceeded()
+
+        if wait > 0:
+            reserved_arrival = self._theoretical_arrival
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # give the permit back unless a later execution has reserved one after it
+                if self._theoretical_arrival == reserved_arrival:
+                    self._theoretical_arrival -= self._interval
+                raise
+
+    def _reserve(self, max_wait_seconds):
+        """
+        Reserves a permit if it can be obtained within `max_wait_seconds`, returning the time
+        to wait for it, or None if it cannot.
+        """
+        now = time.monotonic()
+        theoretical_arrival = max(self._theoretical_arrival, now)
+        wait = theoretical_arrival - self._tolerance - now
+        if wait < 0:
+            wait = 0
+        if max_wait_seconds is not None and wait > max_wait_seconds:
+            return None
+
+        self._theoretical_arrival = theoretical_arrival + self._interval
+        return wait
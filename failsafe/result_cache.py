@@ -0,0 +1,141 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from failsafe.deadline import _current_deadline
+from failsafe.failsafe import CircuitOpen, RetriesExhausted
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry(object):
+
+    def __init__(self, value, stored_at):
+        self.value = value
+        self.stored_at = stored_at
+
+
+class ResultCache:
+    """
+    ResultCache keeps the results of successful :class:`failsafe.Failsafe` calls, keyed by the call
+    arguments, so that repeated calls do not reach the wrapped method.
+
+    A result is fresh for `ttl_seconds`. For `stale_while_revalidate_seconds` more, it is still returned
+    while a single background call refreshes it. For `stale_if_error_seconds` after it expired, it is
+    returned instead of raising when the call fails with one of the `stale_if_error` exceptions, which
+    are :class:`failsafe.CircuitOpen` and :class:`failsafe.RetriesExhausted` by default.
+
+    The cache holds at most `max_size` results, evicting the least recently used one.
+    """
+
+    def __init__(self, ttl_seconds, max_size=1000, stale_while_revalidate_seconds=0, stale_if_error_seconds=0,
+                 stale_if_error=(CircuitOpen, RetriesExhausted), key=None):
+        """
+        Constructs ResultCache.
+
+        :param ttl_seconds: time during which a result is returned without calling the method.
+        :param max_size: maximum number of results kept.
+        :param stale_while_revalidate_seconds: time after `ttl_seconds` during which an expired result is
+            returned while it is refreshed in the background.
+        :param stale_if_error_seconds: time after `ttl_seconds` during which an expired result is returned
+            when the call fails with one of the `stale_if_error` exceptions.
+        :param stale_if_error: exception types replaced by an expired result.
+        :param key: function called with the arguments of :meth:`failsafe.Failsafe.run` returning a hashable
+            key. If None, the key is made of the method and its arguments, which must be hashable.
+        """
+        if ttl_seconds <= 0:
+            raise ValueError("`ttl_seconds` must be positive.")
+        if max_size < 1:
+            raise ValueError("`max_size` must be at least 1.")
+
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.stale_while_revalidate_seconds = stale_while_revalidate_seconds
+        self.stale_if_error_seconds = stale_if_error_seconds
+        self.stale_if_error = stale_if_error
+        self.key = key
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        self._retention_seconds = ttl_seconds + max(stale_while_revalidate_seconds, stale_if_error_seconds)
+        self._entries = OrderedDict()
+        self._refreshing = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def run(self, run, callable, args, kwargs):
+        """
+        Returns the cached result of the call, calling `run(callable, args, kwargs)` to get it when
+        there is none.
+        """
+        if self.key is None:
+            key = (callable, args, tuple(sorted(kwargs.items())))
+        else:
+            key = self.key(*args, **kwargs)
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = now - entry.stored_at
+            if age >= self._retention_seconds:
+                del self._entries[key]
+                entry = None
+            else:
+                self._entries.move_to_end(key)
+                if age < self.ttl_seconds:
+                    self.hits += 1
+                    return entry.value
+                if age < self.ttl_seconds + self.stale_while_revalidate_seconds:
+                    self.stale += 1
+                    if key not in self._refreshing:
+                        logger.debug("Refreshing stale result in the background")
+                        self._refreshing[key] = asyncio.ensure_future(self._refresh(key, run, callable, args, kwargs))
+                    return entry.value
+
+        self.misses += 1
+        try:
+            value = await run(callable, args, kwargs)
+        except self.stale_if_error:
+            if entry is None or now - entry.stored_at >= self.ttl_seconds + self.stale_if_error_seconds:
+                raise
+            logger.debug("Call failed, returning stale result")
+            self.stale += 1
+            return entry.value
+
+        self._store(key, value)
+        return value
+
+    async def _refresh(self, key, run, callable, args, kwargs):
+        # the refresh outlives the call which triggered it, so it is not bound by its deadline
+        _current_deadline.set(None)
+        try:
+            self._store(key, await run(callable, args, kwargs))
+        except Exception as e:
+            logger.debug("Background refresh failed with {}".format(type(e).__name__))
+        finally:
+            del self._refreshing[key]
+
+    def _store(self, key, value):
+        self._entries[key] = _Entry(value, time.monotonic())
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -11,16 +11,60 @@
 # limitations under the License.
 
 from datetime import timedelta
+from email.utils import parsedate_to_datetime
+import logging
 import random
+import time
 
-from failsafe._internal import _do_nothing
+from failsafe._internal import _do_nothing, _safe_call
+
+logger = logging.getLogger(__name__)
+
+
+def get_retry_after(exception):
+    """
+    Returns the time in seconds after which the server raising `exception` asked to be called again,
+    taken from its `retry_after_seconds` attribute, or None if it gave no hint. A negative value means
+    that the server asked not to retry at all.
+
+    Exceptions raised by the callables given to :class:`failsafe.Failsafe` can set the attribute from
+    an HTTP `Retry-After` header, see :func:`parse_retry_after`, or from a gRPC pushback.
+    """
+    return getattr(exception, 'retry_after_seconds', None)
+
+
+def parse_retry_after(value):
+    """
+    Returns the seconds to wait given by the value of an HTTP `Retry-After` header, either a number
+    of seconds or a date, or None if the value is missing or invalid.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at is None or retry_at.tzinfo is None:
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
 
 
 class Backoff:
     """
     Base class to determine how long to wait between calls.
     """
-    def __init__(self, delay, max_delay, factor=2, jitter=False):
+    def __init__(self, delay, max_delay, factor=2, jitter=False, seed=None):
+        """
+        :param delay: wait before the first retry, as a `datetime.timedelta`.
+        :param max_delay: maximum wait between calls, as a `datetime.timedelta`.
+        :param factor: factor by which the wait grows with every attempt.
+        :param jitter: if True, the wait is random between 0 and the wait for the attempt.
+        :param seed: seed of the random number generator of this backoff, to make the jitter reproducible.
+            If None, the global generator of the `random` module is used.
+        """
         if not isinstance(delay, timedelta):
             raise ValueError("`delay` must be an instance of `datetime.timedelta`.")
         if not isinstance(max_delay, timedelta):
@@ -30,6 +74,7 @@ class Backoff:
         self.max_delay = max_delay
         self.factor = factor
         self.jitter = jitter
+        self.random = random if seed is None else random.Random(seed)
 
     def for_attempt(self, attempt):
         """
@@ -46,7 +91,7 @@ class Backoff:
         delay = self.delay.total_seconds()
         duration = float(delay * pow(self.factor, attempt - 1))
         if self.jitter is True:
-            duration = random.uniform(0.0, duration)
+            duration = self.random.uniform(0.0, duration)
         max_delay = self.max_delay.total_seconds()
 
         if duration > max_delay:
@@ -54,6 +99,78 @@ class Backoff:
 
         return duration
 
+    def for_attempt_after(self, attempt, previous_delay, retry_after_seconds=None):
+        """
+        Returns the amount of time to wait before the next attempt, in seconds, knowing the
+        previous wait. Subclasses whose wait depends on the previous one should override this
+        method, the others only need to override `for_attempt`.
+
+        :param attempt: Specifies how many attempts have already happened.
+        :param previous_delay: The previous wait in seconds, or None before the first retry.
+        :param retry_after_seconds: time after which the server asked to be called again, if any.
+            The wait is never shorter, even if it exceeds `max_delay`.
+        """
+        return self._honour_retry_after(self.for_attempt(attempt), retry_after_seconds)
+
+    def _honour_retry_after(self, duration, retry_after_seconds):
+        if retry_after_seconds is not None and retry_after_seconds > duration:
+            return float(retry_after_seconds)
+        return duration
+
+    def _capped_exponential(self, attempt):
+        if attempt < 1:
+            raise ValueError("`attempt` must be a positive integer.")
+
+        duration = float(self.delay.total_seconds() * pow(self.factor, attempt - 1))
+        return min(duration, self.max_delay.total_seconds())
+
+
+class FullJitterBackoff(Backoff):
+    """
+    Exponential backoff where the wait is random between 0 and the capped exponential wait.
+    """
+    def __init__(self, delay, max_delay, factor=2, seed=None):
+        super(FullJitterBackoff, self).__init__(delay, max_delay, factor=factor, seed=seed)
+
+    def for_attempt(self, attempt):
+        return self.random.uniform(0.0, self._capped_exponential(attempt))
+
+
+class EqualJitterBackoff(Backoff):
+    """
+    Exponential backoff where the wait is at least half of the capped exponential wait,
+    with the other half being random.
+    """
+    def __init__(self, delay, max_delay, factor=2, seed=None):
+        super(EqualJitterBackoff, self).__init__(delay, max_delay, factor=factor, seed=seed)
+
+    def for_attempt(self, attempt):
+        half = self._capped_exponential(attempt) / 2
+        return half + self.random.uniform(0.0, half)
+
+
+class DecorrelatedJitterBackoff(Backoff):
+    """
+    Backoff where the wait is random between `delay` and `factor` times the previous wait,
+    capped at `max_delay`. Successive waits are not tied to the attempt number, which spreads
+    the retries of many clients better than the other strategies.
+    """
+    def __init__(self, delay, max_delay, factor=3, seed=None):
+        super(DecorrelatedJitterBackoff, self).__init__(delay, max_delay, factor=factor, seed=seed)
+
+    def for_attempt(self, attempt):
+        return self.for_attempt_after(attempt, None)
+
+    def for_attempt_after(self, attempt, previous_delay, retry_after_seconds=None):
+        if attempt < 1:
+            raise ValueError("`attempt` must be a positive integer.")
+
+        delay = self.delay.total_seconds()
+        if previous_delay is None or previous_delay < delay:
+            previous_delay = delay
+        duration = self.random.uniform(delay, previous_delay * self.factor)
+        return self._honour_retry_after(min(duration, self.max_delay.total_seconds()), retry_after_seconds)
+
 
 class Delay(Backoff):
     """
@@ -63,6 +180,75 @@ class Delay(Backoff):
         super(Delay, self).__init__(delay, delay, factor=1, jitter=False)
 
 
+class RetryBudget:
+    """
+    RetryBudget limits the number of retries relative to the number of successful calls, to
+    prevent retry storms when a downstream is failing. Every success deposits `retry_ratio` of a
+    token and every retry withdraws one, so at most `retry_ratio` retries happen per success.
+    Additionally, `min_retries_per_second` retries are always allowed, so that low traffic
+    callers can still retry.
+
+    A budget can be shared by any number of `RetryPolicy` instances, for instance by all the
+    policies of a service calling the same downstream.
+    """
+
+    def __init__(self, retry_ratio=0.1, min_retries_per_second=10, max_tokens=100, on_exhausted=None):
+        """
+        Constructs RetryBudget.
+
+        :param retry_ratio: number of retries allowed per successful call.
+        :param min_retries_per_second: number of retries per second allowed regardless of the successes.
+        :param max_tokens: maximum number of retries which can be saved up by successful calls.
+        :param on_exhausted: callable that will be invoked when a retry is denied by the budget
+        """
+        self.retry_ratio = retry_ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.max_tokens = max_tokens
+
+        self.on_exhausted = on_exhausted or _do_nothing
+
+        self.tokens = 0.0
+        self.exhausted_count = 0
+        self._reserve = float(min_retries_per_second)
+        self._reserve_updated_at = time.monotonic()
+
+    def deposit(self):
+        """
+        Records a successful call, allowing for `retry_ratio` more retries.
+        """
+        self.tokens = min(self.tokens + self.retry_ratio, self.max_tokens)
+
+    def try_withdraw(self):
+        """
+        Returns a boolean indicating whether a retry is allowed, and withdraws it from the budget if so.
+        """
+        now = time.monotonic()
+        if self.min_retries_per_second:
+            elapsed = now - self._reserve_updated_at
+            self._reserve = min(self._reserve + elapsed * self.min_retries_per_second,
+                                float(self.min_retries_per_second))
+            self._reserve_updated_at = now
+            if self._reserve >= 1.0:
+                self._reserve -= 1.0
+                return True
+
+        # tolerate the rounding errors accumulated by adding up fractions of a token
+        if self.tokens >= 1.0 - 1e-9:
+            self.tokens = max(self.tokens - 1.0, 0.0)
+            return True
+
+        self.exhausted_count += 1
+        logger.debug("Retry budget exhausted")
+        _safe_call(self.on_exhausted)
+        return False
+
+    def refund(self):
+        """
+        Gives back a retry withdrawn with :meth:`try_withdraw` which was not made after all.
+        """
+        self.tokens = min(self.tokens + 1.0, self.max_tokens)
+
+
 class RetryPolicy:
     """
     Model to store the number of allowed retries, the allowed retriable exceptions
@@ -70,7 +256,8 @@ class RetryPolicy:
     """
 
     def __init__(self, allowed_retries=3, retriable_exceptions=None, abortable_exceptions=None, backoff=None,
-                 on_retry=None, on_retries_exhausted=None, on_failed_attempt=None, on_abort=None):
+                 on_retry=None, on_retries_exhausted=None, on_failed_attempt=None, on_abort=None, retry_budget=None,
+                 max_retry_after_seconds=None):
         """
         Constructs RetryPolicy.
 
@@ -85,6 +272,11 @@ class RetryPolicy:
         :param on_retries_exhausted: callable that will be invoked on a retries exhausted event
         :param on_failed_attempt: callable that will be invoked on a failed attempt event
         :param on_abort: callable that will be invoked on an abort event
+        :param retry_budget: :class:`RetryBudget` shared with other policies, limiting the overall number of
+            retries. If None, only `allowed_retries` limits the retries.
+        :param max_retry_after_seconds: longest wait asked by a server through the `retry_after_seconds`
+            attribute of an exception, see :func:`failsafe.get_retry_after`, before retrying. Calls asked to
+            wait longer are not retried. If None, any wait asked is honoured.
         """
         self.allowed_retries = allowed_retries
         self.retriable_exceptions = retriable_exceptions
@@ -98,20 +290,40 @@ class RetryPolicy:
         if backoff is None:
             backoff = Delay(timedelta(0))
         self.backoff = backoff
+        self.retry_budget = retry_budget
+        self.max_retry_after_seconds = max_retry_after_seconds
 
     def should_retry(self, context, exception):
         """
         Returns a boolean indicating if a retry should be performed taking into
-        account the number of attempts already performed and the retriable_exceptions.
+        account the number of attempts already performed, the retriable_exceptions, the retry budget and
+        the retry hint of the exception, along with the time to wait before retrying. A retry is never
+        made sooner than the server asked, nor when it asked not to retry.
 
         :param context: :class:`failsafe.failsafe.Context`.
         :param exception: Exception which caused failure to be considered
             retriable or not raised during the execution.
         """
         should_retry = context.attempts <= self.allowed_retries and self._is_retriable_exception(exception)
+        retry_after_seconds = get_retry_after(exception) if should_retry else None
+        if retry_after_seconds is not None:
+            if retry_after_seconds < 0:
+                logger.debug("Not retrying, the server asked not to")
+                should_retry = False
+            elif self.max_retry_after_seconds is not None and retry_after_seconds > self.max_retry_after_seconds:
+                logger.debug("Not retrying, the server asked to wait for {} seconds".format(retry_after_seconds))
+                should_retry = False
+        if should_retry and self.retry_budget is not None:
+            should_retry = self.retry_budget.try_withdraw()
 
         if should_retry:
-            wait_for = self.backoff.for_attempt(context.attempts)
+            # custom backoffs may not take hints
+            if retry_after_seconds is None:
+                wait_for = self.backoff.for_attempt_after(context.attempts, context.previous_delay)
+            else:
+                wait_for = self.backoff.for_attempt_after(context.attempts, context.previous_delay,
+                                                          retry_after_seconds)
+            context.previous_delay = wait_for
             return True, wait_for
 
         return False, None
@@ -0,0 +1,244 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from failsafe._internal import _do_nothing, _notify, _safe_call
+from failsafe.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+_CLOSED = 0
+_OPEN = 1
+_HALF_OPEN = 2
+
+_STATE_NAMES = {_CLOSED: 'closed', _OPEN: 'open', _HALF_OPEN: 'half-open'}
+
+# generation, state, consecutive failures, opened at, half-open attempts, generation again
+_RECORD = struct.Struct('<qb7xqdqq')
+_HEADER_SIZE = 8
+_FILE_SIZE = _HEADER_SIZE + 2 * _RECORD.size
+
+
+class SharedCircuitBreaker(CircuitBreaker):
+    """
+    A CircuitBreaker whose state is shared by every process of the host opening it with the same `path`,
+    such as pre-forked workers, so that they open, half open and close together. It counts consecutive
+    failures like :class:`failsafe.CircuitBreaker`, and the executions allowed while half open are
+    counted across processes.
+
+    The state is kept in a memory mapped file, preferably on a memory file system such as `/dev/shm`.
+    Updates are serialized with an exclusive `flock`, which the system releases if a process dies.
+    They are written to the inactive one of two records before switching the active record with a
+    single byte write, so that a process dying in the middle of an update leaves the previous state
+    in place. Reads take no lock: a record changed while being read is detected by its generation
+    number, written at both ends, and read again.
+
+    Callbacks and transition listeners are only invoked in the process making the transition. Only
+    available on POSIX systems.
+    """
+
+    def __init__(self, path, maximum_failures=2, reset_timeout_seconds=60, half_open_ratio=0.1,
+                 on_open=None, on_half_open=None, on_close=None, open_on_retry_after=False):
+        """
+        Constructs SharedCircuitBreaker, creating the file at `path` in the closed state if it does not exist.
+
+        :param path: path of the file holding the state, the same for every process sharing the breaker.
+        :param open_on_retry_after: whether Failsafe opens the circuit for the time asked by a failure
+            carrying a retry hint, in every process.
+        """
+        if fcntl is None:
+            raise RuntimeError("SharedCircuitBreaker needs `fcntl`, which is not available on this system.")
+
+        self.path = path
+        self.maximum_failures = maximum_failures
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.half_open_ratio = half_open_ratio
+        self.open_on_retry_after = open_on_retry_after
+
+        self.on_open = on_open or _do_nothing
+        self.on_half_open = on_half_open or _do_nothing
+        self.on_close = on_close or _do_nothing
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # a file of zeros holds a valid closed state
+                if os.fstat(fd).st_size < _FILE_SIZE:
+                    os.ftruncate(fd, _FILE_SIZE)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, _FILE_SIZE)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def close_file(self):
+        """
+        Releases the memory mapped file. The breaker cannot be used anymore.
+        """
+        self._map.close()
+        os.close(self._fd)
+
+    def allows_execution(self):
+        state, _, opened_at, _ = self._read()
+        if state == _CLOSED:
+            return True
+        if state == _OPEN and time.monotonic() <= opened_at + self.reset_timeout_seconds:
+            return False
+        return self._update(self._allow)
+
+    def record_success(self, duration_seconds=None):
+        state, failures, _, _ = self._read()
+        if state == _CLOSED and failures == 0:
+            return
+        self._update(self._succeed)
+        logger.debug("Success recorded")
+
+    def record_failure(self, duration_seconds=None):
+        if self._read()[0] == _OPEN:
+            return
+        self._update(self._fail)
+        logger.debug("Failure recorded")
+
+    def release_permit(self):
+        # executions are allowed by ratio while half open, without permits
+        pass
+
+    def is_open(self):
+        state, _, opened_at, _ = self._read()
+        return state == _OPEN and time.monotonic() <= opened_at + self.reset_timeout_seconds
+
+    def open(self):
+        self._update(lambda record: (None, (_OPEN, 0, time.monotonic(), 0), self._on_open))
+
+    def open_for(self, seconds):
+        """
+        Opens the circuit for `seconds` rather than `reset_timeout_seconds`, in every process. The
+        record keeps the time of the opening, which is set so that the circuit half opens at the
+        hinted time. An open circuit stays open for at least `seconds`.
+        """
+        self._update(lambda record: self._open_for(record, seconds))
+
+    def half_open(self):
+        self._update(lambda record: (None, (_HALF_OPEN, 0, record[2], 0), self._on_half_open))
+
+    def close(self):
+        self._update(lambda record: (None, (_CLOSED, 0, 0.0, 0), self._on_close))
+
+    @property
+    def current_state(self):
+        return _STATE_NAMES[self._read()[0]]
+
+    def _allow(self, record):
+        state, failures, opened_at, attempts = record
+        if state == _CLOSED:
+            return True, None, None
+        if state == _OPEN:
+            if time.monotonic() <= opened_at + self.reset_timeout_seconds:
+                return False, None, None
+            # the first process noticing the end of the reset timeout half opens the circuit
+            return True, (_HALF_OPEN, 0, opened_at, 0), self._on_half_open
+        attempts += 1
+        return attempts % 100 < 100 * self.half_open_ratio, (state, failures, opened_at, attempts), None
+
+    def _succeed(self, record):
+        state, failures, opened_at, attempts = record
+        if state == _CLOSED and failures:
+            return None, (_CLOSED, 0, opened_at, attempts), None
+        if state == _HALF_OPEN:
+            return None, (_CLOSED, 0, 0.0, 0), self._on_close
+        return None, None, None
+
+    def _fail(self, record):
+        state, failures, opened_at, attempts = record
+        if state == _CLOSED and failures + 1 < self.maximum_failures:
+            return None, (_CLOSED, failures + 1, opened_at, attempts), None
+        if state == _OPEN:
+            return None, None, None
+        return None, (_OPEN, 0, time.monotonic(), 0), self._on_open
+
+    def _open_for(self, record, seconds):
+        state, _, opened_at, _ = record
+        hinted_opened_at = time.monotonic() + seconds - self.reset_timeout_seconds
+        if state == _OPEN:
+            if hinted_opened_at <= opened_at:
+                return None, None, None
+            return None, (_OPEN, 0, hinted_opened_at, 0), None
+        return None, (_OPEN, 0, hinted_opened_at, 0), self._on_open
+
+    def _on_open(self):
+        logger.debug("Opened")
+        _safe_call(self.on_open)
+        _notify(self._transition_listeners, 'open')
+
+    def _on_half_open(self):
+        logger.debug("Half opened")
+        _safe_call(self.on_half_open)
+        _notify(self._transition_listeners, 'half-open')
+
+    def _on_close(self):
+        logger.debug("Closed")
+        _safe_call(self.on_close)
+        _notify(self._transition_listeners, 'closed')
+
+    def _read(self):
+        data = self._map
+        while True:
+            offset = _HEADER_SIZE + data[0] * _RECORD.size
+            generation, state, failures, opened_at, attempts, check = _RECORD.unpack_from(data, offset)
+            if generation == check:
+                return state, failures, opened_at, attempts
+
+    def _update(self, transition):
+        """
+        Calls `transition` with the current record under the lock. It returns the result of the update,
+        the new record or None to keep the current one, and a callable invoked once the lock is released.
+        """
+        fd = self._lock_fd()
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            data = self._map
+            active = data[0]
+            offset = _HEADER_SIZE + active * _RECORD.size
+            generation, state, failures, opened_at, attempts, _ = _RECORD.unpack_from(data, offset)
+            result, record, callback = transition((state, failures, opened_at, attempts))
+            if record is not None:
+                inactive = 1 - active
+                _RECORD.pack_into(data, _HEADER_SIZE + inactive * _RECORD.size, generation + 1, *record,
+                                  generation + 1)
+                data[0] = inactive
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        if callback is not None:
+            callback()
+        return result
+
+    def _lock_fd(self):
+        # flock locks belong to the open file, which is shared with the processes forked after it was
+        # opened, so each process opens the file again to lock it
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR)
+            self._pid = os.getpid()
+        return self._fd
@@ -15,5 +15,6 @@ setup(
     license="Apache",
     include_package_data=True,
     platforms="any",
+    python_requires=">=3.7",
     install_requires=[]
 )
@@ -0,0 +1,30 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class SomeAbortableException(Exception):
+    pass
+
+
+def create_operation(*outcomes):
+    """
+    Returns an operation returning or raising the given outcomes in turn, counting its calls in `called`.
+    """
+    async def operation():
+        outcome = outcomes[operation.called]
+        operation.called += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    operation.called = 0
+    return operation
@@ -0,0 +1,155 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+
+import pytest
+
+from failsafe import (
+    Failsafe, AdaptiveBulkhead, AIMDLimit, GradientLimit, BulkheadFull, RetryPolicy, RetriesExhausted,
+)
+
+loop = asyncio.get_event_loop()
+
+
+class TestAIMDLimit:
+
+    def test_increases_when_limit_is_used(self):
+        limit = AIMDLimit(initial_limit=10)
+        limit.update(0.1, in_flight=5, dropped=False)
+        assert limit.current_limit == 11
+
+    def test_does_not_increase_when_limit_is_not_used(self):
+        limit = AIMDLimit(initial_limit=10)
+        limit.update(0.1, in_flight=4, dropped=False)
+        assert limit.current_limit == 10
+
+    def test_decreases_on_drop(self):
+        limit = AIMDLimit(initial_limit=10, backoff_ratio=0.5)
+        limit.update(0.1, in_flight=10, dropped=True)
+        assert limit.current_limit == 5
+
+    def test_decreases_on_slow_execution(self):
+        limit = AIMDLimit(initial_limit=10, backoff_ratio=0.5, rtt_threshold_seconds=1)
+        limit.update(2, in_flight=10, dropped=False)
+        assert limit.current_limit == 5
+
+    def test_stays_within_bounds(self):
+        limit = AIMDLimit(initial_limit=2, min_limit=2, max_limit=3, backoff_ratio=0.5)
+        for _ in range(5):
+            limit.update(0.1, in_flight=3, dropped=False)
+        assert limit.current_limit == 3
+        for _ in range(5):
+            limit.update(0.1, in_flight=3, dropped=True)
+        assert limit.current_limit == 2
+
+    def test_history_records_changes(self):
+        limit = AIMDLimit(initial_limit=10, backoff_ratio=0.5, history_size=2)
+        limit.update(0.1, in_flight=10, dropped=False)
+        limit.update(0.1, in_flight=4, dropped=False)
+        limit.update(0.1, in_flight=10, dropped=True)
+
+        assert [value for _, value in limit.history] == [11, 5]
+
+
+class TestGradientLimit:
+
+    def test_grows_while_latency_is_stable(self):
+        limit = GradientLimit(initial_limit=10)
+        for _ in range(20):
+            limit.update(0.1, in_flight=limit.current_limit, dropped=False)
+        assert limit.current_limit > 10
+
+    def test_shrinks_when_latency_increases(self):
+        limit = GradientLimit(initial_limit=50, smoothing=0.5)
+        for _ in range(100):
+            limit.update(0.1, in_flight=50, dropped=False)
+        grown = limit.current_limit
+
+        for _ in range(10):
+            limit.update(1.0, in_flight=limit.current_limit, dropped=False)
+        assert limit.current_limit < grown
+
+    def test_does_not_change_when_limit_is_not_used(self):
+        limit = GradientLimit(initial_limit=10)
+        limit.update(5.0, in_flight=1, dropped=False)
+        assert limit.current_limit == 10
+
+    def test_instant_executions_are_sampled(self):
+        limit = GradientLimit(initial_limit=10)
+        for _ in range(20):
+            limit.update(0.0, in_flight=limit.current_limit, dropped=False)
+        assert limit.current_limit > 10
+        limit.update(0.1, in_flight=limit.current_limit, dropped=False)
+
+
+class TestAdaptiveBulkhead(unittest.TestCase):
+
+    def test_uses_learned_limit(self):
+        bulkhead = AdaptiveBulkhead(limit=AIMDLimit(initial_limit=2, backoff_ratio=0.5))
+
+        async def scenario():
+            await bulkhead.acquire()
+            await bulkhead.acquire()
+            with pytest.raises(BulkheadFull):
+                await bulkhead.acquire()
+
+            bulkhead.release(0.1, dropped=True)
+            assert bulkhead.limit.current_limit == 1
+            with pytest.raises(BulkheadFull):
+                await bulkhead.acquire()
+
+        loop.run_until_complete(scenario())
+
+    def test_lowered_limit_is_not_handed_over_to_waiters(self):
+        bulkhead = AdaptiveBulkhead(limit=AIMDLimit(initial_limit=2, backoff_ratio=0.5), max_queued_calls=1)
+
+        async def scenario():
+            await bulkhead.acquire()
+            await bulkhead.acquire()
+            waiting = asyncio.ensure_future(bulkhead.acquire())
+            await asyncio.sleep(0)
+
+            bulkhead.release(0.1, dropped=True)
+            await asyncio.sleep(0)
+            assert not waiting.done()
+
+            bulkhead.release()
+            await waiting
+
+        loop.run_until_complete(scenario())
+
+    def test_failsafe_feeds_attempt_timeouts_to_limit(self):
+        bulkhead = AdaptiveBulkhead(limit=AIMDLimit(initial_limit=10, backoff_ratio=0.5))
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1), bulkhead=bulkhead,
+                            attempt_timeout_seconds=0.01)
+
+        async def operation():
+            await asyncio.sleep(1)
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(operation))
+
+        assert bulkhead.limit.current_limit == 2
+        assert bulkhead.in_flight == 0
+
+    def test_failsafe_feeds_round_trip_times_to_limit(self):
+        bulkhead = AdaptiveBulkhead(limit=AIMDLimit(initial_limit=1))
+        failsafe = Failsafe(bulkhead=bulkhead)
+
+        async def operation():
+            pass
+
+        loop.run_until_complete(failsafe.run(operation))
+
+        assert bulkhead.limit.current_limit == 2
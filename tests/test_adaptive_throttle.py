@@ -0,0 +1,146 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest.mock import patch, Mock
+
+import pytest
+
+from failsafe import Failsafe, AdaptiveThrottle, RequestThrottled, RetryPolicy, RetriesExhausted
+
+loop = asyncio.get_event_loop()
+
+
+class OverloadedError(Exception):
+    pass
+
+
+class TestAdaptiveThrottle:
+
+    def test_parameters_are_validated(self):
+        with pytest.raises(ValueError):
+            AdaptiveThrottle(k=0.5)
+        with pytest.raises(ValueError):
+            AdaptiveThrottle(window_seconds=0)
+
+    def test_nothing_is_rejected_while_requests_are_accepted(self):
+        throttle = AdaptiveThrottle(k=2)
+        for _ in range(100):
+            throttle.acquire()
+            throttle.record_accept()
+        assert throttle.rejection_probability == 0
+        assert (throttle.requests, throttle.accepts) == (100, 100)
+
+    def test_rejection_probability(self):
+        throttle = AdaptiveThrottle(k=2)
+        for _ in range(20):
+            throttle.record_accept()
+        for _ in range(79):
+            throttle.record_rejection()
+
+        # (99 - 2 * 20) / (99 + 1)
+        assert throttle.rejection_probability == pytest.approx(0.59)
+
+    def test_rejections_are_random_and_counted_as_requests(self):
+        on_reject = Mock()
+        throttle = AdaptiveThrottle(k=1, on_reject=on_reject)
+        throttle.record_rejection()
+        throttle.random = Mock()
+
+        throttle.random.random.return_value = 0.6
+        throttle.acquire()
+        assert throttle.requests == 1
+
+        throttle.random.random.return_value = 0.4
+        with pytest.raises(RequestThrottled):
+            throttle.acquire()
+        assert (throttle.requests, throttle.accepts) == (2, 0)
+        on_reject.assert_called_once_with()
+
+    def test_seeded_throttle_is_reproducible(self):
+        outcomes = []
+        for _ in range(2):
+            throttle = AdaptiveThrottle(seed=42)
+            for _ in range(10):
+                throttle.record_rejection()
+            outcomes.append([throttle.try_acquire() for _ in range(20)])
+        assert outcomes[0] == outcomes[1]
+
+    @patch('time.monotonic')
+    def test_window_forgets_old_requests(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        throttle = AdaptiveThrottle(window_seconds=10)
+        for _ in range(10):
+            throttle.record_rejection()
+        assert throttle.rejection_probability > 0
+
+        monotonic_mock.return_value = 10
+        assert throttle.rejection_probability == 0
+        assert throttle.requests == 0
+
+    def test_exceptions_count_as_rejections_when_listed(self):
+        throttle = AdaptiveThrottle(rejection_exceptions=[OverloadedError])
+        throttle.record_exception(OverloadedError())
+        throttle.record_exception(ValueError())
+        assert (throttle.requests, throttle.accepts) == (2, 1)
+
+    def test_requests_sent_stay_close_to_k_times_the_accepts(self):
+        throttle = AdaptiveThrottle(k=2, seed=1)
+        sent = 0
+        accepted = 0
+        capacity = 0.0
+        for _ in range(10000):
+            # the downstream can accept one request for every four the application makes
+            capacity = min(capacity + 0.25, 1.0)
+            if not throttle.try_acquire():
+                continue
+            sent += 1
+            if capacity >= 1:
+                capacity -= 1
+                accepted += 1
+                throttle.record_accept()
+            else:
+                throttle.record_rejection()
+
+        assert sent < 4000
+        assert sent == pytest.approx(2 * accepted, rel=0.05)
+
+
+class TestFailsafeWithAdaptiveThrottle:
+
+    def test_attempts_are_recorded_and_throttled(self):
+        throttle = AdaptiveThrottle(k=1, rejection_exceptions=[OverloadedError])
+        throttle.random = Mock()
+        throttle.random.random.return_value = 0.99
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1), throttle=throttle)
+
+        async def overloaded():
+            raise OverloadedError()
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(overloaded))
+        assert (throttle.requests, throttle.accepts) == (2, 0)
+
+        throttle.random.random.return_value = 0.5
+        with pytest.raises(RequestThrottled):
+            loop.run_until_complete(failsafe.run(overloaded))
+        assert throttle.requests == 3
+
+    def test_successes_are_accepts(self):
+        throttle = AdaptiveThrottle()
+        failsafe = Failsafe(throttle=throttle)
+
+        async def succeeding():
+            return 'done'
+
+        assert loop.run_until_complete(failsafe.run(succeeding)) == 'done'
+        assert (throttle.requests, throttle.accepts) == (1, 1)
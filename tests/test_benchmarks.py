@@ -0,0 +1,53 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+
+from benchmarks.run_benchmarks import run_benchmarks, compare, main, ASYNC_BENCHMARKS, SYNC_BENCHMARKS
+
+loop = asyncio.get_event_loop()
+
+
+def results(**ns_per_call):
+    return {'results': {name: {'ns_per_call': ns} for name, ns in ns_per_call.items()}}
+
+
+class TestBenchmarks:
+
+    def test_every_benchmark_runs(self):
+        current = run_benchmarks(iterations=10, repeat=1, loop=loop)
+
+        assert set(current['results']) == {benchmark.__name__ for benchmark in ASYNC_BENCHMARKS + SYNC_BENCHMARKS}
+        assert current['results']['bare_await']['overhead_ns'] == 0
+        assert all(result['ns_per_call'] > 0 for result in current['results'].values())
+
+    def test_compare_reports_regressions_over_threshold(self):
+        baseline = results(fast=100, slow=1000, removed=10)
+        current = results(fast=160, slow=1300, added=10)
+
+        assert compare(baseline, current, 0.1) == ['fast', 'slow']
+        assert compare(baseline, current, 0.5) == ['fast']
+        assert compare(baseline, current, 0.1, min_difference_ns=100) == ['slow']
+
+    def test_main_saves_results_and_fails_on_regression(self, tmpdir):
+        output = str(tmpdir.join('results.json'))
+        assert main(['--iterations', '10', '--repeat', '1', '--output', output]) == 0
+
+        with open(output) as output_file:
+            saved = json.load(output_file)
+        for result in saved['results'].values():
+            result['ns_per_call'] = 1
+        with open(output, 'w') as output_file:
+            json.dump(saved, output_file)
+
+        assert main(['--iterations', '10', '--repeat', '1', '--compare', output, '--min-difference-ns', '0']) == 1
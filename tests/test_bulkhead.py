@@ -0,0 +1,172 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+from unittest.mock import Mock
+
+import pytest
+
+from failsafe import Failsafe, Bulkhead, BulkheadFull, RetryPolicy, CircuitBreaker
+
+loop = asyncio.get_event_loop()
+
+
+class TestBulkhead(unittest.TestCase):
+
+    def test_permits_up_to_limit(self):
+        bulkhead = Bulkhead(max_concurrent_calls=2)
+
+        loop.run_until_complete(bulkhead.acquire())
+        loop.run_until_complete(bulkhead.acquire())
+        assert bulkhead.in_flight == 2
+
+        with pytest.raises(BulkheadFull):
+            loop.run_until_complete(bulkhead.acquire())
+
+        bulkhead.release()
+        loop.run_until_complete(bulkhead.acquire())
+        assert bulkhead.in_flight == 2
+
+    def test_queued_execution_gets_released_permit(self):
+        bulkhead = Bulkhead(max_concurrent_calls=1, max_queued_calls=1)
+
+        async def scenario():
+            await bulkhead.acquire()
+            waiting = asyncio.ensure_future(bulkhead.acquire())
+            await asyncio.sleep(0)
+            assert bulkhead.queued == 1
+            assert not waiting.done()
+
+            bulkhead.release()
+            await waiting
+            assert bulkhead.in_flight == 1
+            assert bulkhead.queued == 0
+
+        loop.run_until_complete(scenario())
+
+    def test_rejects_when_queue_is_full(self):
+        on_reject_mock = Mock()
+        bulkhead = Bulkhead(max_concurrent_calls=1, max_queued_calls=1, on_reject=on_reject_mock)
+
+        async def scenario():
+            await bulkhead.acquire()
+            waiting = asyncio.ensure_future(bulkhead.acquire())
+            await asyncio.sleep(0)
+            with pytest.raises(BulkheadFull):
+                await bulkhead.acquire()
+            waiting.cancel()
+
+        loop.run_until_complete(scenario())
+        assert on_reject_mock.call_count == 1
+        assert bulkhead.queued == 0
+
+    def test_rejects_after_max_queue_time(self):
+        bulkhead = Bulkhead(max_concurrent_calls=1, max_queued_calls=10, max_queue_time_seconds=0.01)
+
+        async def scenario():
+            await bulkhead.acquire()
+            with pytest.raises(BulkheadFull):
+                await bulkhead.acquire()
+
+        loop.run_until_complete(scenario())
+        assert bulkhead.queued == 0
+        assert bulkhead.in_flight == 1
+
+    def test_cancelled_waiter_does_not_hold_permit(self):
+        bulkhead = Bulkhead(max_concurrent_calls=1, max_queued_calls=1)
+
+        async def scenario():
+            await bulkhead.acquire()
+            waiting = asyncio.ensure_future(bulkhead.acquire())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            bulkhead.release()
+
+        loop.run_until_complete(scenario())
+        assert bulkhead.queued == 0
+        assert bulkhead.in_flight == 0
+
+    def test_sheds_load_when_queueing_delay_stays_above_target(self):
+        bulkhead = Bulkhead(max_concurrent_calls=1, max_queued_calls=10,
+                            queue_delay_target_seconds=0.005, queue_delay_interval_seconds=0)
+
+        async def scenario():
+            await bulkhead.acquire()
+            waiting = [asyncio.ensure_future(bulkhead.acquire()) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            bulkhead.release()
+            bulkhead.release()
+            await asyncio.gather(*waiting)
+
+            with pytest.raises(BulkheadFull):
+                await bulkhead.acquire()
+
+            # queue drained, the bulkhead stops shedding
+            bulkhead.release()
+            await bulkhead.acquire()
+            waiting = asyncio.ensure_future(bulkhead.acquire())
+            await asyncio.sleep(0)
+            assert bulkhead.queued == 1
+            bulkhead.release()
+            await waiting
+
+        loop.run_until_complete(scenario())
+
+
+class TestFailsafeWithBulkhead(unittest.TestCase):
+
+    def test_limits_concurrent_attempts(self):
+        bulkhead = Bulkhead(max_concurrent_calls=2, max_queued_calls=10)
+        failsafe = Failsafe(bulkhead=bulkhead)
+        running = []
+
+        async def operation():
+            running.append(bulkhead.in_flight)
+            await asyncio.sleep(0.001)
+
+        loop.run_until_complete(asyncio.gather(*[failsafe.run(operation) for _ in range(10)]))
+
+        assert max(running) == 2
+        assert bulkhead.in_flight == 0
+
+    def test_rejection_is_not_retried_nor_recorded(self):
+        bulkhead = Bulkhead(max_concurrent_calls=1)
+        circuit_breaker = CircuitBreaker(maximum_failures=1)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=3), circuit_breaker=circuit_breaker,
+                            bulkhead=bulkhead)
+
+        async def operation():
+            await asyncio.sleep(0.01)
+
+        async def scenario():
+            running = asyncio.ensure_future(failsafe.run(operation))
+            await asyncio.sleep(0)
+            with pytest.raises(BulkheadFull):
+                await failsafe.run(operation)
+            await running
+
+        loop.run_until_complete(scenario())
+        assert circuit_breaker.current_state == 'closed'
+
+    def test_permit_is_released_between_retries(self):
+        bulkhead = Bulkhead(max_concurrent_calls=1)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=2), bulkhead=bulkhead)
+
+        async def operation():
+            raise ValueError()
+
+        with pytest.raises(Exception):
+            loop.run_until_complete(failsafe.run(operation))
+
+        assert bulkhead.in_flight == 0
@@ -10,9 +10,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 from unittest.mock import patch, Mock
+import pytest
 
-from failsafe.circuit_breaker import CircuitBreaker
+from failsafe import (
+    Failsafe, CircuitOpen, RetryPolicy, RateLimiter, RateLimitExceeded, Bulkhead, TimeoutExceeded, RetriesExhausted,
+)
+from failsafe.circuit_breaker import CircuitBreaker, FailureRateCircuitBreaker
+
+loop = asyncio.get_event_loop()
 
 
 class TestCircuitBreaker:
@@ -57,6 +64,25 @@ class TestCircuitBreaker:
 
         assert circuit_breaker.current_state == 'closed'
 
+    @patch('time.monotonic')
+    def test_reused_states_are_reset_on_transitions(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit_breaker = CircuitBreaker(maximum_failures=2, reset_timeout_seconds=10)
+        circuit_breaker.record_failure()
+        circuit_breaker.record_failure()
+        circuit_breaker.close()
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'closed'
+
+        circuit_breaker.record_failure()
+        monotonic_mock.return_value = 105
+        circuit_breaker.open()
+        monotonic_mock.return_value = 112
+        assert circuit_breaker.allows_execution() is False
+        monotonic_mock.return_value = 116
+        assert circuit_breaker.allows_execution() is True
+        assert circuit_breaker.current_state == 'half-open'
+
     @patch('time.monotonic')
     def test_circuit_half_opens_and_closes_after_timeout(self, monotonic_mock):
         circuit_breaker = CircuitBreaker(maximum_failures=1, reset_timeout_seconds=20)
@@ -105,6 +131,23 @@ class TestCircuitBreaker:
         assert circuit_breaker.allows_execution() is False
         assert circuit_breaker.current_state == 'open'
 
+    @patch('time.monotonic')
+    def test_is_open_does_not_change_state(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit_breaker = CircuitBreaker(maximum_failures=1, reset_timeout_seconds=20)
+        assert circuit_breaker.is_open() is False
+
+        circuit_breaker.record_failure()
+        assert circuit_breaker.is_open() is True
+
+        monotonic_mock.return_value = 130
+        assert circuit_breaker.is_open() is False
+        assert circuit_breaker.current_state == 'open'
+
+        circuit_breaker.allows_execution()
+        assert circuit_breaker.is_open() is False
+        assert circuit_breaker.current_state == 'half-open'
+
     def test_half_open_state_ratio(self):
         ratio = 0.2
         total_executions = 1000
@@ -123,6 +166,440 @@ class TestCircuitBreaker:
         assert len(allowed_executions) == total_executions * ratio
 
 
+class TestFailureRateCircuitBreaker:
+
+    def test_opens_when_failure_rate_is_reached_despite_successes(self):
+        circuit_breaker = FailureRateCircuitBreaker(failure_rate_threshold=0.4, minimum_calls=10, window_size=10)
+
+        for _ in range(3):
+            circuit_breaker.record_failure()
+            circuit_breaker.record_success()
+        for _ in range(3):
+            circuit_breaker.record_success()
+        assert circuit_breaker.current_state == 'closed'
+        assert circuit_breaker.failure_rate == 3 / 9
+
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+
+    def test_does_not_open_before_minimum_calls(self):
+        circuit_breaker = FailureRateCircuitBreaker(failure_rate_threshold=0.5, minimum_calls=5)
+
+        for _ in range(4):
+            circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'closed'
+
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+
+    def test_count_window_forgets_old_outcomes(self):
+        circuit_breaker = FailureRateCircuitBreaker(failure_rate_threshold=0.5, minimum_calls=4, window_size=4)
+
+        circuit_breaker.record_failure()
+        for _ in range(4):
+            circuit_breaker.record_success()
+        assert circuit_breaker.failure_rate == 0
+
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'closed'
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+
+    @patch('time.monotonic')
+    def test_time_window_forgets_old_outcomes(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit_breaker = FailureRateCircuitBreaker(failure_rate_threshold=0.6, minimum_calls=2, window_seconds=10)
+
+        circuit_breaker.record_success()
+        monotonic_mock.return_value = 105
+        circuit_breaker.record_success()
+        monotonic_mock.return_value = 110.5
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'closed'
+        assert circuit_breaker.failure_rate == 0.5
+
+        monotonic_mock.return_value = 115
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+
+    @patch('time.monotonic')
+    def test_rates_of_time_window_exclude_expired_outcomes(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit_breaker = FailureRateCircuitBreaker(minimum_calls=10, window_seconds=10,
+                                                    slow_call_duration_seconds=1)
+
+        circuit_breaker.record_failure(5)
+        assert (circuit_breaker.failure_rate, circuit_breaker.slow_call_rate) == (1, 1)
+
+        monotonic_mock.return_value = 111
+        assert circuit_breaker.failure_rate is None
+        assert circuit_breaker.slow_call_rate is None
+
+    @pytest.mark.parametrize('parameters', [
+        {'failure_rate_threshold': 0}, {'failure_rate_threshold': 1.5}, {'slow_call_rate_threshold': 0},
+        {'slow_call_rate_threshold': -0.5}, {'window_size': 0}, {'window_seconds': 0.5},
+    ])
+    def test_parameters_are_validated(self, parameters):
+        with pytest.raises(ValueError):
+            FailureRateCircuitBreaker(**parameters)
+
+    @patch('time.monotonic')
+    def test_time_window_is_cleared_after_long_inactivity(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit_breaker = FailureRateCircuitBreaker(failure_rate_threshold=0.5, minimum_calls=2, window_seconds=10)
+
+        circuit_breaker.record_failure()
+        monotonic_mock.return_value = 1000
+        circuit_breaker.record_success()
+        circuit_breaker.record_success()
+
+        assert circuit_breaker.failure_rate == 0
+
+    @patch('time.monotonic')
+    def test_window_is_reset_when_circuit_closes_again(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit_breaker = FailureRateCircuitBreaker(failure_rate_threshold=0.5, minimum_calls=2,
+                                                    reset_timeout_seconds=10)
+        circuit_breaker.record_failure()
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+        assert circuit_breaker.failure_rate is None
+
+        monotonic_mock.return_value = 120
+        assert circuit_breaker.allows_execution() is True
+        circuit_breaker.record_success()
+        assert circuit_breaker.current_state == 'closed'
+        assert circuit_breaker.failure_rate is None
+
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'closed'
+
+
+class TestSlowCallCircuitBreaker:
+
+    def test_opens_on_slow_call_rate_even_if_calls_succeed(self):
+        circuit_breaker = FailureRateCircuitBreaker(minimum_calls=4, window_size=4, slow_call_duration_seconds=1,
+                                                    slow_call_rate_threshold=0.5)
+
+        circuit_breaker.record_success(0.1)
+        circuit_breaker.record_success(0.1)
+        circuit_breaker.record_success(5)
+        assert circuit_breaker.current_state == 'closed'
+        assert circuit_breaker.slow_call_rate == 1 / 3
+
+        circuit_breaker.record_success(5)
+        assert circuit_breaker.current_state == 'open'
+
+    def test_slow_failures_count_as_slow(self):
+        circuit_breaker = FailureRateCircuitBreaker(failure_rate_threshold=1, minimum_calls=2, window_size=2,
+                                                    slow_call_duration_seconds=1, slow_call_rate_threshold=1)
+
+        circuit_breaker.record_success(5)
+        circuit_breaker.record_failure(5)
+        assert circuit_breaker.current_state == 'open'
+
+    def test_duration_is_ignored_without_threshold(self):
+        circuit_breaker = FailureRateCircuitBreaker(minimum_calls=1, window_size=2)
+
+        circuit_breaker.record_success(500)
+        circuit_breaker.record_success(500)
+        assert circuit_breaker.current_state == 'closed'
+        assert circuit_breaker.slow_call_rate == 0
+
+    @patch('time.monotonic')
+    def test_time_window_forgets_old_slow_calls(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit_breaker = FailureRateCircuitBreaker(minimum_calls=2, window_seconds=10,
+                                                    slow_call_duration_seconds=1, slow_call_rate_threshold=0.6)
+
+        circuit_breaker.record_success(5)
+        monotonic_mock.return_value = 120
+        circuit_breaker.record_success(0.1)
+        circuit_breaker.record_success(5)
+        assert circuit_breaker.current_state == 'closed'
+        assert circuit_breaker.slow_call_rate == 0.5
+
+    def test_failsafe_supports_breakers_recording_outcomes_without_duration(self):
+        outcomes = []
+
+        class CountingCircuitBreaker(CircuitBreaker):
+            def record_success(self):
+                outcomes.append('success')
+
+            def record_failure(self):
+                outcomes.append('failure')
+
+        failsafe = Failsafe(circuit_breaker=CountingCircuitBreaker())
+
+        async def succeeding():
+            return 'done'
+
+        async def failing():
+            raise ValueError()
+
+        loop.run_until_complete(failsafe.run(succeeding))
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(failing))
+        assert outcomes == ['success', 'failure']
+
+    def test_failsafe_records_attempt_duration(self):
+        circuit_breaker = FailureRateCircuitBreaker(minimum_calls=1, window_size=1, slow_call_duration_seconds=0.01)
+        failsafe = Failsafe(circuit_breaker=circuit_breaker)
+
+        async def slow_operation():
+            await asyncio.sleep(0.02)
+
+        loop.run_until_complete(failsafe.run(slow_operation))
+        assert circuit_breaker.current_state == 'open'
+
+        with pytest.raises(CircuitOpen):
+            loop.run_until_complete(failsafe.run(slow_operation))
+
+
+class TestCircuitBreakerOpenFor:
+
+    @patch('time.monotonic')
+    def test_open_for_given_duration(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        on_open = Mock()
+        circuit_breaker = CircuitBreaker(reset_timeout_seconds=60, on_open=on_open)
+        circuit_breaker.open_for(5)
+
+        monotonic_mock.return_value = 5.5
+        assert circuit_breaker.allows_execution()
+        assert circuit_breaker.current_state == 'half-open'
+        on_open.assert_called_once_with()
+
+    @patch('time.monotonic')
+    def test_open_for_only_extends_an_open_circuit(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        on_open = Mock()
+        circuit_breaker = CircuitBreaker(reset_timeout_seconds=10, on_open=on_open)
+        circuit_breaker.open()
+        circuit_breaker.open_for(5)
+        assert circuit_breaker._open.half_open_at == 10
+        circuit_breaker.open_for(30)
+        assert circuit_breaker._open.half_open_at == 30
+        assert on_open.call_count == 1
+
+
+class TestHalfOpenPermitsAndSlowStart:
+
+    def test_parameters_are_validated(self):
+        with pytest.raises(ValueError):
+            CircuitBreaker(half_open_successes=0)
+        with pytest.raises(ValueError):
+            CircuitBreaker(slow_start_curve='quadratic')
+
+    def test_half_open_allows_a_fixed_number_of_concurrent_probes(self):
+        circuit_breaker = CircuitBreaker(half_open_max_calls=2, half_open_successes=2)
+        circuit_breaker.half_open()
+
+        assert [circuit_breaker.allows_execution() for _ in range(5)] == [True, True, False, False, False]
+        circuit_breaker.record_success()
+        assert circuit_breaker.current_state == 'half-open'
+        assert [circuit_breaker.allows_execution() for _ in range(3)] == [True, False, False]
+
+    def test_released_permit_allows_another_probe(self):
+        circuit_breaker = CircuitBreaker(half_open_max_calls=1)
+        circuit_breaker.half_open()
+
+        assert circuit_breaker.allows_execution()
+        assert not circuit_breaker.allows_execution()
+        circuit_breaker.release_permit()
+        assert circuit_breaker.allows_execution()
+
+    @patch('time.monotonic')
+    def test_outcome_of_execution_started_before_half_opening_does_not_release_a_permit(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        circuit_breaker = CircuitBreaker(half_open_max_calls=1)
+        circuit_breaker.half_open()
+        assert circuit_breaker.allows_execution()
+
+        monotonic_mock.return_value = 1
+        circuit_breaker.record_success(duration_seconds=5)
+        assert circuit_breaker.current_state == 'half-open'
+        assert not circuit_breaker.allows_execution()
+
+    @patch('time.monotonic')
+    def test_lost_probe_timeout_counts_from_the_permit(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        circuit_breaker = CircuitBreaker(reset_timeout_seconds=10, half_open_max_calls=1, half_open_successes=2)
+        circuit_breaker.half_open()
+        assert circuit_breaker.allows_execution()
+
+        monotonic_mock.return_value = 8
+        circuit_breaker.record_success()
+        assert circuit_breaker.allows_execution()
+
+        # the second probe has only been running for 7 seconds
+        monotonic_mock.return_value = 15
+        assert not circuit_breaker.allows_execution()
+        assert circuit_breaker.current_state == 'half-open'
+
+    @patch('time.monotonic')
+    def test_lost_probes_open_the_circuit_again(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        circuit_breaker = CircuitBreaker(reset_timeout_seconds=10, half_open_max_calls=1)
+        circuit_breaker.half_open()
+        assert circuit_breaker.allows_execution()
+
+        monotonic_mock.return_value = 10
+        assert not circuit_breaker.allows_execution()
+        assert circuit_breaker.current_state == 'half-open'
+
+        monotonic_mock.return_value = 10.5
+        assert not circuit_breaker.allows_execution()
+        assert circuit_breaker.current_state == 'open'
+
+    def test_circuit_closes_after_enough_successful_probes(self):
+        circuit_breaker = CircuitBreaker(half_open_max_calls=3, half_open_successes=3)
+        circuit_breaker.half_open()
+
+        for _ in range(2):
+            assert circuit_breaker.allows_execution()
+            circuit_breaker.record_success()
+        assert circuit_breaker.current_state == 'half-open'
+
+        assert circuit_breaker.allows_execution()
+        circuit_breaker.record_success()
+        assert circuit_breaker.current_state == 'closed'
+
+    def test_failed_probe_opens_the_circuit_despite_successes(self):
+        circuit_breaker = CircuitBreaker(half_open_max_calls=3, half_open_successes=3)
+        circuit_breaker.half_open()
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+
+    @patch('time.monotonic')
+    def test_linear_slow_start_after_recovery(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        circuit_breaker = CircuitBreaker(half_open_ratio=0.2, slow_start_seconds=10)
+        circuit_breaker.half_open()
+        circuit_breaker.record_success()
+        assert circuit_breaker.current_state == 'closed'
+
+        assert sum(circuit_breaker.allows_execution() for _ in range(100)) == 20
+
+        monotonic_mock.return_value = 5
+        assert sum(circuit_breaker.allows_execution() for _ in range(100)) == 60
+
+        monotonic_mock.return_value = 10
+        assert circuit_breaker.allows_execution()
+        assert circuit_breaker.state is circuit_breaker._closed
+
+    @patch('time.monotonic')
+    def test_exponential_slow_start_after_recovery(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        circuit_breaker = CircuitBreaker(half_open_ratio=0.01, slow_start_seconds=10, slow_start_curve='exponential')
+        circuit_breaker.half_open()
+        circuit_breaker.record_success()
+
+        assert circuit_breaker._slow_start.allowed_ratio == pytest.approx(0.01)
+        monotonic_mock.return_value = 5
+        assert circuit_breaker._slow_start.allowed_ratio == pytest.approx(0.1)
+        assert sum(circuit_breaker.allows_execution() for _ in range(100)) in (9, 10)
+
+    @patch('time.monotonic')
+    def test_failures_during_slow_start_open_the_circuit(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        circuit_breaker = CircuitBreaker(maximum_failures=2, slow_start_seconds=10)
+        circuit_breaker.open()
+        circuit_breaker.close()
+        assert circuit_breaker.state is circuit_breaker._slow_start
+
+        circuit_breaker.record_failure()
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+
+    def test_no_slow_start_when_closing_a_closed_circuit(self):
+        circuit_breaker = CircuitBreaker(slow_start_seconds=10)
+        circuit_breaker.close()
+        assert circuit_breaker.state is circuit_breaker._closed
+
+    @patch('time.monotonic')
+    def test_failure_rate_is_available_during_slow_start(self, monotonic_mock):
+        monotonic_mock.return_value = 0
+        circuit_breaker = FailureRateCircuitBreaker(slow_start_seconds=10, half_open_successes=2)
+        circuit_breaker.half_open()
+        circuit_breaker.record_success()
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure()
+        assert circuit_breaker.failure_rate == 1.0
+
+
+class TestFailsafeHalfOpenProbes:
+
+    def create_recovered_circuit_breaker(self, **kwargs):
+        circuit_breaker = CircuitBreaker(reset_timeout_seconds=0.01, half_open_max_calls=1, **kwargs)
+        circuit_breaker.open()
+        loop.run_until_complete(asyncio.sleep(0.02))
+        return circuit_breaker
+
+    def test_call_half_opening_the_circuit_takes_the_only_permit(self):
+        circuit_breaker = self.create_recovered_circuit_breaker(half_open_successes=2)
+        failsafe = Failsafe(circuit_breaker=circuit_breaker)
+        calls = []
+
+        async def slow_operation():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+
+        results = loop.run_until_complete(asyncio.gather(
+            *[failsafe.run(slow_operation) for _ in range(5)], return_exceptions=True))
+
+        assert len(calls) == 1
+        assert sum(isinstance(result, CircuitOpen) for result in results) == 4
+
+    def test_aborted_probe_releases_its_permit(self):
+        circuit_breaker = self.create_recovered_circuit_breaker()
+        failsafe = Failsafe(retry_policy=RetryPolicy(abortable_exceptions=[ValueError]),
+                            circuit_breaker=circuit_breaker)
+
+        async def aborted():
+            raise ValueError()
+
+        async def succeeding():
+            return 'done'
+
+        with pytest.raises(ValueError):
+            loop.run_until_complete(failsafe.run(aborted))
+        assert circuit_breaker.current_state == 'half-open'
+        assert loop.run_until_complete(failsafe.run(succeeding)) == 'done'
+        assert circuit_breaker.current_state == 'closed'
+
+    def test_probe_rejected_by_other_policies_releases_its_permit(self):
+        circuit_breaker = self.create_recovered_circuit_breaker()
+        rate_limiter = RateLimiter(calls_per_second=0.001)
+        rate_limiter.try_acquire()
+        failsafe = Failsafe(circuit_breaker=circuit_breaker, rate_limiter=rate_limiter)
+
+        async def succeeding():
+            return 'done'
+
+        with pytest.raises(RateLimitExceeded):
+            loop.run_until_complete(failsafe.run(succeeding))
+        assert circuit_breaker.allows_execution()
+
+    def test_probe_reaching_the_deadline_before_its_attempt_releases_its_permit(self):
+        circuit_breaker = self.create_recovered_circuit_breaker()
+        bulkhead = Bulkhead(max_concurrent_calls=1, max_queued_calls=1)
+        failsafe = Failsafe(circuit_breaker=circuit_breaker, bulkhead=bulkhead, timeout_seconds=0.01)
+
+        async def succeeding():
+            return 'done'
+
+        async def run_when_bulkhead_is_full():
+            await bulkhead.acquire()
+            loop.call_later(0.02, bulkhead.release)
+            await failsafe.run(succeeding)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(run_when_bulkhead_is_full())
+        assert circuit_breaker.allows_execution()
+
+
 class TestCircuitBreakerEvents:
     def test_initial_state_is_closed(self):
         on_open_mock = Mock()
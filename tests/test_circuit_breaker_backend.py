@@ -0,0 +1,299 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest.mock import patch, Mock
+
+import pytest
+
+from failsafe import (
+    CircuitBreaker, FailureRateCircuitBreaker, StateBackend, SharedState, InMemoryStateBackend, RedisStateBackend,
+)
+from failsafe.circuit_breaker_backend import _SYNC_SCRIPT
+
+loop = asyncio.get_event_loop()
+
+
+class FakeRedis:
+    """
+    Runs the synchronization script of RedisStateBackend the way Redis would, returning bytes as Redis does.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+        self.round_trips = 0
+
+    async def eval(self, script, numkeys, counts_key, open_until_key, successes, failures, open_until,
+                   counts_expiry, open_until_expiry):
+        assert (script, numkeys) == (_SYNC_SCRIPT, 2)
+        self.round_trips += 1
+        shared_open_until = self.values.get(open_until_key, b'0')
+        if open_until != '' and float(open_until) > float(shared_open_until):
+            shared_open_until = self.values[open_until_key] = open_until.encode()
+            self.expiries[open_until_key] = open_until_expiry
+            self.values.pop(counts_key, None)
+        counts = self.values.setdefault(counts_key, {})
+        for field, amount in ((b'successes', successes), (b'failures', failures)):
+            if amount > 0:
+                counts[field] = str(int(counts.get(field, 0)) + amount).encode()
+        if successes > 0 or failures > 0:
+            self.expiries[counts_key] = counts_expiry
+        return [counts.get(b'successes', b'0'), counts.get(b'failures', b'0'), shared_open_until]
+
+
+class CountingBackend(InMemoryStateBackend):
+
+    def __init__(self, **kwargs):
+        super(CountingBackend, self).__init__(**kwargs)
+        self.calls = []
+
+    async def sync(self, key, successes, failures, open_until=None):
+        self.calls.append((key, successes, failures, open_until))
+        return await super(CountingBackend, self).sync(key, successes, failures, open_until)
+
+
+class FailingBackend(StateBackend):
+
+    async def sync(self, key, successes, failures, open_until=None):
+        raise ConnectionError()
+
+
+def create_lua_redis():
+    """
+    Returns a fake Redis running the Lua scripts, skipping the test when fakeredis or lupa is not installed.
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return fakeredis.aioredis.FakeRedis()
+
+
+def create_backends():
+    return [InMemoryStateBackend(minimum_calls=10), RedisStateBackend(FakeRedis(), minimum_calls=10)]
+
+
+class TestStateBackends:
+
+    @pytest.mark.parametrize('backend', create_backends())
+    @patch('time.time')
+    def test_outcomes_are_counted_per_window(self, time_mock, backend):
+        time_mock.return_value = 1005
+        loop.run_until_complete(backend.sync('partner', 3, 1))
+        state = loop.run_until_complete(backend.sync('partner', 2, 4))
+        assert (state.successes, state.failures, state.open_until) == (5, 5, 0)
+
+        other_state = loop.run_until_complete(backend.sync('other', 0, 0))
+        assert (other_state.successes, other_state.failures) == (0, 0)
+
+        time_mock.return_value = 1010
+        state = loop.run_until_complete(backend.sync('partner', 1, 0))
+        assert (state.successes, state.failures) == (1, 0)
+
+    @pytest.mark.parametrize('backend', create_backends())
+    @patch('time.time')
+    def test_opening_keeps_the_latest_time_and_clears_the_counts(self, time_mock, backend):
+        time_mock.return_value = 1000
+        loop.run_until_complete(backend.sync('partner', 3, 7))
+        state = loop.run_until_complete(backend.sync('partner', 0, 1, open_until=1060))
+        assert (state.successes, state.failures, state.open_until) == (0, 1, 1060)
+
+        state = loop.run_until_complete(backend.sync('partner', 0, 1, open_until=1030))
+        assert (state.failures, state.open_until) == (2, 1060)
+
+    def test_failure_rate_is_checked_after_minimum_calls(self):
+        backend = InMemoryStateBackend(failure_rate_threshold=0.5, minimum_calls=10)
+        assert not backend.is_failing(SharedState(successes=0, failures=9))
+        assert backend.is_failing(SharedState(successes=5, failures=5))
+        assert not backend.is_failing(SharedState(successes=6, failures=4))
+        assert not InMemoryStateBackend(failure_rate_threshold=None).is_failing(SharedState(0, 1000))
+
+    def test_redis_keys_expire(self):
+        redis = FakeRedis()
+        backend = RedisStateBackend(redis, prefix='test:', window_seconds=10)
+        with patch('time.time', return_value=1000):
+            loop.run_until_complete(backend.sync('partner', 1, 0, open_until=1060))
+        assert redis.expiries == {'test:partner:100': 20, 'test:partner:open_until': 61}
+
+    def test_redis_synchronization_takes_one_round_trip(self):
+        redis = FakeRedis()
+        backend = RedisStateBackend(redis, prefix='test:')
+        with patch('time.time', return_value=1000):
+            state = loop.run_until_complete(backend.sync('partner', 3, 2, open_until=1060))
+        assert (state.successes, state.failures, state.open_until) == (3, 2, 1060)
+        assert redis.round_trips == 1
+
+
+class TestRedisSynchronizationScript:
+
+    @patch('time.time')
+    def test_outcomes_are_counted_in_an_expiring_hash(self, time_mock):
+        time_mock.return_value = 1005
+        redis = create_lua_redis()
+        backend = RedisStateBackend(redis, prefix='test:', window_seconds=10)
+
+        state = loop.run_until_complete(backend.sync('partner', 0, 0))
+        assert (state.successes, state.failures, state.open_until) == (0, 0, 0)
+        assert loop.run_until_complete(redis.exists('test:partner:100')) == 0
+
+        loop.run_until_complete(backend.sync('partner', 3, 0))
+        state = loop.run_until_complete(backend.sync('partner', 0, 4))
+        assert (state.successes, state.failures, state.open_until) == (3, 4, 0)
+        assert loop.run_until_complete(redis.hgetall('test:partner:100')) == {b'successes': b'3', b'failures': b'4'}
+        assert loop.run_until_complete(redis.ttl('test:partner:100')) == 20
+        assert loop.run_until_complete(redis.exists('test:partner:open_until')) == 0
+
+    @patch('time.time')
+    def test_only_a_later_opening_is_kept_and_clears_the_counts(self, time_mock):
+        time_mock.return_value = 1000
+        redis = create_lua_redis()
+        backend = RedisStateBackend(redis, prefix='test:', window_seconds=10)
+        loop.run_until_complete(backend.sync('partner', 3, 7))
+
+        state = loop.run_until_complete(backend.sync('partner', 0, 1, open_until=1060))
+        assert (state.successes, state.failures, state.open_until) == (0, 1, 1060)
+        assert loop.run_until_complete(redis.ttl('test:partner:open_until')) == 61
+
+        state = loop.run_until_complete(backend.sync('partner', 1, 1, open_until=1030.5))
+        assert (state.successes, state.failures, state.open_until) == (1, 2, 1060)
+        assert loop.run_until_complete(redis.get('test:partner:open_until')) == b'1060'
+        assert loop.run_until_complete(redis.ttl('test:partner:open_until')) == 61
+
+
+class TestCircuitBreakerWithStateBackend:
+
+    def test_state_key_is_required(self):
+        with pytest.raises(ValueError):
+            CircuitBreaker(state_backend=InMemoryStateBackend())
+
+    def test_outcomes_are_sent_in_batches(self):
+        backend = CountingBackend()
+        circuit_breaker = CircuitBreaker(maximum_failures=1000, state_backend=backend, state_key='partner')
+
+        for _ in range(100):
+            assert circuit_breaker.allows_execution()
+            circuit_breaker.record_success()
+        circuit_breaker.record_failure()
+        assert backend.calls == []
+
+        loop.run_until_complete(circuit_breaker.sync_state())
+        assert backend.calls == [('partner', 100, 1, None)]
+        loop.run_until_complete(circuit_breaker.stop_state_sync())
+
+    @patch('time.time')
+    @patch('time.monotonic')
+    def test_opening_is_shared_for_the_remaining_time(self, monotonic_mock, time_mock):
+        time_mock.return_value = 1000
+        monotonic_mock.return_value = 50
+        backend = InMemoryStateBackend()
+        on_open = Mock()
+        first = CircuitBreaker(maximum_failures=2, reset_timeout_seconds=60, state_backend=backend, state_key='p')
+        second = CircuitBreaker(reset_timeout_seconds=60, state_backend=backend, state_key='p', on_open=on_open)
+
+        first.record_failure()
+        first.record_failure()
+        assert first.current_state == 'open'
+        loop.run_until_complete(first.sync_state())
+
+        time_mock.return_value = 1020
+        monotonic_mock.return_value = 70
+        loop.run_until_complete(second.sync_state())
+        assert second.current_state == 'open'
+        on_open.assert_called_once_with()
+        assert not second.allows_execution()
+
+        # open until the time of the first breaker, not for a whole reset timeout
+        time_mock.return_value = 1061
+        monotonic_mock.return_value = 111
+        assert second.allows_execution()
+        assert second.current_state == 'half-open'
+
+        # the opening is only applied once
+        loop.run_until_complete(second.sync_state())
+        assert second.current_state == 'half-open'
+        for circuit_breaker in (first, second):
+            loop.run_until_complete(circuit_breaker.stop_state_sync())
+
+    def test_shared_failure_rate_opens_every_breaker(self):
+        backend = InMemoryStateBackend(failure_rate_threshold=0.5, minimum_calls=10)
+        circuit_breakers = [FailureRateCircuitBreaker(minimum_calls=100, state_backend=backend, state_key='p')
+                            for _ in range(3)]
+
+        for circuit_breaker in circuit_breakers:
+            for _ in range(3):
+                circuit_breaker.record_failure()
+            circuit_breaker.record_success()
+            loop.run_until_complete(circuit_breaker.sync_state())
+        assert [circuit_breaker.current_state for circuit_breaker in circuit_breakers] == ['closed', 'closed', 'open']
+
+        for circuit_breaker in circuit_breakers:
+            loop.run_until_complete(circuit_breaker.sync_state())
+        assert [circuit_breaker.current_state for circuit_breaker in circuit_breakers] == ['open', 'open', 'open']
+        for circuit_breaker in circuit_breakers:
+            loop.run_until_complete(circuit_breaker.stop_state_sync())
+
+    def test_outcomes_are_kept_when_synchronization_fails(self):
+        circuit_breaker = CircuitBreaker(state_backend=FailingBackend(), state_key='partner')
+        circuit_breaker.record_success()
+        loop.run_until_complete(circuit_breaker.sync_state())
+        circuit_breaker.record_success()
+
+        assert circuit_breaker._sync.successes == 2
+        assert circuit_breaker.current_state == 'closed'
+        loop.run_until_complete(circuit_breaker.stop_state_sync())
+
+    def test_background_task_synchronizes_periodically(self):
+        backend = CountingBackend()
+        circuit_breaker = CircuitBreaker(state_backend=backend, state_key='partner', sync_interval_seconds=0.01)
+
+        async def record_outcomes():
+            circuit_breaker.record_success()
+            circuit_breaker.record_success()
+            await asyncio.sleep(0.05)
+
+        loop.run_until_complete(record_outcomes())
+        assert backend.calls[0] == ('partner', 2, 0, None)
+
+        loop.run_until_complete(circuit_breaker.stop_state_sync())
+        assert circuit_breaker._sync.task is None
+
+    def test_background_task_is_only_started_in_a_running_loop(self):
+        backend = CountingBackend()
+        circuit_breaker = CircuitBreaker(state_backend=backend, state_key='partner', sync_interval_seconds=0.01)
+        circuit_breaker.record_success()
+        assert circuit_breaker._sync.task is None
+
+        async def record_outcome():
+            circuit_breaker.record_success()
+            await asyncio.sleep(0.03)
+
+        loop.run_until_complete(record_outcome())
+        assert backend.calls[0] == ('partner', 2, 0, None)
+        loop.run_until_complete(circuit_breaker.stop_state_sync())
+
+    def test_background_task_is_restarted_when_it_ended(self):
+        backend = CountingBackend()
+        circuit_breaker = CircuitBreaker(state_backend=backend, state_key='partner', sync_interval_seconds=0.01)
+
+        async def record_outcome():
+            circuit_breaker.record_success()
+            await asyncio.sleep(0)
+
+        loop.run_until_complete(record_outcome())
+        ended_task = circuit_breaker._sync.task
+        ended_task.cancel()
+        loop.run_until_complete(asyncio.sleep(0))
+        assert ended_task.done()
+
+        loop.run_until_complete(record_outcome())
+        assert circuit_breaker._sync.task is not ended_task
+        assert not circuit_breaker._sync.task.done()
+        loop.run_until_complete(circuit_breaker.stop_state_sync())
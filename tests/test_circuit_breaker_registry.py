@@ -0,0 +1,205 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest.mock import patch, Mock
+
+import pytest
+
+from failsafe import Failsafe, CircuitBreaker, CircuitBreakerRegistry, CircuitOpen, RetriesExhausted
+
+loop = asyncio.get_event_loop()
+
+
+class TestCircuitBreakerRegistry:
+
+    def test_breakers_are_independent(self):
+        registry = CircuitBreakerRegistry(maximum_failures=2)
+
+        registry.get('a').record_failure()
+        registry.get('a').record_failure()
+        registry.get('b').record_failure()
+
+        assert registry.get('a').current_state == 'open'
+        assert registry.get('a').allows_execution() is False
+        assert registry.get('b').current_state == 'closed'
+        assert registry.get('b').allows_execution() is True
+        assert len(registry) == 2
+
+    def test_success_resets_failures(self):
+        registry = CircuitBreakerRegistry(maximum_failures=2)
+        breaker = registry.get('a')
+
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        assert breaker.current_state == 'closed'
+
+    @patch('time.monotonic')
+    def test_circuit_half_opens_and_closes_after_timeout(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        on_open, on_half_open, on_close = Mock(), Mock(), Mock()
+        registry = CircuitBreakerRegistry(maximum_failures=1, reset_timeout_seconds=10, half_open_ratio=1,
+                                          on_open=on_open, on_half_open=on_half_open, on_close=on_close)
+        breaker = registry.get('a')
+        breaker.record_failure()
+        assert breaker.is_open() is True
+
+        monotonic_mock.return_value = 111
+        assert breaker.is_open() is False
+        assert breaker.current_state == 'open'
+        assert breaker.allows_execution() is True
+        assert breaker.current_state == 'half-open'
+        breaker.record_failure()
+        assert breaker.current_state == 'open'
+
+        monotonic_mock.return_value = 122
+        assert breaker.allows_execution() is True
+        breaker.record_success()
+        assert breaker.current_state == 'closed'
+        assert (on_open.call_count, on_half_open.call_count, on_close.call_count) == (2, 2, 1)
+
+    def test_half_open_ratio(self):
+        registry = CircuitBreakerRegistry(half_open_ratio=0.1)
+        breaker = registry.get('a')
+        breaker.half_open()
+
+        assert [breaker.allows_execution() for _ in range(100)].count(True) == 10
+
+    def test_unknown_key_is_closed_and_not_created_by_is_open(self):
+        registry = CircuitBreakerRegistry()
+
+        assert registry.get('a').is_open() is False
+        assert registry.get('a').current_state == 'closed'
+        assert 'a' not in registry
+
+    def test_least_recently_used_closed_breaker_is_evicted(self):
+        registry = CircuitBreakerRegistry(max_size=2)
+        registry.get('a').record_failure()
+        registry.get('b').record_success()
+        registry.get('a').record_success()
+        registry.get('c').record_success()
+
+        assert 'a' in registry and 'c' in registry
+        assert 'b' not in registry
+
+    def test_open_breakers_are_never_evicted(self):
+        registry = CircuitBreakerRegistry(maximum_failures=1, max_size=2)
+        registry.get('a').record_failure()
+        registry.get('b').record_failure()
+        registry.get('c').record_success()
+        registry.get('d').record_success()
+
+        assert registry.get('a').current_state == 'open'
+        assert registry.get('b').current_state == 'open'
+        assert 'c' not in registry
+        assert 'd' in registry
+
+    def test_evicted_slot_is_reused_in_closed_state(self):
+        registry = CircuitBreakerRegistry(maximum_failures=2, max_size=1)
+        registry.get('a').record_failure()
+        registry.get('b').record_failure()
+
+        assert 'a' not in registry
+        assert registry.get('b').current_state == 'closed'
+        assert len(registry._states) == 1
+
+    @patch('time.monotonic')
+    def test_idle_closed_breakers_are_evicted(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        registry = CircuitBreakerRegistry(maximum_failures=1, idle_seconds=60)
+        registry.get('closed').record_success()
+        registry.get('open').record_failure()
+        monotonic_mock.return_value = 130
+        registry.get('recent').record_success()
+
+        monotonic_mock.return_value = 180
+        registry.get('new').record_success()
+
+        assert 'closed' not in registry
+        assert 'open' in registry
+        assert 'recent' in registry
+
+    @patch('time.monotonic')
+    def test_open_for_half_opens_the_key_at_the_hinted_time(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        registry = CircuitBreakerRegistry(reset_timeout_seconds=60)
+
+        registry.get('partner').open_for(5)
+        registry.get('partner').open_for(2)
+        assert registry.get('partner').is_open()
+        assert registry.get('other').current_state == 'closed'
+
+        monotonic_mock.return_value = 105.5
+        assert registry.get('partner').allows_execution()
+        assert registry.get('partner').current_state == 'half-open'
+
+    def test_max_size_must_be_positive(self):
+        with pytest.raises(ValueError):
+            CircuitBreakerRegistry(max_size=0)
+
+
+class TestFailsafeWithCircuitBreakerRegistry:
+
+    def test_breaker_is_selected_per_call(self):
+        async def operation(host):
+            if host == 'down':
+                raise ValueError()
+            return host
+
+        registry = CircuitBreakerRegistry(maximum_failures=1)
+        failsafe = Failsafe(circuit_breaker=registry, circuit_breaker_key=lambda host: host)
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(operation, 'down'))
+        with pytest.raises(CircuitOpen):
+            loop.run_until_complete(failsafe.run(operation, 'down'))
+        assert loop.run_until_complete(failsafe.run(operation, 'up')) == 'up'
+
+    def test_run_many_fails_items_of_open_keys_only(self):
+        called = []
+
+        async def operation(host):
+            called.append(host)
+
+        registry = CircuitBreakerRegistry(maximum_failures=1)
+        registry.get('down').open()
+        failsafe = Failsafe(circuit_breaker=registry, circuit_breaker_key=lambda host: host)
+
+        results = loop.run_until_complete(
+            failsafe.run_many(operation, ['up', 'down', 'up'], return_exceptions=True))
+
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], CircuitOpen)
+        assert called == ['up', 'up']
+
+    def test_circuit_of_the_key_opens_for_the_hinted_duration(self):
+        class ThrottledError(Exception):
+            retry_after_seconds = 5
+
+        async def throttled(host):
+            raise ThrottledError()
+
+        registry = CircuitBreakerRegistry(maximum_failures=10, open_on_retry_after=True)
+        failsafe = Failsafe(circuit_breaker=registry, circuit_breaker_key=lambda host: host)
+
+        with patch('time.monotonic', return_value=100):
+            with pytest.raises(RetriesExhausted):
+                loop.run_until_complete(failsafe.run(throttled, 'down'))
+            assert registry.get('down').current_state == 'open'
+        with patch('time.monotonic', return_value=105.5):
+            assert registry.get('down').allows_execution()
+
+    def test_key_needs_registry(self):
+        with pytest.raises(ValueError):
+            Failsafe(circuit_breaker=CircuitBreaker(), circuit_breaker_key=lambda host: host)
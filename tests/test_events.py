@@ -0,0 +1,233 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import gc
+from unittest.mock import Mock
+
+import pytest
+
+from failsafe import (
+    Failsafe, Event, AsyncEventQueue, RetryPolicy, CircuitBreaker, CircuitOpen, RetriesExhausted,
+    TimeoutExceeded,
+)
+from tests.helpers import SomeAbortableException, create_operation
+
+loop = asyncio.get_event_loop()
+
+
+class TestFailsafeEvents:
+
+    def test_events_of_retried_call(self):
+        events = []
+        error = ValueError()
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1), name='profile', listeners=[events.append])
+
+        loop.run_until_complete(failsafe.run(create_operation(error, 'result')))
+
+        assert [event.type for event in events] == [Event.ATTEMPT_FAILED, Event.RETRY, Event.ATTEMPT_SUCCEEDED]
+        assert [event.attempt for event in events] == [1, 1, 2]
+        assert events[0].exception is error
+        assert events[0].duration_seconds >= 0
+        assert events[2].elapsed_seconds >= events[2].duration_seconds
+        assert all(event.name == 'profile' and event.circuit_state == 'closed' for event in events)
+
+    def test_events_of_failed_call(self):
+        events = []
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1, abortable_exceptions=[SomeAbortableException]),
+                            listeners=[events.append])
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(create_operation(ValueError(), ValueError())))
+        with pytest.raises(SomeAbortableException):
+            loop.run_until_complete(failsafe.run(create_operation(SomeAbortableException())))
+
+        assert [event.type for event in events] == [Event.ATTEMPT_FAILED, Event.RETRY, Event.ATTEMPT_FAILED,
+                                                    Event.RETRIES_EXHAUSTED, Event.ABORT]
+
+    def test_circuit_breaker_events(self):
+        events = []
+        on_open = Mock()
+        circuit_breaker = CircuitBreaker(maximum_failures=1, on_open=on_open)
+        failsafe = Failsafe(circuit_breaker=circuit_breaker, listeners=[events.append])
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(create_operation(ValueError())))
+        with pytest.raises(CircuitOpen):
+            loop.run_until_complete(failsafe.run(create_operation('result')))
+
+        assert [(event.type, event.circuit_state) for event in events] == [
+            (Event.CIRCUIT_OPENED, 'open'),
+            (Event.ATTEMPT_FAILED, 'open'),
+            (Event.RETRIES_EXHAUSTED, 'open'),
+            (Event.CIRCUIT_REJECTED, 'open'),
+        ]
+        on_open.assert_called_once_with()
+
+    def test_shared_circuit_breaker_keeps_its_callbacks_and_no_listener_of_collected_failsafes(self):
+        on_open = Mock()
+        circuit_breaker = CircuitBreaker(maximum_failures=1, on_open=on_open)
+        for _ in range(100):
+            Failsafe(circuit_breaker=circuit_breaker, listeners=[Mock()])
+        gc.collect()
+
+        assert circuit_breaker.on_open is on_open
+        assert circuit_breaker._transition_listeners == ()
+
+    def test_transitions_of_shared_circuit_breaker_are_tagged_with_the_name_of_each_failsafe(self):
+        events = []
+        circuit_breaker = CircuitBreaker(maximum_failures=1)
+        profile = Failsafe(circuit_breaker=circuit_breaker, name='profile', listeners=[events.append])
+        search = Failsafe(circuit_breaker=circuit_breaker, name='search', listeners=[events.append])
+
+        circuit_breaker.open()
+
+        assert [(event.type, event.name) for event in events] == [
+            (Event.CIRCUIT_OPENED, 'profile'), (Event.CIRCUIT_OPENED, 'search')]
+        # the breaker holds the Failsafe instances weakly, they are only kept alive by the test
+        del profile, search
+
+    def test_circuit_breakers_without_current_state_are_supported(self):
+        events = []
+
+        class MinimalCircuitBreaker:
+            def allows_execution(self):
+                return True
+
+            def record_success(self, duration_seconds=None):
+                pass
+
+            def record_failure(self, duration_seconds=None):
+                pass
+
+        failsafe = Failsafe(circuit_breaker=MinimalCircuitBreaker(), listeners=[events.append])
+
+        assert loop.run_until_complete(failsafe.run(create_operation('result'))) == 'result'
+        assert [(event.type, event.circuit_state) for event in events] == [(Event.ATTEMPT_SUCCEEDED, None)]
+
+    def test_timeout_event(self):
+        events = []
+
+        async def operation():
+            await asyncio.sleep(1)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(Failsafe(timeout_seconds=0.01, listeners=[events.append]).run(operation))
+
+        assert [event.type for event in events] == [Event.ATTEMPT_FAILED, Event.TIMEOUT]
+
+    def test_failing_listener_does_not_fail_call(self):
+        listener = Mock(side_effect=Exception())
+
+        result = loop.run_until_complete(Failsafe(listeners=[listener]).run(create_operation('result')))
+
+        assert result == 'result'
+        assert listener.call_count == 1
+
+
+class TestAsyncEventQueue:
+
+    def test_parameters_are_validated(self):
+        with pytest.raises(ValueError):
+            AsyncEventQueue(Mock(), max_size=0)
+
+    def test_events_are_passed_in_batches_off_the_call(self):
+        batches = []
+        release = asyncio.Event()
+
+        async def slow_listener(events):
+            await release.wait()
+            batches.append([event.attempt for event in events])
+
+        queue = AsyncEventQueue(slow_listener, batch_size=2)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=2), listeners=[queue])
+
+        async def scenario():
+            result = await failsafe.run(create_operation(ValueError(), ValueError(), 'result'))
+            assert batches == []
+            release.set()
+            await queue.close()
+            return result
+
+        assert loop.run_until_complete(scenario()) == 'result'
+        assert batches == [[1, 1], [2, 2], [3]]
+        assert len(queue) == 0
+
+    def test_events_are_dropped_when_full(self):
+        received = []
+
+        async def listener(events):
+            received.extend(events)
+
+        queue = AsyncEventQueue(listener, max_size=2)
+
+        async def scenario():
+            for attempt in range(5):
+                queue(Event(Event.RETRY, attempt=attempt))
+            await queue.flush()
+
+        loop.run_until_complete(scenario())
+
+        assert [event.attempt for event in received] == [0, 1]
+        assert queue.dropped == 3
+
+    def test_failing_listener_does_not_stop_dispatching(self):
+        received = []
+
+        async def listener(events):
+            received.extend(events)
+            raise Exception()
+
+        queue = AsyncEventQueue(listener)
+
+        async def scenario():
+            queue(Event(Event.RETRY))
+            await queue.flush()
+            queue(Event(Event.ABORT))
+            await queue.close()
+
+        loop.run_until_complete(scenario())
+
+        assert [event.type for event in received] == [Event.RETRY, Event.ABORT]
+
+    def test_queue_is_dispatched_in_every_event_loop_using_it(self):
+        received = []
+
+        async def listener(events):
+            received.extend(events)
+
+        queue = AsyncEventQueue(listener)
+
+        async def scenario(event_type):
+            queue(Event(event_type))
+            await queue.flush()
+
+        for event_type in (Event.RETRY, Event.ABORT):
+            event_loop = asyncio.new_event_loop()
+            try:
+                event_loop.run_until_complete(scenario(event_type))
+            finally:
+                event_loop.close()
+
+        assert [event.type for event in received] == [Event.RETRY, Event.ABORT]
+
+    def test_events_queued_outside_of_a_loop_are_passed_on_flush(self):
+        received = []
+
+        async def listener(events):
+            received.extend(events)
+
+        queue = AsyncEventQueue(listener)
+        queue(Event(Event.RETRY))
+        loop.run_until_complete(queue.close())
+
+        assert [event.type for event in received] == [Event.RETRY]
@@ -12,12 +12,12 @@
 
 import asyncio
 import unittest
-from unittest.mock import MagicMock, Mock, call
+from unittest.mock import MagicMock, Mock, call, patch
 import pytest
 
 from failsafe import (
     RetryPolicy, Failsafe, CircuitOpen, CircuitBreaker, RetriesExhausted, Delay,
-    Backoff,
+    Backoff, AttemptTimeout, TimeoutExceeded, RetryBudget, deadline_after, get_deadline,
 )
 from datetime import timedelta
 
@@ -52,6 +52,20 @@ def create_failing_operation(exception=None):
     return operation
 
 
+def create_hanging_operation(duration=10):
+    async def operation():
+        operation.called += 1
+        try:
+            await asyncio.sleep(duration)
+        except asyncio.CancelledError:
+            operation.cancelled += 1
+            raise
+
+    operation.called = 0
+    operation.cancelled = 0
+    return operation
+
+
 def create_aborting_operation():
     async def operation():
         operation.called += 1
@@ -293,3 +307,520 @@ class TestFailsafe(unittest.TestCase):
         assert on_retry_mock.called
         assert on_failed_attempt_mock.called
         assert on_retries_exhausted_mock.called
+
+
+class TestFailsafeTimeouts(unittest.TestCase):
+
+    def test_fast_attempt_is_not_affected_by_timeouts(self):
+        async def operation():
+            return "result"
+
+        failsafe = Failsafe(attempt_timeout_seconds=1, timeout_seconds=2)
+        assert loop.run_until_complete(failsafe.run(operation)) == "result"
+
+    def test_attempt_timeout_is_retried_and_cancels_the_attempt(self):
+        hanging_operation = create_hanging_operation()
+        on_failed_attempt_mock = Mock()
+        policy = RetryPolicy(allowed_retries=2, on_failed_attempt=on_failed_attempt_mock)
+        failsafe = Failsafe(retry_policy=policy, attempt_timeout_seconds=0.01)
+
+        with pytest.raises(RetriesExhausted) as exc_info:
+            loop.run_until_complete(failsafe.run(hanging_operation))
+
+        assert isinstance(exc_info.value.__cause__, AttemptTimeout)
+        assert hanging_operation.called == 3
+        assert on_failed_attempt_mock.call_count == 3
+        loop.run_until_complete(asyncio.sleep(0))
+        assert hanging_operation.cancelled == 3
+
+    def test_attempt_timeout_is_recorded_by_circuit_breaker(self):
+        hanging_operation = create_hanging_operation()
+        circuit_breaker = CircuitBreaker(maximum_failures=2)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=5), circuit_breaker=circuit_breaker,
+                            attempt_timeout_seconds=0.01)
+
+        with pytest.raises(CircuitOpen) as exc_info:
+            loop.run_until_complete(failsafe.run(hanging_operation))
+
+        assert isinstance(exc_info.value.__cause__, AttemptTimeout)
+        assert hanging_operation.called == 2
+
+    def test_attempt_timeout_respects_retriable_exceptions(self):
+        hanging_operation = create_hanging_operation()
+        policy = RetryPolicy(allowed_retries=2, retriable_exceptions=[SomeRetriableException])
+        failsafe = Failsafe(retry_policy=policy, attempt_timeout_seconds=0.01)
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(hanging_operation))
+
+        assert hanging_operation.called == 1
+
+    def test_overall_timeout_cancels_running_attempt(self):
+        hanging_operation = create_hanging_operation()
+        circuit_breaker = CircuitBreaker(maximum_failures=1)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=5), circuit_breaker=circuit_breaker,
+                            timeout_seconds=0.02)
+
+        with pytest.raises(TimeoutExceeded) as exc_info:
+            loop.run_until_complete(failsafe.run(hanging_operation))
+
+        assert isinstance(exc_info.value.__cause__, AttemptTimeout)
+        assert hanging_operation.called == 1
+        assert circuit_breaker.current_state == 'open'
+
+    def test_overall_timeout_spans_retries(self):
+        hanging_operation = create_hanging_operation()
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=100), attempt_timeout_seconds=0.01,
+                            timeout_seconds=0.035)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(failsafe.run(hanging_operation))
+
+        assert 3 <= hanging_operation.called <= 4
+
+    def test_no_retry_when_backoff_exceeds_overall_timeout(self):
+        failing_operation = create_failing_operation()
+        policy = RetryPolicy(allowed_retries=3, backoff=Delay(timedelta(seconds=10)))
+        failsafe = Failsafe(retry_policy=policy, timeout_seconds=1)
+
+        with pytest.raises(TimeoutExceeded) as exc_info:
+            loop.run_until_complete(failsafe.run(failing_operation))
+
+        assert isinstance(exc_info.value.__cause__, SomeRetriableException)
+        assert failing_operation.called == 1
+
+
+class TestFailsafeRetryBudget(unittest.TestCase):
+
+    def test_budget_is_shared_between_failsafes(self):
+        budget = RetryBudget(retry_ratio=0.5, min_retries_per_second=0)
+        succeeding = Failsafe(retry_policy=RetryPolicy(retry_budget=budget))
+        failing = Failsafe(retry_policy=RetryPolicy(allowed_retries=3, retry_budget=budget))
+        failing_operation = create_failing_operation()
+
+        for _ in range(4):
+            loop.run_until_complete(succeeding.run(create_succeeding_operation()))
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failing.run(failing_operation))
+
+        assert failing_operation.called == 3
+        assert budget.exhausted_count == 1
+
+    def test_nested_failsafes_share_budget(self):
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0)
+        budget.deposit()
+        inner = Failsafe(retry_policy=RetryPolicy(allowed_retries=5, retry_budget=budget))
+        outer = Failsafe(retry_policy=RetryPolicy(allowed_retries=5, retry_budget=budget))
+        failing_operation = create_failing_operation()
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(outer.run(inner.run, failing_operation))
+
+        # the inner retry uses the only token, so the outer failsafe does not multiply the attempts
+        assert failing_operation.called == 2
+        assert budget.exhausted_count == 2
+
+    def test_retry_dropped_by_the_timeout_is_given_back_to_the_budget(self):
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0)
+        budget.deposit()
+        retry_policy = RetryPolicy(allowed_retries=1, backoff=Delay(timedelta(seconds=10)), retry_budget=budget)
+        failsafe = Failsafe(retry_policy=retry_policy, timeout_seconds=1)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(failsafe.run(create_failing_operation()))
+
+        assert budget.try_withdraw() is True
+
+
+class ThrottledError(Exception):
+
+    def __init__(self, retry_after_seconds):
+        super(ThrottledError, self).__init__()
+        self.retry_after_seconds = retry_after_seconds
+
+
+class TestFailsafeRetryAfter(unittest.TestCase):
+
+    def test_circuit_opens_for_the_hinted_duration(self):
+        circuit_breaker = CircuitBreaker(maximum_failures=10, reset_timeout_seconds=60, open_on_retry_after=True)
+        failsafe = Failsafe(circuit_breaker=circuit_breaker)
+
+        async def throttled():
+            raise ThrottledError(5)
+
+        with patch('time.monotonic', return_value=100):
+            with pytest.raises(RetriesExhausted):
+                loop.run_until_complete(failsafe.run(throttled))
+            assert circuit_breaker.current_state == 'open'
+            assert circuit_breaker._open.half_open_at == 105
+
+    def test_circuit_breaker_must_support_open_for(self):
+        class CustomCircuitBreaker:
+            open_on_retry_after = True
+
+            def allows_execution(self):
+                return True
+
+        with pytest.raises(ValueError):
+            Failsafe(circuit_breaker=CustomCircuitBreaker())
+
+    def test_hint_does_not_open_the_circuit_by_default(self):
+        circuit_breaker = CircuitBreaker(maximum_failures=10)
+        failsafe = Failsafe(circuit_breaker=circuit_breaker)
+
+        async def throttled():
+            raise ThrottledError(5)
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(throttled))
+        assert circuit_breaker.current_state == 'closed'
+
+    def test_call_waits_as_long_as_asked_before_retrying(self):
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1))
+        outcomes = [ThrottledError(0.05), None]
+
+        async def throttled_once():
+            outcome = outcomes.pop(0)
+            if outcome is not None:
+                raise outcome
+            return 'done'
+
+        started_at = loop.time()
+        assert loop.run_until_complete(failsafe.run(throttled_once)) == 'done'
+        assert loop.time() - started_at >= 0.05
+
+    def test_pushback_stops_retries(self):
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=3))
+        calls = []
+
+        async def pushed_back():
+            calls.append(1)
+            raise ThrottledError(-1)
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(pushed_back))
+        assert len(calls) == 1
+
+
+class TestFailsafeDeadline(unittest.TestCase):
+
+    def test_deadline_limits_the_call(self):
+        hanging_operation = create_hanging_operation()
+
+        async def scenario():
+            with deadline_after(0.02):
+                await Failsafe().run(hanging_operation)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(scenario())
+
+        assert hanging_operation.called == 1
+
+    def test_no_retry_when_backoff_exceeds_deadline(self):
+        failing_operation = create_failing_operation()
+        policy = RetryPolicy(allowed_retries=3, backoff=Delay(timedelta(seconds=5)))
+
+        async def scenario():
+            with deadline_after(1):
+                await Failsafe(retry_policy=policy).run(failing_operation)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(scenario())
+
+        assert failing_operation.called == 1
+
+    def test_earliest_of_deadline_and_timeout_is_used(self):
+        async def operation():
+            return get_deadline()
+
+        async def scenario():
+            with deadline_after(10) as deadline:
+                assert await Failsafe(timeout_seconds=1).run(operation) < deadline
+                assert await Failsafe(timeout_seconds=100).run(operation) == deadline
+
+        loop.run_until_complete(scenario())
+
+    def test_nested_failsafe_inherits_timeout_as_deadline(self):
+        hanging_operation = create_hanging_operation()
+        inner = Failsafe()
+        outer = Failsafe(timeout_seconds=0.02)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(outer.run(inner.run, hanging_operation))
+
+        assert hanging_operation.called == 1
+        assert get_deadline() is None
+
+    def test_deadline_is_not_set_after_call(self):
+        loop.run_until_complete(Failsafe(timeout_seconds=1).run(create_succeeding_operation()))
+        assert get_deadline() is None
+
+
+class TestFailsafeCoalescing(unittest.TestCase):
+
+    def test_concurrent_calls_with_same_key_share_execution(self):
+        called = []
+
+        async def operation(key):
+            called.append(key)
+            await asyncio.sleep(0.01)
+            return object()
+
+        failsafe = Failsafe(coalesce_key=lambda key: key)
+
+        async def scenario():
+            return await asyncio.gather(failsafe.run(operation, 'a'), failsafe.run(operation, 'a'),
+                                        failsafe.run(operation, 'b'))
+
+        first, second, other = loop.run_until_complete(scenario())
+
+        assert sorted(called) == ['a', 'b']
+        assert first is second
+        assert first is not other
+        assert failsafe._coalesced_calls == {}
+
+    def test_retries_are_shared_and_exception_is_raised_to_every_call(self):
+        failing_operation = create_failing_operation()
+        circuit_breaker = CircuitBreaker(maximum_failures=10)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=2), circuit_breaker=circuit_breaker,
+                            coalesce_key=lambda: 'key')
+
+        async def scenario():
+            return await asyncio.gather(*[failsafe.run(failing_operation) for _ in range(5)],
+                                        return_exceptions=True)
+
+        results = loop.run_until_complete(scenario())
+
+        assert all(isinstance(result, RetriesExhausted) for result in results)
+        assert failing_operation.called == 3
+        assert circuit_breaker.current_state == 'closed'
+
+    def test_sequential_calls_are_not_coalesced(self):
+        succeeding_operation = create_succeeding_operation()
+        failsafe = Failsafe(coalesce_key=lambda: 'key')
+
+        loop.run_until_complete(failsafe.run(succeeding_operation))
+        loop.run_until_complete(failsafe.run(succeeding_operation))
+
+        assert succeeding_operation.called == 2
+
+    def test_none_key_is_not_coalesced(self):
+        hanging_operation = create_hanging_operation()
+        failsafe = Failsafe(coalesce_key=lambda: None, timeout_seconds=0.01)
+
+        async def scenario():
+            return await asyncio.gather(failsafe.run(hanging_operation), failsafe.run(hanging_operation),
+                                        return_exceptions=True)
+
+        loop.run_until_complete(scenario())
+
+        assert hanging_operation.called == 2
+
+    def test_cancelled_call_does_not_cancel_shared_execution(self):
+        async def operation():
+            await asyncio.sleep(0.02)
+            return 'result'
+
+        failsafe = Failsafe(coalesce_key=lambda: 'key')
+
+        async def scenario():
+            cancelled = asyncio.ensure_future(failsafe.run(operation))
+            waiting = asyncio.ensure_future(failsafe.run(operation))
+            await asyncio.sleep(0.005)
+            cancelled.cancel()
+            return await waiting, cancelled.cancelled()
+
+        assert loop.run_until_complete(scenario()) == ('result', True)
+
+    def test_shared_execution_is_cancelled_when_every_call_is_cancelled(self):
+        hanging_operation = create_hanging_operation()
+        failsafe = Failsafe(coalesce_key=lambda: 'key')
+
+        async def scenario():
+            calls = [asyncio.ensure_future(failsafe.run(hanging_operation)) for _ in range(2)]
+            await asyncio.sleep(0.005)
+            for waiting in calls:
+                waiting.cancel()
+            await asyncio.sleep(0.005)
+
+        loop.run_until_complete(scenario())
+
+        assert hanging_operation.called == 1
+        assert hanging_operation.cancelled == 1
+        assert failsafe._coalesced_calls == {}
+
+    def test_cancelled_shared_execution_is_not_recorded_as_a_failure(self):
+        hanging_operation = create_hanging_operation()
+        circuit_breaker = CircuitBreaker(maximum_failures=1)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1), circuit_breaker=circuit_breaker,
+                            coalesce_key=lambda: 'key')
+
+        async def scenario():
+            waiting = asyncio.ensure_future(failsafe.run(hanging_operation))
+            await asyncio.sleep(0.005)
+            shared_task = failsafe._coalesced_calls['key'].task
+            waiting.cancel()
+            await asyncio.sleep(0.005)
+            return shared_task
+
+        shared_task = loop.run_until_complete(scenario())
+
+        assert shared_task.cancelled()
+        assert hanging_operation.called == 1
+        assert circuit_breaker.current_state == 'closed'
+
+    def test_joining_call_stops_waiting_at_its_own_deadline(self):
+        async def operation():
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        failsafe = Failsafe(coalesce_key=lambda: 'key')
+
+        async def joining_call():
+            with deadline_after(0.01):
+                return await failsafe.run(operation)
+
+        async def scenario():
+            return await asyncio.gather(failsafe.run(operation), joining_call(), return_exceptions=True)
+
+        result, joined = loop.run_until_complete(scenario())
+
+        assert result == 'result'
+        assert isinstance(joined, TimeoutExceeded)
+
+
+class TestFailsafeRunMany(unittest.TestCase):
+
+    def test_results_are_in_item_order(self):
+        async def operation(item):
+            await asyncio.sleep(0.001 * (5 - item))
+            return item * 2
+
+        results = loop.run_until_complete(Failsafe().run_many(operation, range(5), concurrency=5))
+
+        assert results == [0, 2, 4, 6, 8]
+
+    def test_concurrency_is_bounded_and_items_are_consumed_lazily(self):
+        running = []
+        max_running = []
+        consumed = []
+
+        async def operation(item):
+            running.append(item)
+            max_running.append(len(running))
+            await asyncio.sleep(0.001)
+            running.remove(item)
+            return item
+
+        def items():
+            for item in range(10):
+                consumed.append(item)
+                yield item
+
+        async def scenario():
+            iterator = Failsafe().run_iter(operation, items(), concurrency=3)
+            first = await iterator.__anext__()
+            consumed_after_first = len(consumed)
+            rest = [pair async for pair in iterator]
+            return first, consumed_after_first, rest
+
+        first, consumed_after_first, rest = loop.run_until_complete(scenario())
+
+        assert max(max_running) == 3
+        assert consumed_after_first <= 6
+        assert sorted([first] + rest) == [(item, item) for item in range(10)]
+
+    def test_only_failed_items_are_retried(self):
+        attempts = {}
+
+        async def operation(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            if item == 1 and attempts[item] == 1:
+                raise ValueError()
+            return item
+
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1))
+
+        assert loop.run_until_complete(failsafe.run_many(operation, range(3))) == [0, 1, 2]
+        assert attempts == {0: 1, 1: 2, 2: 1}
+
+    def test_first_exception_is_raised(self):
+        async def operation(item):
+            if item == 2:
+                raise ValueError()
+            return item
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(Failsafe().run_many(operation, range(5), concurrency=1))
+
+    def test_exceptions_are_returned(self):
+        async def operation(item):
+            if item == 1:
+                raise ValueError()
+            return item
+
+        results = loop.run_until_complete(Failsafe().run_many(operation, range(3), return_exceptions=True))
+
+        assert results[0] == 0 and results[2] == 2
+        assert isinstance(results[1], RetriesExhausted)
+
+    def test_remaining_items_are_short_circuited_when_circuit_opens(self):
+        failing_operation = create_failing_operation()
+        failsafe = Failsafe(circuit_breaker=CircuitBreaker(maximum_failures=2))
+
+        results = loop.run_until_complete(
+            failsafe.run_many(lambda item: failing_operation(), range(100), concurrency=2, return_exceptions=True))
+
+        assert failing_operation.called == 2
+        assert len(results) == 100
+        assert all(isinstance(result, CircuitOpen) for result in results[2:])
+
+    def test_running_calls_are_cancelled_after_the_first_exception(self):
+        called = []
+
+        async def operation(item):
+            called.append(item)
+            if item == 0:
+                raise ValueError()
+            await asyncio.sleep(0.01)
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(Failsafe().run_many(operation, range(50), concurrency=10))
+        loop.run_until_complete(asyncio.sleep(0.02))
+
+        # the worker of the failed item may start the next one before the workers are cancelled
+        assert len(called) <= 11
+
+    def test_circuit_breakers_without_is_open_are_supported(self):
+        class MinimalCircuitBreaker:
+            def allows_execution(self):
+                return True
+
+            def record_success(self, duration_seconds=None):
+                pass
+
+            def record_failure(self, duration_seconds=None):
+                pass
+
+        failsafe = Failsafe(circuit_breaker=MinimalCircuitBreaker())
+
+        async def operation(item):
+            return item
+
+        assert loop.run_until_complete(failsafe.run_many(operation, range(3))) == [0, 1, 2]
+
+    def test_exception_of_the_items_is_raised(self):
+        def items():
+            yield 0
+            raise KeyError()
+
+        async def operation(item):
+            return item
+
+        with pytest.raises(KeyError):
+            loop.run_until_complete(Failsafe().run_many(operation, items(), concurrency=1))
+
+    def test_concurrency_must_be_positive(self):
+        with pytest.raises(ValueError):
+            loop.run_until_complete(Failsafe().run_many(create_succeeding_operation(), [], concurrency=0))
@@ -11,11 +11,15 @@
 # limitations under the License.
 
 import asyncio
+from datetime import timedelta
 import unittest
 import pytest
 
-from failsafe import FallbackFailsafe, FallbacksExhausted
-from failsafe import RetryPolicy
+from failsafe import (
+    FallbackFailsafe, FallbacksExhausted, TimeoutExceeded, Delay, deadline_after, CircuitOpen, OptionHealth,
+)
+from failsafe import RetryPolicy, RetryBudget, CircuitBreaker
+from unittest.mock import Mock, patch
 
 loop = asyncio.get_event_loop()
 
@@ -85,3 +89,283 @@ class TestFallbackFailsafe(unittest.TestCase):
         with pytest.raises(ValueError):
             loop.run_until_complete(
                 fallback_failsafe.run(call))
+
+    def test_retry_budget_is_shared_by_fallback_options(self):
+        calls = []
+
+        async def call(option):
+            calls.append(option)
+            raise Exception()
+
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0)
+        budget.deposit()
+        budget.deposit()
+        fallback_failsafe = FallbackFailsafe(["option 1", "option 2"], retry_budget=budget,
+                                             retry_policy_factory=lambda _: RetryPolicy(allowed_retries=3),
+                                             circuit_breaker_factory=lambda _: CircuitBreaker(maximum_failures=10))
+
+        with pytest.raises(FallbacksExhausted):
+            loop.run_until_complete(
+                fallback_failsafe.run(call))
+
+        assert calls == ["option 1", "option 1", "option 1", "option 2"]
+        assert budget.exhausted_count == 2
+
+    def test_later_options_only_get_remaining_time(self):
+        calls = []
+
+        async def call(option):
+            calls.append(option)
+            await asyncio.sleep(10)
+
+        fallback_failsafe = FallbackFailsafe(["option 1", "option 2"], timeout_seconds=0.02)
+
+        with pytest.raises(TimeoutExceeded):
+            loop.run_until_complete(
+                fallback_failsafe.run(call))
+
+        assert calls == ["option 1"]
+
+    def test_backoff_past_deadline_skips_to_next_option(self):
+        calls = []
+
+        async def call(option):
+            calls.append(option)
+            if option == "option 1":
+                raise Exception()
+            return "return value"
+
+        fallback_failsafe = FallbackFailsafe(
+            ["option 1", "option 2"],
+            retry_policy_factory=lambda _: RetryPolicy(allowed_retries=3, backoff=Delay(timedelta(seconds=5))))
+
+        async def scenario():
+            with deadline_after(1):
+                return await fallback_failsafe.run(call)
+
+        assert loop.run_until_complete(scenario()) == "return value"
+        assert calls == ["option 1", "option 2"]
+
+
+class TestRacingFallbackFailsafe(unittest.TestCase):
+
+    def create_call(self, durations, failing=()):
+        calls = []
+        cancelled = []
+
+        async def call(option):
+            calls.append(option)
+            try:
+                await asyncio.sleep(durations[option])
+            except asyncio.CancelledError:
+                cancelled.append(option)
+                raise
+            if option in failing:
+                raise Exception()
+            return option
+
+        return call, calls, cancelled
+
+    def test_first_success_wins_and_others_are_cancelled(self):
+        call, calls, cancelled = self.create_call({"slow": 10, "fast": 0.01, "third": 0})
+        fallback_failsafe = FallbackFailsafe(["slow", "fast", "third"], concurrent_options=2)
+
+        result = loop.run_until_complete(fallback_failsafe.run(call))
+        loop.run_until_complete(asyncio.sleep(0))
+
+        assert result == "fast"
+        assert calls == ["slow", "fast"]
+        assert cancelled == ["slow"]
+
+    def test_failed_option_is_replaced_with_next_one(self):
+        call, calls, _ = self.create_call({"slow": 0.05, "failing": 0, "third": 0.01}, failing={"failing"})
+        fallback_failsafe = FallbackFailsafe(["slow", "failing", "third"], concurrent_options=2,
+                                             retry_policy_factory=lambda _: RetryPolicy(allowed_retries=0))
+
+        result = loop.run_until_complete(fallback_failsafe.run(call))
+
+        assert result == "third"
+        assert calls == ["slow", "failing", "third"]
+
+    def test_options_are_staggered(self):
+        call, calls, _ = self.create_call({"first": 0.03, "second": 0})
+        fallback_failsafe = FallbackFailsafe(["first", "second"], concurrent_options=2, stagger_seconds=0.01)
+
+        assert loop.run_until_complete(fallback_failsafe.run(call)) == "second"
+        assert calls == ["first", "second"]
+
+    def test_fast_option_is_not_staggered(self):
+        call, calls, _ = self.create_call({"first": 0, "second": 0})
+        fallback_failsafe = FallbackFailsafe(["first", "second"], concurrent_options=2, stagger_seconds=0.05)
+
+        assert loop.run_until_complete(fallback_failsafe.run(call)) == "first"
+        assert calls == ["first"]
+
+    def test_exception_is_raised_when_all_options_fail(self):
+        call, calls, _ = self.create_call({"first": 0, "second": 0, "third": 0}, failing={"first", "second", "third"})
+        fallback_failsafe = FallbackFailsafe(["first", "second", "third"], concurrent_options=2,
+                                             retry_policy_factory=lambda _: RetryPolicy(allowed_retries=0))
+
+        with pytest.raises(FallbacksExhausted):
+            loop.run_until_complete(fallback_failsafe.run(call))
+
+        assert calls == ["first", "second", "third"]
+
+    def test_abortable_exception_cancels_other_options(self):
+        cancelled = []
+
+        async def call(option):
+            if option == "aborting":
+                raise ValueError()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(option)
+                raise
+
+        policy = RetryPolicy(abortable_exceptions=[ValueError])
+        fallback_failsafe = FallbackFailsafe(["slow", "aborting"], retry_policy_factory=lambda _: policy,
+                                             concurrent_options=2)
+
+        with pytest.raises(ValueError):
+            loop.run_until_complete(fallback_failsafe.run(call))
+        loop.run_until_complete(asyncio.sleep(0))
+
+        assert cancelled == ["slow"]
+
+
+class TestHealthAwareFallbackFailsafe(unittest.TestCase):
+
+    def test_options_with_open_circuit_are_not_called(self):
+        calls = []
+
+        async def call(option):
+            calls.append(option)
+            return option
+
+        fallback_failsafe = FallbackFailsafe(["option 1", "option 2"])
+        fallback_failsafe.failsafes[0][1].circuit_breaker.open()
+        fallback_failsafe.failsafes[0][1].run = Mock(side_effect=AssertionError("should not be called"))
+
+        assert loop.run_until_complete(fallback_failsafe.run(call)) == "option 2"
+        assert calls == ["option 2"]
+
+    def test_all_open_circuits_raise_with_circuit_open_cause(self):
+        async def call(option):
+            return option
+
+        fallback_failsafe = FallbackFailsafe(["option 1", "option 2"])
+        for _, failsafe in fallback_failsafe.failsafes:
+            failsafe.circuit_breaker.open()
+
+        with pytest.raises(FallbacksExhausted) as exc_info:
+            loop.run_until_complete(fallback_failsafe.run(call))
+
+        assert isinstance(exc_info.value.__cause__, CircuitOpen)
+
+    def test_racing_skips_open_circuits(self):
+        calls = []
+
+        async def call(option):
+            calls.append(option)
+            if option == "option 3":
+                await asyncio.sleep(0.01)
+            return option
+
+        fallback_failsafe = FallbackFailsafe(["option 1", "option 2", "option 3"], concurrent_options=2)
+        fallback_failsafe.failsafes[0][1].circuit_breaker.open()
+
+        assert loop.run_until_complete(fallback_failsafe.run(call)) == "option 2"
+        assert calls == ["option 2", "option 3"]
+
+    def test_options_are_ordered_by_health(self):
+        calls = []
+        durations = {"slow": 0.02, "fast": 0}
+
+        async def call(option):
+            calls.append(option)
+            await asyncio.sleep(durations[option])
+            return option
+
+        fallback_failsafe = FallbackFailsafe(["slow", "fast"], order_by_health=True)
+
+        results = [loop.run_until_complete(fallback_failsafe.run(call)) for _ in range(4)]
+
+        # every option is tried once, then the fastest one is preferred
+        assert results == ["slow", "fast", "fast", "fast"]
+
+    def test_failing_option_is_moved_back(self):
+        calls = []
+
+        async def call(option):
+            calls.append(option)
+            if option == "failing":
+                raise Exception()
+            return option
+
+        fallback_failsafe = FallbackFailsafe(["failing", "healthy"], order_by_health=True,
+                                             retry_policy_factory=lambda _: RetryPolicy(allowed_retries=0),
+                                             circuit_breaker_factory=lambda _: CircuitBreaker(maximum_failures=100))
+
+        for _ in range(3):
+            assert loop.run_until_complete(fallback_failsafe.run(call)) == "healthy"
+
+        assert calls == ["failing", "healthy", "healthy", "healthy"]
+
+    def test_circuit_breakers_without_is_open_are_supported(self):
+        class MinimalCircuitBreaker:
+            def allows_execution(self):
+                return True
+
+            def record_success(self, duration_seconds=None):
+                pass
+
+            def record_failure(self, duration_seconds=None):
+                pass
+
+        async def call(option):
+            return option
+
+        fallback_failsafe = FallbackFailsafe(["option 1"], circuit_breaker_factory=lambda _: MinimalCircuitBreaker())
+        assert loop.run_until_complete(fallback_failsafe.run(call)) == "option 1"
+
+        fallback_failsafe = FallbackFailsafe(["option 1"], circuit_breaker_factory=lambda _: MinimalCircuitBreaker(),
+                                             concurrent_options=2)
+        assert loop.run_until_complete(fallback_failsafe.run(call)) == "option 1"
+
+
+class TestOptionHealth:
+
+    def test_untried_option_scores_zero(self):
+        assert OptionHealth().score == 0
+
+    def test_option_which_only_failed_scores_infinity(self):
+        health = OptionHealth()
+        health.record_failure()
+        assert health.score == float('inf')
+
+    @patch('time.monotonic')
+    def test_stale_option_scores_zero_again(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        health = OptionHealth(stale_seconds=60)
+        health.record_failure()
+
+        monotonic_mock.return_value = 159
+        assert health.score == float('inf')
+        monotonic_mock.return_value = 160
+        assert health.score == 0
+
+        health.record_success(0.1)
+        assert health.score == pytest.approx(0.1 / 0.84)
+
+    def test_score_grows_with_latency_and_failures(self):
+        health = OptionHealth(smoothing=0.5)
+        health.record_success(0.1)
+        assert health.score == 0.1
+
+        health.record_success(0.3)
+        assert health.latency_seconds == 0.2
+
+        health.record_failure()
+        assert health.success_rate == 0.5
+        assert health.score == 0.4
@@ -0,0 +1,225 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+from unittest.mock import Mock
+
+import pytest
+
+from failsafe import (
+    Failsafe, HedgePolicy, CircuitBreaker, RetriesExhausted, Bulkhead, RateLimiter, AdaptiveThrottle,
+)
+
+loop = asyncio.get_event_loop()
+
+
+def create_operation(durations, exceptions=None):
+    """
+    Creates an operation whose n-th call sleeps for durations[n] and then returns n,
+    or raises exceptions[n] if given.
+    """
+    exceptions = exceptions or {}
+
+    async def operation():
+        call = operation.called
+        operation.called += 1
+        try:
+            await asyncio.sleep(durations[call])
+        except asyncio.CancelledError:
+            operation.cancelled.append(call)
+            raise
+        if call in exceptions:
+            raise exceptions[call]
+        return call
+
+    operation.called = 0
+    operation.cancelled = []
+    return operation
+
+
+class TestHedgePolicy:
+
+    def test_delay_or_percentile_is_required(self):
+        with pytest.raises(ValueError):
+            HedgePolicy()
+
+        with pytest.raises(ValueError):
+            HedgePolicy(latency_percentile=120)
+
+    def test_fixed_delay(self):
+        assert HedgePolicy(delay_seconds=0.3).delay() == 0.3
+
+    def test_percentile_delay_is_learned_from_latencies(self):
+        hedge_policy = HedgePolicy(latency_percentile=90, sample_size=100, min_samples=100)
+        assert hedge_policy.delay() is None
+
+        for i in range(1, 101):
+            hedge_policy.record_latency(i / 100)
+
+        assert hedge_policy.delay() == 0.9
+
+    def test_fixed_delay_is_used_until_enough_samples(self):
+        hedge_policy = HedgePolicy(delay_seconds=1, latency_percentile=50, sample_size=10, min_samples=10)
+
+        for _ in range(9):
+            hedge_policy.record_latency(0.1)
+        assert hedge_policy.delay() == 1
+
+        hedge_policy.record_latency(0.1)
+        assert hedge_policy.delay() == 0.1
+
+    def test_percentile_only_uses_recent_latencies(self):
+        hedge_policy = HedgePolicy(latency_percentile=50, sample_size=10, min_samples=10)
+
+        for _ in range(10):
+            hedge_policy.record_latency(5)
+        for _ in range(10):
+            hedge_policy.record_latency(0.1)
+
+        assert hedge_policy.delay() == 0.1
+
+    def test_hedges_are_limited_by_ratio(self):
+        hedge_policy = HedgePolicy(delay_seconds=0.1, max_hedged_ratio=0.1)
+
+        allowed = 0
+        for _ in range(1000):
+            hedge_policy.record_attempt()
+            if hedge_policy.allows_hedge():
+                allowed += 1
+
+        assert allowed == 100
+
+
+class TestFailsafeWithHedging(unittest.TestCase):
+
+    def test_fast_attempt_is_not_hedged(self):
+        operation = create_operation([0])
+        on_hedge_mock = Mock()
+        hedge_policy = HedgePolicy(delay_seconds=0.05, max_hedged_ratio=1, on_hedge=on_hedge_mock)
+
+        result = loop.run_until_complete(Failsafe(hedge_policy=hedge_policy).run(operation))
+
+        assert result == 0
+        assert operation.called == 1
+        assert not on_hedge_mock.called
+
+    def test_hedged_attempt_wins_and_slow_attempt_is_cancelled(self):
+        operation = create_operation([10, 0])
+        on_hedge_mock = Mock()
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1, on_hedge=on_hedge_mock)
+
+        result = loop.run_until_complete(Failsafe(hedge_policy=hedge_policy).run(operation))
+        loop.run_until_complete(asyncio.sleep(0))
+
+        assert result == 1
+        assert operation.called == 2
+        assert operation.cancelled == [0]
+        assert on_hedge_mock.call_count == 1
+
+    def test_first_attempt_can_win_after_hedging(self):
+        operation = create_operation([0.03, 10])
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+
+        result = loop.run_until_complete(Failsafe(hedge_policy=hedge_policy).run(operation))
+        loop.run_until_complete(asyncio.sleep(0))
+
+        assert result == 0
+        assert operation.cancelled == [1]
+
+    def test_failed_attempt_waits_for_the_hedged_one(self):
+        operation = create_operation([0.03, 0.05], exceptions={0: ValueError()})
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+
+        result = loop.run_until_complete(Failsafe(hedge_policy=hedge_policy).run(operation))
+
+        assert result == 1
+
+    def test_attempt_fails_when_all_executions_fail(self):
+        operation = create_operation([0.03, 0.05], exceptions={0: ValueError(), 1: KeyError()})
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+
+        with pytest.raises(RetriesExhausted) as exc_info:
+            loop.run_until_complete(Failsafe(hedge_policy=hedge_policy).run(operation))
+
+        assert isinstance(exc_info.value.__cause__, KeyError)
+
+    def test_no_hedge_when_circuit_is_not_closed(self):
+        operation = create_operation([0.03])
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+        circuit_breaker = CircuitBreaker(half_open_ratio=1, half_open_successes=2)
+        circuit_breaker.half_open()
+
+        result = loop.run_until_complete(
+            Failsafe(circuit_breaker=circuit_breaker, hedge_policy=hedge_policy).run(operation)
+        )
+
+        assert result == 0
+        assert operation.called == 1
+        assert circuit_breaker._half_open.attempts == 1
+
+    def test_no_hedge_when_bulkhead_is_full(self):
+        operation = create_operation([0.03])
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+        bulkhead = Bulkhead(max_concurrent_calls=1)
+
+        loop.run_until_complete(Failsafe(hedge_policy=hedge_policy, bulkhead=bulkhead).run(operation))
+
+        assert operation.called == 1
+
+    def test_hedge_holds_a_bulkhead_permit_until_it_completes(self):
+        operation = create_operation([10, 0.02])
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+        bulkhead = Bulkhead(max_concurrent_calls=2)
+        in_flight = []
+
+        async def observed_operation():
+            in_flight.append(bulkhead.in_flight)
+            return await operation()
+
+        result = loop.run_until_complete(Failsafe(hedge_policy=hedge_policy, bulkhead=bulkhead).run(observed_operation))
+        loop.run_until_complete(asyncio.sleep(0))
+
+        assert result == 1
+        assert in_flight == [1, 2]
+        assert bulkhead.in_flight == 0
+
+    def test_no_hedge_without_rate_limiter_permit(self):
+        operation = create_operation([0.03])
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+        bulkhead = Bulkhead(max_concurrent_calls=2)
+        failsafe = Failsafe(hedge_policy=hedge_policy, bulkhead=bulkhead, rate_limiter=RateLimiter(calls_per_second=1))
+
+        loop.run_until_complete(failsafe.run(operation))
+
+        assert operation.called == 1
+        assert bulkhead.in_flight == 0
+
+    def test_no_hedge_while_throttle_rejects(self):
+        operation = create_operation([0.03])
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=1)
+        throttle = AdaptiveThrottle(k=1)
+        throttle.record_rejection()
+        throttle.random = Mock()
+        throttle.random.random.return_value = 0.99
+
+        loop.run_until_complete(Failsafe(hedge_policy=hedge_policy, throttle=throttle).run(operation))
+
+        assert operation.called == 1
+
+    def test_no_hedge_when_ratio_is_exceeded(self):
+        operation = create_operation([0.02, 0.02])
+        hedge_policy = HedgePolicy(delay_seconds=0.01, max_hedged_ratio=0.5)
+
+        loop.run_until_complete(Failsafe(hedge_policy=hedge_policy).run(operation))
+
+        assert operation.called == 1
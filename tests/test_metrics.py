@@ -0,0 +1,169 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import gc
+from unittest.mock import Mock
+
+import pytest
+
+from failsafe import (
+    Failsafe, FailsafeMetrics, LatencyHistogram, prometheus_text, RetryPolicy, CircuitBreaker, CircuitOpen,
+    RetriesExhausted,
+)
+from tests.helpers import SomeAbortableException, create_operation
+
+loop = asyncio.get_event_loop()
+
+
+class TestLatencyHistogram:
+
+    def test_sub_bucket_bits_must_be_positive(self):
+        with pytest.raises(ValueError):
+            LatencyHistogram(sub_bucket_bits=0)
+
+    def test_empty_histogram(self):
+        histogram = LatencyHistogram()
+
+        assert histogram.percentile(50) is None
+        assert histogram.count == 0
+
+    def test_percentiles_are_within_relative_error(self):
+        histogram = LatencyHistogram(sub_bucket_bits=3)
+        durations = [i / 10000.0 for i in range(1, 10001)]
+        for duration in durations:
+            histogram.record(duration)
+
+        assert histogram.count == 10000
+        assert histogram.sum == pytest.approx(sum(durations))
+        for percentile in [1, 50, 90, 99, 99.9, 100]:
+            exact = durations[int(len(durations) * percentile / 100.0) - 1]
+            assert exact <= histogram.percentile(percentile) <= exact * 1.125 + 0.000001
+
+    def test_small_durations_are_exact(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.000003)
+        histogram.record(0)
+        histogram.record(-1)
+
+        assert histogram.percentile(100) == 0.000004
+        assert histogram.percentile(50) == 0.000001
+
+    def test_long_durations_are_counted_in_last_bucket(self):
+        histogram = LatencyHistogram(max_seconds=1)
+        histogram.record(10)
+
+        assert 1 <= histogram.percentile(100) <= 1.125
+
+    def test_cumulative_counts(self):
+        histogram = LatencyHistogram()
+        for duration in [0.000001, 0.0005, 0.002, 0.002, 5000]:
+            histogram.record(duration)
+
+        assert histogram.cumulative_counts([0.000004, 0.001024, 0.004096, 1.048576, 4000]) == [1, 2, 4, 4, 5]
+
+
+class TestFailsafeMetrics:
+
+    def test_counts_attempts_and_their_outcome(self):
+        metrics = FailsafeMetrics()
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=2), metrics=metrics)
+
+        loop.run_until_complete(failsafe.run(create_operation(ValueError(), 'result')))
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(create_operation(ValueError(), ValueError(), ValueError())))
+
+        assert metrics.attempts == 5
+        assert metrics.successes == 1
+        assert metrics.failures == 4
+        assert metrics.retries == 3
+        assert metrics.attempt_latency.count == 5
+
+    def test_counts_aborts(self):
+        metrics = FailsafeMetrics()
+        policy = RetryPolicy(allowed_retries=2, abortable_exceptions=[SomeAbortableException])
+        failsafe = Failsafe(retry_policy=policy, metrics=metrics)
+
+        with pytest.raises(SomeAbortableException):
+            loop.run_until_complete(failsafe.run(create_operation(SomeAbortableException())))
+
+        assert (metrics.attempts, metrics.aborts, metrics.failures, metrics.retries) == (1, 1, 0, 0)
+
+    def test_counts_circuit_rejections_and_transitions(self):
+        on_open = Mock()
+        metrics = FailsafeMetrics()
+        circuit_breaker = CircuitBreaker(maximum_failures=1, on_open=on_open)
+        failsafe = Failsafe(circuit_breaker=circuit_breaker, metrics=metrics)
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(create_operation(ValueError())))
+        with pytest.raises(CircuitOpen):
+            loop.run_until_complete(failsafe.run(create_operation('result')))
+        circuit_breaker.close()
+
+        assert metrics.circuit_rejections == 1
+        assert (metrics.circuit_opened, metrics.circuit_half_opened, metrics.circuit_closed) == (1, 0, 1)
+        on_open.assert_called_once_with()
+
+    def test_shared_circuit_breaker_is_observed_once_and_keeps_its_callbacks(self):
+        on_open = Mock()
+        metrics = FailsafeMetrics()
+        circuit_breaker = CircuitBreaker(on_open=on_open)
+        for _ in range(100):
+            Failsafe(circuit_breaker=circuit_breaker, metrics=metrics)
+
+        circuit_breaker.open()
+
+        assert metrics.circuit_opened == 1
+        assert len(circuit_breaker._transition_listeners) == 1
+        assert circuit_breaker.on_open is on_open
+
+    def test_collected_metrics_stop_observing(self):
+        circuit_breaker = CircuitBreaker()
+        FailsafeMetrics().observe_circuit_breaker(circuit_breaker)
+        gc.collect()
+
+        assert circuit_breaker._transition_listeners == ()
+
+
+class TestPrometheusText:
+
+    def test_exposition_format(self):
+        metrics = FailsafeMetrics(labels={'service': 'profile "v2"'})
+        metrics.attempts = 3
+        metrics.successes = 2
+        metrics.attempt_latency.record(0.003)
+        metrics.attempt_latency.record(0.5)
+
+        text = prometheus_text(metrics)
+
+        assert text.endswith('\n')
+        assert '# TYPE failsafe_attempts_total counter\n' in text
+        assert 'failsafe_attempts_total{service="profile \\"v2\\""} 3\n' in text
+        assert 'failsafe_successes_total{service="profile \\"v2\\""} 2\n' in text
+        assert '# TYPE failsafe_attempt_duration_seconds histogram\n' in text
+        assert 'failsafe_attempt_duration_seconds_bucket{service="profile \\"v2\\"",le="0.001024"} 0\n' in text
+        assert 'failsafe_attempt_duration_seconds_bucket{service="profile \\"v2\\"",le="0.004096"} 1\n' in text
+        assert 'failsafe_attempt_duration_seconds_bucket{service="profile \\"v2\\"",le="+Inf"} 2\n' in text
+        assert 'failsafe_attempt_duration_seconds_sum{service="profile \\"v2\\""} 0.503\n' in text
+        assert 'failsafe_attempt_duration_seconds_count{service="profile \\"v2\\""} 2\n' in text
+
+    def test_several_failsafes_share_metric_families(self):
+        text = prometheus_text([FailsafeMetrics(labels={'name': 'a'}), FailsafeMetrics(labels={'name': 'b'})],
+                               prefix='app')
+
+        assert text.count('# TYPE app_retries_total counter') == 1
+        assert 'app_retries_total{name="a"} 0\n' in text
+        assert 'app_retries_total{name="b"} 0\n' in text
+
+    def test_no_labels(self):
+        assert 'failsafe_aborts_total 0\n' in prometheus_text(FailsafeMetrics())
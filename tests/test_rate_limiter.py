@@ -0,0 +1,173 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+import unittest
+from unittest.mock import patch, Mock
+
+import pytest
+
+from failsafe import Failsafe, RateLimiter, RateLimitExceeded, RetryPolicy, CircuitBreaker
+
+loop = asyncio.get_event_loop()
+
+
+class TestRateLimiter:
+
+    def test_rate_must_be_positive(self):
+        with pytest.raises(ValueError):
+            RateLimiter(0)
+
+        with pytest.raises(ValueError):
+            RateLimiter(10, burst=0)
+
+    @patch('time.monotonic')
+    def test_allows_calls_at_rate(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        rate_limiter = RateLimiter(calls_per_second=10)
+
+        assert rate_limiter.try_acquire() is True
+        assert rate_limiter.try_acquire() is False
+
+        monotonic_mock.return_value = 100.1
+        assert rate_limiter.try_acquire() is True
+        assert rate_limiter.try_acquire() is False
+
+    @patch('time.monotonic')
+    def test_allows_bursts(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        rate_limiter = RateLimiter(calls_per_second=10, burst=3)
+
+        assert [rate_limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+        monotonic_mock.return_value = 100.1
+        assert [rate_limiter.try_acquire() for _ in range(2)] == [True, False]
+
+        monotonic_mock.return_value = 200
+        assert [rate_limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+    @patch('time.monotonic')
+    def test_rejected_calls_do_not_use_permits(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        rate_limiter = RateLimiter(calls_per_second=10)
+
+        rate_limiter.try_acquire()
+        for _ in range(10):
+            rate_limiter.try_acquire()
+
+        monotonic_mock.return_value = 100.1
+        assert rate_limiter.try_acquire() is True
+
+
+class TestRateLimiterAcquire(unittest.TestCase):
+
+    def test_rejects_immediately_by_default(self):
+        on_reject_mock = Mock()
+        rate_limiter = RateLimiter(calls_per_second=1, on_reject=on_reject_mock)
+
+        async def scenario():
+            await rate_limiter.acquire()
+            with pytest.raises(RateLimitExceeded):
+                await rate_limiter.acquire()
+
+        loop.run_until_complete(scenario())
+        assert on_reject_mock.call_count == 1
+
+    def test_waits_for_permit(self):
+        rate_limiter = RateLimiter(calls_per_second=50, max_wait_seconds=None)
+
+        async def scenario():
+            started_at = time.monotonic()
+            for _ in range(3):
+                await rate_limiter.acquire()
+            return time.monotonic() - started_at
+
+        assert loop.run_until_complete(scenario()) >= 0.039
+
+    def test_rejects_when_wait_is_too_long(self):
+        rate_limiter = RateLimiter(calls_per_second=10, max_wait_seconds=0.15)
+
+        async def scenario():
+            await rate_limiter.acquire()
+            await rate_limiter.acquire()
+            with pytest.raises(RateLimitExceeded):
+                await rate_limiter.acquire(max_wait_seconds=0.05)
+
+        loop.run_until_complete(scenario())
+
+    def test_cancelled_wait_gives_permit_back(self):
+        rate_limiter = RateLimiter(calls_per_second=10, max_wait_seconds=None)
+
+        async def scenario():
+            await rate_limiter.acquire()
+            waiting = asyncio.ensure_future(rate_limiter.acquire())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            started_at = time.monotonic()
+            await rate_limiter.acquire()
+            return time.monotonic() - started_at
+
+        assert loop.run_until_complete(scenario()) < 0.15
+
+
+class TestFailsafeWithRateLimiter(unittest.TestCase):
+
+    def test_retries_are_rate_limited(self):
+        rate_limiter = RateLimiter(calls_per_second=1, burst=2)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=5), rate_limiter=rate_limiter)
+        calls = []
+
+        async def operation():
+            calls.append(1)
+            raise ValueError()
+
+        with pytest.raises(RateLimitExceeded):
+            loop.run_until_complete(failsafe.run(operation))
+
+        assert len(calls) == 2
+
+    def test_open_circuit_does_not_use_permits(self):
+        rate_limiter = RateLimiter(calls_per_second=1)
+        circuit_breaker = CircuitBreaker()
+        circuit_breaker.open()
+        failsafe = Failsafe(circuit_breaker=circuit_breaker, rate_limiter=rate_limiter)
+
+        async def operation():
+            pass
+
+        with pytest.raises(Exception):
+            loop.run_until_complete(failsafe.run(operation))
+
+        assert rate_limiter.try_acquire() is True
+
+    def test_wait_for_permit_respects_timeout(self):
+        rate_limiter = RateLimiter(calls_per_second=1, max_wait_seconds=None)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=5), rate_limiter=rate_limiter,
+                            timeout_seconds=0.1)
+
+        async def operation():
+            raise ValueError()
+
+        with pytest.raises(RateLimitExceeded):
+            loop.run_until_complete(failsafe.run(operation))
+
+    def test_waiting_calls_succeed(self):
+        rate_limiter = RateLimiter(calls_per_second=100, max_wait_seconds=None)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1), rate_limiter=rate_limiter)
+
+        async def operation():
+            return 1
+
+        results = loop.run_until_complete(asyncio.gather(*[failsafe.run(operation) for _ in range(5)]))
+        assert results == [1] * 5
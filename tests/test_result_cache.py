@@ -0,0 +1,185 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from failsafe import Failsafe, ResultCache, RetryPolicy, CircuitBreaker, CircuitOpen, RetriesExhausted
+
+loop = asyncio.get_event_loop()
+
+
+def create_operation():
+    async def operation(*args, **kwargs):
+        operation.called += 1
+        if operation.fail:
+            raise ValueError()
+        return (args, kwargs, operation.called)
+
+    operation.called = 0
+    operation.fail = False
+    return operation
+
+
+class TestResultCache:
+
+    def test_parameters_are_validated(self):
+        with pytest.raises(ValueError):
+            ResultCache(ttl_seconds=0)
+
+        with pytest.raises(ValueError):
+            ResultCache(ttl_seconds=1, max_size=0)
+
+    @patch('time.monotonic')
+    def test_returns_fresh_result_until_ttl(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        cache = ResultCache(ttl_seconds=10)
+        failsafe = Failsafe(result_cache=cache)
+
+        assert loop.run_until_complete(failsafe.run(operation, 1)) == ((1,), {}, 1)
+        monotonic_mock.return_value = 109
+        assert loop.run_until_complete(failsafe.run(operation, 1)) == ((1,), {}, 1)
+        assert loop.run_until_complete(failsafe.run(operation, 2, flag=True)) == ((2,), {'flag': True}, 2)
+
+        monotonic_mock.return_value = 110
+        assert loop.run_until_complete(failsafe.run(operation, 1)) == ((1,), {}, 3)
+
+        assert (cache.hits, cache.misses, cache.stale) == (1, 3, 0)
+
+    @patch('time.monotonic')
+    def test_custom_key(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        failsafe = Failsafe(result_cache=ResultCache(ttl_seconds=10, key=lambda user_id, **kwargs: user_id))
+
+        loop.run_until_complete(failsafe.run(operation, 1, trace_id='a'))
+        loop.run_until_complete(failsafe.run(operation, 1, trace_id='b'))
+
+        assert operation.called == 1
+
+    @patch('time.monotonic')
+    def test_evicts_least_recently_used(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        cache = ResultCache(ttl_seconds=10, max_size=2)
+        failsafe = Failsafe(result_cache=cache)
+
+        for argument in [1, 2, 1, 3, 1, 2]:
+            loop.run_until_complete(failsafe.run(operation, argument))
+
+        assert len(cache) == 2
+        # 2 was evicted by 3 as 1 was used more recently
+        assert operation.called == 4
+
+    @patch('time.monotonic')
+    def test_failures_are_not_cached(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        operation.fail = True
+        cache = ResultCache(ttl_seconds=10)
+        failsafe = Failsafe(result_cache=cache)
+
+        for _ in range(2):
+            with pytest.raises(RetriesExhausted):
+                loop.run_until_complete(failsafe.run(operation))
+
+        assert operation.called == 2
+        assert len(cache) == 0
+
+    @patch('time.monotonic')
+    def test_stale_while_revalidate(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        cache = ResultCache(ttl_seconds=10, stale_while_revalidate_seconds=5)
+        failsafe = Failsafe(result_cache=cache)
+
+        async def scenario():
+            first = await failsafe.run(operation)
+            monotonic_mock.return_value = 112
+            stale = await asyncio.gather(failsafe.run(operation), failsafe.run(operation))
+            await asyncio.sleep(0)
+            refreshed = await failsafe.run(operation)
+            return first, stale, refreshed
+
+        first, stale, refreshed = loop.run_until_complete(scenario())
+
+        assert stale == [first, first]
+        assert refreshed == ((), {}, 2)
+        assert operation.called == 2
+        assert (cache.hits, cache.misses, cache.stale) == (1, 1, 2)
+
+    @patch('time.monotonic')
+    def test_result_older_than_stale_while_revalidate_is_not_returned(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        failsafe = Failsafe(result_cache=ResultCache(ttl_seconds=10, stale_while_revalidate_seconds=5))
+
+        loop.run_until_complete(failsafe.run(operation))
+        monotonic_mock.return_value = 115
+        assert loop.run_until_complete(failsafe.run(operation)) == ((), {}, 2)
+
+    @patch('time.monotonic')
+    def test_failed_background_refresh_keeps_stale_result(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        failsafe = Failsafe(result_cache=ResultCache(ttl_seconds=10, stale_while_revalidate_seconds=5))
+
+        async def scenario():
+            first = await failsafe.run(operation)
+            monotonic_mock.return_value = 112
+            operation.fail = True
+            await failsafe.run(operation)
+            await asyncio.sleep(0)
+            return first, await failsafe.run(operation)
+
+        first, stale = loop.run_until_complete(scenario())
+
+        assert stale == first
+        assert operation.called == 3
+
+    @patch('time.monotonic')
+    def test_stale_if_error(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        cache = ResultCache(ttl_seconds=10, stale_if_error_seconds=60)
+        failsafe = Failsafe(retry_policy=RetryPolicy(allowed_retries=1),
+                            circuit_breaker=CircuitBreaker(maximum_failures=2), result_cache=cache)
+
+        first = loop.run_until_complete(failsafe.run(operation))
+        operation.fail = True
+        monotonic_mock.return_value = 120
+
+        # retries exhausted, opening the circuit
+        assert loop.run_until_complete(failsafe.run(operation)) == first
+        # circuit open
+        assert loop.run_until_complete(failsafe.run(operation)) == first
+        assert operation.called == 3
+        assert (cache.hits, cache.misses, cache.stale) == (0, 3, 2)
+
+        monotonic_mock.return_value = 170
+        with pytest.raises(CircuitOpen):
+            loop.run_until_complete(failsafe.run(operation))
+
+    @patch('time.monotonic')
+    def test_stale_if_error_is_disabled_by_default(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        operation = create_operation()
+        failsafe = Failsafe(result_cache=ResultCache(ttl_seconds=10))
+
+        loop.run_until_complete(failsafe.run(operation))
+        operation.fail = True
+        monotonic_mock.return_value = 110
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(failsafe.run(operation))
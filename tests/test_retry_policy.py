@@ -10,9 +10,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from unittest.mock import patch, Mock
+
 import pytest
 from failsafe.failsafe import Context
-from failsafe.retry_policy import RetryPolicy, Delay, Backoff
+from failsafe.retry_policy import (
+    RetryPolicy, RetryBudget, Delay, Backoff, FullJitterBackoff, EqualJitterBackoff, DecorrelatedJitterBackoff,
+    get_retry_after, parse_retry_after,
+)
 
 from datetime import timedelta
 import random
@@ -114,3 +119,220 @@ class TestRetryPolicy:
 
         for i in range(1, 5):
             assert round(backoff.for_attempt(i), 3) <= 5.0
+
+    def test_seeded_backoff_is_reproducible(self):
+        first = Backoff(timedelta(seconds=1), timedelta(seconds=5), jitter=True, seed=42)
+        second = Backoff(timedelta(seconds=1), timedelta(seconds=5), jitter=True, seed=42)
+
+        random.seed(1)
+        first_waits = [first.for_attempt(i) for i in range(1, 5)]
+        random.seed(2)
+        second_waits = [second.for_attempt(i) for i in range(1, 5)]
+
+        assert first_waits == second_waits
+
+    def test_full_jitter(self):
+        backoff = FullJitterBackoff(timedelta(seconds=1), timedelta(seconds=5), seed=7)
+
+        with pytest.raises(ValueError):
+            backoff.for_attempt(0)
+
+        for attempt, cap in [(1, 1), (2, 2), (3, 4), (4, 5), (10, 5)]:
+            waits = [backoff.for_attempt(attempt) for _ in range(100)]
+            assert all(0 <= wait <= cap for wait in waits)
+            assert min(waits) < cap / 4
+
+    def test_equal_jitter(self):
+        backoff = EqualJitterBackoff(timedelta(seconds=1), timedelta(seconds=5), seed=7)
+
+        for attempt, cap in [(1, 1), (2, 2), (3, 4), (4, 5), (10, 5)]:
+            waits = [backoff.for_attempt(attempt) for _ in range(100)]
+            assert all(cap / 2 <= wait <= cap for wait in waits)
+
+    def test_decorrelated_jitter(self):
+        backoff = DecorrelatedJitterBackoff(timedelta(seconds=1), timedelta(seconds=20), seed=7)
+
+        with pytest.raises(ValueError):
+            backoff.for_attempt_after(0, None)
+
+        previous_delay = None
+        for attempt in range(1, 20):
+            wait = backoff.for_attempt_after(attempt, previous_delay)
+            assert 1 <= wait <= min(20, 3 * (previous_delay or 1))
+            previous_delay = wait
+
+    def test_decorrelated_jitter_is_reproducible(self):
+        waits = []
+        for _ in range(2):
+            backoff = DecorrelatedJitterBackoff(timedelta(seconds=1), timedelta(seconds=20), seed=3)
+            policy = RetryPolicy(allowed_retries=5, backoff=backoff)
+            context = Context()
+            for attempt in range(1, 6):
+                context.attempts = attempt
+                policy.should_retry(context, Exception())
+            waits.append(context.previous_delay)
+
+        assert waits[0] == waits[1]
+
+    def test_policy_passes_previous_delay_to_backoff(self):
+        backoff = Mock(wraps=Backoff(timedelta(seconds=1), timedelta(seconds=5)))
+        policy = RetryPolicy(allowed_retries=3, backoff=backoff)
+        context = Context()
+
+        for attempt in range(1, 4):
+            context.attempts = attempt
+            policy.should_retry(context, Exception())
+
+        assert [c[0] for c in backoff.for_attempt_after.call_args_list] == [(1, None), (2, 1.0), (3, 2.0)]
+
+
+class ThrottledError(Exception):
+
+    def __init__(self, retry_after_seconds):
+        super(ThrottledError, self).__init__()
+        self.retry_after_seconds = retry_after_seconds
+
+
+class TestRetryAfter:
+
+    def test_hint_is_read_from_the_exception(self):
+        assert get_retry_after(ThrottledError(3)) == 3
+        assert get_retry_after(ValueError()) is None
+
+    @patch('time.time')
+    def test_parse_retry_after_header(self, time_mock):
+        time_mock.return_value = 1445412480  # Wed, 21 Oct 2015 07:28:00 GMT
+        assert parse_retry_after('120') == 120
+        assert parse_retry_after(' 5 ') == 5
+        assert parse_retry_after('Wed, 21 Oct 2015 07:30:00 GMT') == 120
+        assert parse_retry_after('Wed, 21 Oct 2015 07:00:00 GMT') == 0
+        assert parse_retry_after('soon') is None
+        assert parse_retry_after('-1') is None
+        assert parse_retry_after(None) is None
+
+    def test_policy_waits_at_least_as_long_as_asked(self):
+        retry_policy = RetryPolicy(allowed_retries=3, backoff=Backoff(timedelta(seconds=1), timedelta(seconds=10)))
+        context = Context()
+        context.attempts = 1
+
+        assert retry_policy.should_retry(context, ThrottledError(30)) == (True, 30)
+        assert context.previous_delay == 30
+        context.attempts = 3
+        assert retry_policy.should_retry(context, ThrottledError(0.5)) == (True, 4)
+
+    def test_jittered_backoffs_honour_hints(self):
+        for backoff in [FullJitterBackoff(timedelta(seconds=1), timedelta(seconds=2), seed=1),
+                        EqualJitterBackoff(timedelta(seconds=1), timedelta(seconds=2), seed=1),
+                        DecorrelatedJitterBackoff(timedelta(seconds=1), timedelta(seconds=2), seed=1)]:
+            assert backoff.for_attempt_after(1, None, retry_after_seconds=20) == 20
+
+    def test_policy_does_not_retry_on_pushback(self):
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0)
+        budget.deposit()
+        retry_policy = RetryPolicy(allowed_retries=3, retry_budget=budget)
+        context = Context()
+        context.attempts = 1
+
+        assert retry_policy.should_retry(context, ThrottledError(-1)) == (False, None)
+        assert budget.tokens == 1
+
+    def test_policy_does_not_retry_when_asked_to_wait_too_long(self):
+        retry_policy = RetryPolicy(allowed_retries=3, max_retry_after_seconds=10)
+        context = Context()
+        context.attempts = 1
+
+        assert retry_policy.should_retry(context, ThrottledError(11)) == (False, None)
+        assert retry_policy.should_retry(context, ThrottledError(10)) == (True, 10)
+
+    def test_custom_backoffs_without_hints_still_work(self):
+        class CustomBackoff(Backoff):
+            def for_attempt_after(self, attempt, previous_delay):
+                return 1
+
+        retry_policy = RetryPolicy(backoff=CustomBackoff(timedelta(seconds=1), timedelta(seconds=1)))
+        context = Context()
+        context.attempts = 1
+
+        assert retry_policy.should_retry(context, Exception()) == (True, 1)
+
+
+class TestRetryBudget:
+
+    def test_successes_deposit_retries(self):
+        budget = RetryBudget(retry_ratio=0.5, min_retries_per_second=0)
+
+        assert budget.try_withdraw() is False
+        budget.deposit()
+        budget.deposit()
+        assert budget.try_withdraw() is True
+        assert budget.try_withdraw() is False
+
+    def test_deposits_are_capped(self):
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0, max_tokens=2)
+
+        for _ in range(10):
+            budget.deposit()
+
+        assert [budget.try_withdraw() for _ in range(3)] == [True, True, False]
+
+    def test_refunded_retries_can_be_withdrawn_again(self):
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0, max_tokens=1)
+        budget.deposit()
+
+        assert budget.try_withdraw() is True
+        budget.refund()
+        budget.refund()
+        assert [budget.try_withdraw() for _ in range(2)] == [True, False]
+
+    def test_fractional_deposits_add_up(self):
+        budget = RetryBudget(retry_ratio=0.1, min_retries_per_second=0)
+
+        for _ in range(10):
+            budget.deposit()
+
+        assert budget.try_withdraw() is True
+
+    @patch('time.monotonic')
+    def test_minimum_retries_per_second(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        budget = RetryBudget(retry_ratio=0, min_retries_per_second=2)
+
+        assert [budget.try_withdraw() for _ in range(3)] == [True, True, False]
+
+        monotonic_mock.return_value = 100.5
+        assert [budget.try_withdraw() for _ in range(2)] == [True, False]
+
+        monotonic_mock.return_value = 200
+        assert [budget.try_withdraw() for _ in range(3)] == [True, True, False]
+
+    def test_exhaustion_is_observable(self):
+        on_exhausted_mock = Mock()
+        budget = RetryBudget(min_retries_per_second=0, on_exhausted=on_exhausted_mock)
+
+        budget.try_withdraw()
+        budget.try_withdraw()
+
+        assert budget.exhausted_count == 2
+        assert on_exhausted_mock.call_count == 2
+
+    def test_policy_does_not_retry_when_budget_is_exhausted(self):
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0)
+        retry_policy = RetryPolicy(allowed_retries=3, retry_budget=budget)
+
+        context = Context()
+        context.attempts = 1
+
+        assert retry_policy.should_retry(context, Exception()) == (False, None)
+        budget.deposit()
+        assert retry_policy.should_retry(context, Exception()) == (True, 0)
+
+    def test_budget_is_not_used_when_exception_is_not_retriable(self):
+        budget = RetryBudget(retry_ratio=1, min_retries_per_second=0)
+        budget.deposit()
+        retry_policy = RetryPolicy(allowed_retries=3, retriable_exceptions=[BufferError], retry_budget=budget)
+
+        context = Context()
+        context.attempts = 1
+
+        assert retry_policy.should_retry(context, ValueError()) == (False, None)
+        assert budget.tokens == 1
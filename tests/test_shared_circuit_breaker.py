@@ -0,0 +1,149 @@
+# Copyright 2016 Skyscanner Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+from unittest.mock import patch, Mock
+
+import pytest
+
+from failsafe import Failsafe, SharedCircuitBreaker, CircuitOpen, RetriesExhausted
+from failsafe.shared_circuit_breaker import fcntl
+
+loop = asyncio.get_event_loop()
+
+pytestmark = pytest.mark.skipif(fcntl is None or not hasattr(os, 'fork'), reason="needs fcntl and fork")
+
+
+def run_in_child(function):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            function()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+class TestSharedCircuitBreaker:
+
+    def test_new_breaker_is_closed(self, tmpdir):
+        circuit_breaker = SharedCircuitBreaker(str(tmpdir.join('breaker')))
+
+        assert circuit_breaker.current_state == 'closed'
+        assert circuit_breaker.allows_execution() is True
+
+    def test_breakers_with_same_path_share_state(self, tmpdir):
+        path = str(tmpdir.join('breaker'))
+        first = SharedCircuitBreaker(path, maximum_failures=2)
+        second = SharedCircuitBreaker(path, maximum_failures=2)
+
+        first.record_failure()
+        second.record_failure()
+
+        assert first.current_state == 'open'
+        assert first.allows_execution() is False
+        assert second.is_open() is True
+
+    def test_success_resets_failures(self, tmpdir):
+        circuit_breaker = SharedCircuitBreaker(str(tmpdir.join('breaker')), maximum_failures=2)
+
+        circuit_breaker.record_failure()
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure()
+
+        assert circuit_breaker.current_state == 'closed'
+
+    @patch('time.monotonic')
+    def test_open_for_half_opens_every_process_at_the_hinted_time(self, monotonic_mock, tmpdir):
+        monotonic_mock.return_value = 100
+        path = str(tmpdir.join('breaker'))
+        on_open = Mock()
+        first = SharedCircuitBreaker(path, reset_timeout_seconds=60, on_open=on_open)
+        second = SharedCircuitBreaker(path, reset_timeout_seconds=60)
+
+        first.open_for(5)
+        first.open_for(2)
+        assert second.is_open() is True
+        on_open.assert_called_once_with()
+
+        monotonic_mock.return_value = 105.5
+        assert second.allows_execution() is True
+        assert first.current_state == 'half-open'
+
+    @patch('time.monotonic')
+    def test_processes_half_open_and_close_together(self, monotonic_mock, tmpdir):
+        monotonic_mock.return_value = 100
+        path = str(tmpdir.join('breaker'))
+        on_half_open = Mock()
+        first = SharedCircuitBreaker(path, maximum_failures=1, reset_timeout_seconds=10, half_open_ratio=0.5,
+                                     on_half_open=on_half_open)
+        second = SharedCircuitBreaker(path, maximum_failures=1, reset_timeout_seconds=10, half_open_ratio=0.5,
+                                      on_half_open=on_half_open)
+        first.record_failure()
+
+        monotonic_mock.return_value = 111
+        allowed = [breaker.allows_execution() for breaker in [first, second] * 50]
+        assert first.current_state == 'half-open'
+        assert on_half_open.call_count == 1
+        # the first call half opens the circuit, then the attempts of both breakers are counted together
+        assert allowed.count(True) == 50
+
+        second.record_success()
+        assert first.current_state == 'closed'
+
+    def test_failures_in_forked_worker_open_circuit(self, tmpdir):
+        circuit_breaker = SharedCircuitBreaker(str(tmpdir.join('breaker')), maximum_failures=4)
+
+        for _ in range(2):
+            run_in_child(lambda: [circuit_breaker.record_failure() for _ in range(2)])
+
+        assert circuit_breaker.current_state == 'open'
+
+    def test_lock_is_released_when_worker_dies(self, tmpdir):
+        circuit_breaker = SharedCircuitBreaker(str(tmpdir.join('breaker')), maximum_failures=1)
+
+        def die_holding_lock():
+            fcntl.flock(circuit_breaker._lock_fd(), fcntl.LOCK_EX)
+            os._exit(1)
+
+        run_in_child(die_holding_lock)
+        circuit_breaker.record_failure()
+
+        assert circuit_breaker.current_state == 'open'
+
+    def test_interrupted_update_keeps_previous_state(self, tmpdir):
+        circuit_breaker = SharedCircuitBreaker(str(tmpdir.join('breaker')), maximum_failures=3)
+        circuit_breaker.record_failure()
+
+        # an update writes the inactive record first, so garbage there is never read
+        inactive = 1 - circuit_breaker._map[0]
+        offset = 8 + inactive * 48
+        circuit_breaker._map[offset:offset + 20] = b'\xff' * 20
+
+        assert circuit_breaker.current_state == 'closed'
+        circuit_breaker.record_failure()
+        circuit_breaker.record_failure()
+        assert circuit_breaker.current_state == 'open'
+
+    def test_failsafe_with_shared_breaker(self, tmpdir):
+        async def operation():
+            raise ValueError()
+
+        path = str(tmpdir.join('breaker'))
+        first = Failsafe(circuit_breaker=SharedCircuitBreaker(path, maximum_failures=1))
+        second = Failsafe(circuit_breaker=SharedCircuitBreaker(path, maximum_failures=1))
+
+        with pytest.raises(RetriesExhausted):
+            loop.run_until_complete(first.run(operation))
+        with pytest.raises(CircuitOpen):
+            loop.run_until_complete(second.run(operation))